@@ -7,7 +7,9 @@ from celery.schedules import crontab
 
 from src.apps.accounts.tasks import fetch_sui_price, fetch_sui_usd_price_hourly
 from src.db.engine import init_db
+from src.db.redis import revoked_token_filter
 from src.celery_tasks import celery_app
+from src.utils.http import http_client
 from src.utils.logger import LOGGER
 from src.middleware import register_middleware
 from src.config.settings import Config
@@ -62,7 +64,10 @@ The API may have rate limits to prevent abuse. Please refer to the official Next
 async def life_span(app: FastAPI):
     LOGGER.info("Server is running")
     await init_db()
+    revoked_token_filter.start()
     yield
+    await revoked_token_filter.stop()
+    await http_client.close()
     LOGGER.info("Server has stopped")
 
 
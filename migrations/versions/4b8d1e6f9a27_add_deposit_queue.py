@@ -0,0 +1,39 @@
+"""add deposit queue
+
+Revision ID: 4b8d1e6f9a27
+Revises: e1f7a3c85d20
+Create Date: 2026-10-17 23:48:31.207415
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '4b8d1e6f9a27'
+down_revision: Union[str, None] = 'e1f7a3c85d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('deposit_queue',
+    sa.Column('userUid', sa.UUID(), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('enqueuedAt', postgresql.TIMESTAMP(), nullable=False),
+    sa.Column('availableAt', postgresql.TIMESTAMP(), nullable=False),
+    sa.ForeignKeyConstraint(['userUid'], ['users.uid'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('userUid')
+    )
+    with op.batch_alter_table('deposit_queue', schema=None) as batch_op:
+        batch_op.create_index('ix_deposit_queue_available_at', ['availableAt'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('deposit_queue', schema=None) as batch_op:
+        batch_op.drop_index('ix_deposit_queue_available_at')
+
+    op.drop_table('deposit_queue')
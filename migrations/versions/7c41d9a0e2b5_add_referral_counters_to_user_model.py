@@ -0,0 +1,51 @@
+"""add referral counters to user model
+
+Revision ID: 7c41d9a0e2b5
+Revises: ff8c709b8597
+Create Date: 2026-10-17 09:12:31.408215
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c41d9a0e2b5'
+down_revision: Union[str, None] = 'ff8c709b8597'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('paidReferrals', sa.BIGINT(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('referralsDeposit', sa.Numeric(scale=9), server_default='0', nullable=False))
+
+    # backfill the level 1 counters from the referral tree
+    op.execute("""
+        UPDATE users SET
+            "totalReferrals" = counters.referrals,
+            "paidReferrals" = counters.paid,
+            "referralsDeposit" = counters.deposit
+        FROM (
+            SELECT
+                referred.referrer_id,
+                count(*) AS referrals,
+                count(*) FILTER (WHERE stakings.deposit >= 1) AS paid,
+                coalesce(sum(stakings.deposit), 0) AS deposit
+            FROM users AS referred
+            LEFT JOIN user_stakings AS stakings ON stakings."userUid" = referred.uid
+            WHERE referred.referrer_id IS NOT NULL
+            GROUP BY referred.referrer_id
+        ) AS counters
+        WHERE users.uid = counters.referrer_id
+    """)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('referralsDeposit')
+        batch_op.drop_column('paidReferrals')
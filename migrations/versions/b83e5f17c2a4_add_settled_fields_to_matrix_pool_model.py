@@ -0,0 +1,34 @@
+"""add settled fields to matrix pool model
+
+Revision ID: b83e5f17c2a4
+Revises: 7c41d9a0e2b5
+Create Date: 2026-10-17 11:40:07.215903
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'b83e5f17c2a4'
+down_revision: Union[str, None] = '7c41d9a0e2b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('matrix_pool', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('settled', sa.Boolean(), server_default='false', nullable=False))
+        batch_op.add_column(sa.Column('settledAt', postgresql.TIMESTAMP(), nullable=True))
+
+    # pools that already ended were paid out by the old share task
+    op.execute('UPDATE matrix_pool SET settled = true, "settledAt" = "endDate" WHERE "endDate" < now()')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('matrix_pool', schema=None) as batch_op:
+        batch_op.drop_column('settledAt')
+        batch_op.drop_column('settled')
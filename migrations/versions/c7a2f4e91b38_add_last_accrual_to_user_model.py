@@ -0,0 +1,29 @@
+"""add last accrual to user model
+
+Revision ID: c7a2f4e91b38
+Revises: 4b8d1e6f9a27
+Create Date: 2026-10-18 00:04:12.581306
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7a2f4e91b38'
+down_revision: Union[str, None] = '4b8d1e6f9a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('lastAccrual', sa.DATE(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('lastAccrual')
@@ -0,0 +1,61 @@
+"""add referral closure table
+
+Revision ID: d5a2c90b41f3
+Revises: b83e5f17c2a4
+Create Date: 2026-10-17 14:05:52.630117
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a2c90b41f3'
+down_revision: Union[str, None] = 'b83e5f17c2a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('referral_closure',
+    sa.Column('ancestorUid', sa.UUID(), nullable=False),
+    sa.Column('descendantUid', sa.UUID(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestorUid'], ['users.uid'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendantUid'], ['users.uid'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestorUid', 'descendantUid')
+    )
+    with op.batch_alter_table('referral_closure', schema=None) as batch_op:
+        batch_op.create_index('ix_referral_closure_ancestor_depth', ['ancestorUid', 'depth'], unique=False)
+        batch_op.create_index('ix_referral_closure_descendant_depth', ['descendantUid', 'depth'], unique=False)
+
+    # backfill from the referrer_id chain, 19 levels deep like the referral records
+    op.execute("""
+        INSERT INTO referral_closure ("ancestorUid", "descendantUid", depth)
+        WITH RECURSIVE closure AS (
+            SELECT uid AS "ancestorUid", uid AS "descendantUid", 0 AS depth, referrer_id AS next FROM users
+            UNION ALL
+            SELECT closure.next, closure."descendantUid", closure.depth + 1, users.referrer_id
+            FROM closure JOIN users ON users.uid = closure.next
+            WHERE closure.depth < 19
+        )
+        SELECT "ancestorUid", "descendantUid", depth FROM closure
+    """)
+    op.execute("""
+        UPDATE users SET "totalNetwork" = network.members
+        FROM (
+            SELECT "ancestorUid", count(*) AS members FROM referral_closure WHERE depth >= 1 GROUP BY "ancestorUid"
+        ) AS network
+        WHERE users.uid = network."ancestorUid"
+    """)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('referral_closure', schema=None) as batch_op:
+        batch_op.drop_index('ix_referral_closure_descendant_depth')
+        batch_op.drop_index('ix_referral_closure_ancestor_depth')
+
+    op.drop_table('referral_closure')
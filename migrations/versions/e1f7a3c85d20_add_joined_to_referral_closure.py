@@ -0,0 +1,45 @@
+"""add joined to referral closure
+
+Revision ID: e1f7a3c85d20
+Revises: d5a2c90b41f3
+Create Date: 2026-10-17 16:22:18.904412
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1f7a3c85d20'
+down_revision: Union[str, None] = 'd5a2c90b41f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('referral_closure', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('joined', postgresql.TIMESTAMP(), nullable=True))
+
+    op.execute("""
+        UPDATE referral_closure SET joined = users.joined
+        FROM users WHERE users.uid = referral_closure."descendantUid"
+    """)
+
+    with op.batch_alter_table('referral_closure', schema=None) as batch_op:
+        batch_op.alter_column('joined', existing_type=postgresql.TIMESTAMP(), nullable=False)
+        batch_op.drop_index('ix_referral_closure_ancestor_depth')
+        batch_op.create_index(
+            'ix_referral_closure_ancestor_depth_joined',
+            ['ancestorUid', 'depth', 'joined', 'descendantUid'],
+            unique=False,
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('referral_closure', schema=None) as batch_op:
+        batch_op.drop_index('ix_referral_closure_ancestor_depth_joined')
+        batch_op.create_index('ix_referral_closure_ancestor_depth', ['ancestorUid', 'depth'], unique=False)
+        batch_op.drop_column('joined')
@@ -1,6 +1,7 @@
 from contextlib import asynccontextmanager
 from src.apps.accounts.tasks import fetch_sui_price
 from src.db.engine import init_db
+from src.db.redis import revoked_token_filter
 from src.utils.logger import LOGGER
 from src.middleware import register_middleware
 from src.config.settings import Config
@@ -56,7 +57,9 @@ async def life_span(app: FastAPI):
     LOGGER.info("Server is running")
     await init_db()
     await fetch_sui_price()
+    revoked_token_filter.start()
     yield
+    await revoked_token_filter.stop()
     LOGGER.info("Server has stopped")
 
 
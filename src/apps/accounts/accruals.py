@@ -0,0 +1,142 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlmodel import or_, select
+
+from src.apps.accounts.models import User, UserStaking, UserWallet
+from src.config.settings import Config
+from src.db.bulk import bulk_update
+from src.db.engine import get_session_context
+from src.db.redis import get_sui_usd_price
+from src.db.streaming import stream_keyset
+from src.utils.calculations import classify_ranks
+from src.utils.logger import LOGGER
+
+ROI_CAP = Decimal("0.04")
+ROI_STEP = Decimal("0.005")
+
+
+class DailyAccrual:
+    """
+    Bulk daily rank and ROI accrual. The sui/usd price is read once, the users'
+    inputs are streamed in chunks of `chunkSize` from a projection query (no ORM
+    graphs, no per user referral query) and each chunk is written back with
+    `UPDATE ... FROM (VALUES ...)` statements, so memory stays bounded by the chunk.
+    The whole run is still one transaction, a failed run accrues nobody. Every user
+    accrued gets the day in `lastAccrual` and is skipped by another run that day.
+    """
+
+    def __init__(self, chunkSize: Optional[int] = None) -> None:
+        self.chunkSize = chunkSize or Config.BULK_WRITE_CHUNK_SIZE
+
+    def _query(self, today: date):
+        return (
+            select(
+                User.uid,
+                User.rank,
+                User.totalTeamVolume,
+                User.totalReferrals,
+                User.lastRankEarningAddedAt,
+                UserWallet.totalDeposit,
+                UserStaking.roi,
+                UserStaking.deposit,
+                UserStaking.start,
+                UserStaking.end,
+                UserStaking.nextRoiIncrease,
+            )
+            .join(UserWallet, UserWallet.userUid == User.uid)
+            .join(UserStaking, UserStaking.userUid == User.uid)
+            .where(User.isBlocked == False)
+            .where(or_(User.lastAccrual == None, User.lastAccrual < today))
+        )
+
+    def accrue(self, row, rankEarning: Decimal, rank: Optional[str], now: datetime):
+        """Works out the user, wallet and stake writes for one projected user row"""
+        user = {
+            "uid": row.uid,
+            "rank": row.rank,
+            "lastRankEarningAddedAt": row.lastRankEarningAddedAt,
+            "lastAccrual": now.date(),
+        }
+        wallet = {
+            "userUid": row.uid,
+            "weeklyRankEarnings": rankEarning,
+            "earnings": Decimal(0),
+            "totalRankBonus": Decimal(0),
+            "expectedRankBonus": Decimal(0),
+        }
+        stake = {}
+
+        # ######### RANK EARNING ########## #
+        if row.rank != rank:
+            user["rank"] = rank
+
+        if now.date() == row.lastRankEarningAddedAt.date():
+            wallet["earnings"] += rankEarning
+            wallet["totalRankBonus"] += rankEarning
+            wallet["expectedRankBonus"] += rankEarning
+            user["lastRankEarningAddedAt"] = now + timedelta(days=7)
+
+        # ########## ROI AND INTEREST ########## #
+        roi, end, nextRoiIncrease = row.roi, row.end, row.nextRoiIncrease
+
+        # accrue interest until it reaches 4% then create the end date to be 100 days in the future
+        if (
+            end is None
+            and row.start is not None
+            and roi < ROI_CAP
+            and nextRoiIncrease is not None
+            and nextRoiIncrease <= now
+        ):
+            roi += ROI_STEP
+            nextRoiIncrease = now + timedelta(days=5)
+        elif end is None and row.start is not None and roi >= ROI_CAP:
+            end = now + timedelta(days=100)
+
+        if row.start is not None:
+            wallet["earnings"] += row.deposit * roi
+
+        if end is not None and end.date() == now.date():
+            roi, end, nextRoiIncrease = Decimal(0), None, None
+
+        if (roi, end, nextRoiIncrease) != (row.roi, row.end, row.nextRoiIncrease):
+            stake = {"userUid": row.uid, "roi": roi, "end": end, "nextRoiIncrease": nextRoiIncrease}
+
+        return user, wallet, stake
+
+    async def run(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.now()
+        usd_price = await get_sui_usd_price()
+
+        checked = rankUpdates = stakeUpdates = 0
+        async with get_session_context() as session:
+            async for rows in stream_keyset(self._query(now.date()), User.uid, session, self.chunkSize):
+                users: List[dict] = []
+                wallets: List[dict] = []
+                stakes: List[dict] = []
+                rankEarnings, ranks = classify_ranks(
+                    [row.totalTeamVolume for row in rows],
+                    [row.totalDeposit for row in rows],
+                    [int(row.totalReferrals) for row in rows],
+                    usd_price,
+                )
+                for row, rankEarning, rank in zip(rows, rankEarnings, ranks):
+                    user, wallet, stake = self.accrue(row, rankEarning, rank, now)
+                    users.append(user)
+                    rankUpdates += user["rank"] != row.rank
+                    wallets.append(wallet)
+                    if stake:
+                        stakes.append(stake)
+
+                await bulk_update(session, User, "uid", users)
+                await bulk_update(
+                    session, UserWallet, "userUid", wallets, increments=("earnings", "totalRankBonus", "expectedRankBonus")
+                )
+                await bulk_update(session, UserStaking, "userUid", stakes)
+                checked += len(rows)
+                stakeUpdates += len(stakes)
+            await session.commit()
+
+        LOGGER.info(f"Daily accrual: {checked} users, {rankUpdates} rank updates, {stakeUpdates} stake updates")
+        return checked
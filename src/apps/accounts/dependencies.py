@@ -6,9 +6,11 @@ from fastapi import Depends, Request
 from fastapi.security import HTTPBearer, OAuth2PasswordBearer, HTTPAuthorizationCredentials
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from src.apps.accounts.loaders import AUTH, PROFILE_VIEW
 from src.apps.accounts.models import User
+from src.apps.accounts.schemas import AuthPrincipal
 from src.db.engine import get_session
-from src.db.redis import token_in_blocklist
+from src.db.redis import cache_auth_principal, get_cached_auth_principal, token_in_blocklist
 from src.utils.hashing import decodeAccessToken
 from src.errors import AccessTokenRequired, InsufficientPermission, InvalidAuthenticationScheme, RefreshTokenRequired, RevokedToken, UnAuthorizedAccess, UserBlocked, UserNotFound
 from src.utils.logger import LOGGER
@@ -53,30 +55,57 @@ class RefreshTokenBearer(TokenBearer):
         return None
 
 
-async def get_current_user(token_data: Annotated[dict, Depends(AccessTokenBearer())], session: db_dependency) -> Optional[User]:
+async def get_current_principal(
+    token_data: Annotated[dict, Depends(AccessTokenBearer())], session: db_dependency
+) -> AuthPrincipal:
+    """
+    The authenticated user as an `AuthPrincipal`, served from redis for `AUTH_PRINCIPAL_EXPIRY` seconds
+    so most requests never reach the database on the auth path. Only the identity and permission
+    fields are cached, and the cache is dropped whenever they are written.
+    """
     userId = token_data["user"]["userId"]
     if userId is None:
         raise UnAuthorizedAccess()
 
-    db_result = await session.exec(select(User).where(User.userId == str(userId)))
+    cached = await get_cached_auth_principal(str(userId))
+    if cached is not None:
+        principal = AuthPrincipal.model_validate(cached)
+    else:
+        db_result = await session.exec(select(User).options(*AUTH).where(User.userId == str(userId)))
+        user = db_result.first()
+
+        if user is None:
+            raise UserNotFound()
+
+        principal = AuthPrincipal.model_validate(user)
+        await cache_auth_principal(principal.userId, principal.model_dump(mode="json"))
+
+    if principal.isBlocked:
+        raise UserBlocked()
+
+    return principal
+
+
+async def get_current_user(
+    principal: Annotated[AuthPrincipal, Depends(get_current_principal)], session: db_dependency
+) -> Optional[User]:
+    """The authenticated user as an ORM object, for endpoints that render or write to it"""
+    db_result = await session.exec(select(User).options(*PROFILE_VIEW).where(User.uid == principal.uid))
     user = db_result.first()
 
     if user is None:
         raise UserNotFound()
 
-    if user.isBlocked:
-        raise UserBlocked()
-
     return user
 
 
 async def user_exists_check(userId: str, session: db_dependency) -> Optional[User]:
-    db_result = await session.exec(select(User).where(User.userId == str(userId)))
+    db_result = await session.exec(select(User).options(*PROFILE_VIEW).where(User.userId == str(userId)))
     user = db_result.first()
     return user
 
 
-async def admin_permission_check(auth_user: Annotated[User, Depends(get_current_user)]) -> User:
+async def admin_permission_check(auth_user: Annotated[AuthPrincipal, Depends(get_current_principal)]) -> AuthPrincipal:
     if not auth_user.isAdmin or not auth_user.isSuperuser:
         raise InsufficientPermission()
     if auth_user.isBlocked:
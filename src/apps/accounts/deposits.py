@@ -0,0 +1,409 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import AsyncIterable, Awaitable, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import sqlalchemy.dialects.postgresql as pg
+from sqlalchemy import delete, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.apps.accounts.loaders import WALLET_OPS
+from src.apps.accounts.models import DepositQueue, User, UserWallet
+from src.apps.accounts.schemas import DepositSweepStats
+from src.apps.accounts.services import UserServices
+from src.celery_tasks import celery_app
+from src.config.settings import Config
+from src.db.engine import get_session_context, pool_capacity
+from src.db.redis import (
+    add_wallet_addresses,
+    claim_deposit,
+    filter_wallet_addresses,
+    get_balance_snapshots,
+    get_deposit_checkpoint,
+    mark_wallet_addresses_loaded,
+    release_deposit,
+    set_balance_snapshots,
+    set_deposit_checkpoint,
+    wallet_addresses_loaded,
+)
+from src.db.streaming import stream_keyset
+from src.utils.logger import LOGGER
+from src.utils.sui_json_rpc_apis import SUI, SUIRequests
+
+SUI_COIN_TYPE = "0x2::sui::SUI"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list of values"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(q * len(values)))
+    return values[index]
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def enqueue_deposits(session: AsyncSession, userUids: List[uuid.UUID]) -> int:
+    """
+    Queues the users for their wallet balance to be staked in the caller's transaction and returns
+    how many were added. A user already waiting in the queue keeps their entry.
+    """
+    if not userUids:
+        return 0
+    now = datetime.utcnow()
+    db_result = await session.execute(
+        pg.insert(DepositQueue)
+        .values([
+            {"userUid": userUid, "attempts": 0, "enqueuedAt": now, "availableAt": now}
+            for userUid in userUids
+        ])
+        .on_conflict_do_nothing(index_elements=["userUid"])
+    )
+    return db_result.rowcount
+
+
+def process_deposit_queue_later() -> None:
+    """Asks a worker to drain the deposit queue"""
+    try:
+        celery_app.send_task("run_process_deposit_queue")
+    except Exception as e:
+        # the beat schedule drains the queue anyway
+        LOGGER.error(f"Could not schedule the deposit queue: {e}")
+    return None
+
+
+class DepositQueueWorker:
+    """
+    Drains the deposit queue. `concurrency` claimers each lock the next available entry with
+    `FOR UPDATE SKIP LOCKED`, stake its user in the same transaction and delete the entry when
+    the stake commits, so any number of workers can drain the queue side by side without two of
+    them ever crediting the same user at once. The balance staked is read when the entry is
+    claimed, not when it was queued. An entry whose stake fails, or whose balance can't be read,
+    is rolled back and retried later, up to `maxAttempts` times. Every claimer holds a connection
+    across its transfer, so there are never more claimers than the process's pool can hold.
+    """
+
+    def __init__(
+        self, concurrency: Optional[int] = None, maxClaims: Optional[int] = None, maxAttempts: Optional[int] = None
+    ) -> None:
+        self.concurrency = min(concurrency or Config.DEPOSIT_QUEUE_CONCURRENCY, pool_capacity(Config.PROCESS_ROLE))
+        self.maxClaims = maxClaims or Config.DEPOSIT_QUEUE_MAX_CLAIMS
+        self.maxAttempts = maxAttempts or Config.DEPOSIT_QUEUE_MAX_ATTEMPTS
+        self.user_services = UserServices()
+
+    def _claim(self):
+        return (
+            select(DepositQueue)
+            .where(DepositQueue.availableAt <= datetime.utcnow())
+            .order_by(DepositQueue.availableAt)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+
+    async def _retry_later(self, userUid: uuid.UUID, attempts: int, session: AsyncSession) -> None:
+        delay = timedelta(seconds=Config.DEPOSIT_QUEUE_RETRY_DELAY * 2 ** attempts)
+        attempts += 1
+        if attempts >= self.maxAttempts:
+            # the next sweep queues the user again if the deposit is still there
+            LOGGER.error(f"Deposit queue gave up on {userUid} after {attempts} attempts")
+            await session.execute(delete(DepositQueue).where(DepositQueue.userUid == userUid))
+        else:
+            await session.execute(
+                update(DepositQueue)
+                .where(DepositQueue.userUid == userUid)
+                .values(attempts=attempts, availableAt=datetime.utcnow() + delay)
+            )
+        await session.commit()
+        return None
+
+    async def process_one(self) -> Optional[bool]:
+        """Claims and stakes the next entry, None when nothing is available, else whether it staked"""
+        async with get_session_context() as session:
+            db_result = await session.exec(self._claim())
+            entry = db_result.first()
+            if entry is None:
+                return None
+            userUid, attempts = entry.userUid, entry.attempts
+
+            # deleted in the stake's transaction, a rolled back stake puts the entry back
+            await session.execute(delete(DepositQueue).where(DepositQueue.userUid == userUid))
+            db_result = await session.exec(select(User).options(*WALLET_OPS).where(User.uid == userUid))
+            user = db_result.first()
+            if user is None or user.isBlocked:
+                await session.commit()
+                return False
+
+            if await self.user_services.stake_sui(user, session):
+                return True
+
+            # either there was nothing to stake and the entry delete is still pending, or the
+            # stake or its balance lookup failed, rolling the delete back for another attempt
+            if session.in_transaction():
+                await session.commit()
+            else:
+                await self._retry_later(userUid, attempts, session)
+            return False
+
+    async def drain(self) -> int:
+        """Stakes queued deposits until the queue is empty or `maxClaims` were claimed, returns the stakes"""
+        claims = 0
+        staked = 0
+
+        async def worker():
+            nonlocal claims, staked
+            while claims < self.maxClaims:
+                claims += 1
+                try:
+                    result = await self.process_one()
+                except Exception as e:
+                    LOGGER.error(f"Deposit queue failed to process an entry: {e}")
+                    continue
+                if result is None:
+                    return
+                staked += result
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+        LOGGER.info(f"Deposit queue: {staked} deposits staked")
+        return staked
+
+
+class DepositPoller:
+    """
+    Deposit sweep engine. Wallet balances are looked up in JSON-RPC batches of
+    `batchSize` addresses, the batches are fanned out over a bounded number of
+    concurrent workers and every user with a deposit is put on the deposit queue,
+    one insert per batch, for the `DepositQueueWorker` to stake. Balances are
+    compared against the wallet balance snapshots in redis first, so only wallets
+    whose balance moved since the last sweep ever touch the database.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, batchSize: Optional[int] = None) -> None:
+        self.concurrency = concurrency or Config.DEPOSIT_SWEEP_CONCURRENCY
+        self.batchSize = batchSize or Config.SUI_RPC_BATCH_SIZE
+
+    async def _enqueue(self, userUids: List[uuid.UUID]) -> int:
+        if not userUids:
+            return 0
+        async with get_session_context() as session:
+            queued = await enqueue_deposits(session, userUids)
+            await session.commit()
+        return queued
+
+    async def sweep(
+        self,
+        pages: AsyncIterable[Sequence[Tuple[uuid.UUID, str]]],
+        pageDone: Optional[Callable[[Sequence], Awaitable]] = None,
+    ) -> DepositSweepStats:
+        """
+        Poll every `(userUid, address)` pair of every page and queue the ones holding a deposit for
+        staking. The pages are split into batches that all workers pull from, and `pageDone(page)`
+        is awaited once every batch of a page and of the pages before it was handled.
+        """
+        stats = DepositSweepStats()
+        latencies: List[float] = []
+        # the pages being polled in stream order, each with the number of its batches not done yet
+        inFlight: Deque[dict] = deque()
+        pull = asyncio.Lock()
+        advance = asyncio.Lock()
+
+        async def batches():
+            async for page in pages:
+                chunks = list(chunked(page, self.batchSize))
+                tracker = {"page": page, "batches": len(chunks)}
+                inFlight.append(tracker)
+                for chunk in chunks:
+                    yield tracker, chunk
+
+        pending = batches()
+
+        async def next_batch():
+            async with pull:
+                return await anext(pending, None)
+
+        async def done(tracker: dict) -> None:
+            tracker["batches"] -= 1
+            # pages are reported in stream order, a page waits for every page before it
+            async with advance:
+                while inFlight and inFlight[0]["batches"] == 0:
+                    page = inFlight.popleft()["page"]
+                    if pageDone is not None:
+                        await pageDone(page)
+
+        try:
+            checkpoint = await SUI.getLatestCheckpoint()
+        except Exception as e:
+            LOGGER.error(f"Deposit sweep could not read the latest checkpoint: {e}")
+            checkpoint = None
+
+        async def worker():
+            # every worker pulls from the same stream so at most `concurrency`
+            # batches are in flight regardless of how many wallets there are
+            while (batch := await next_batch()) is not None:
+                tracker, chunk = batch
+                stats.users += len(chunk)
+                started = time.perf_counter()
+                addresses = [address for _, address in chunk]
+                balances = await SUI.getBalances(addresses)
+                latencies.append(time.perf_counter() - started)
+                snapshots = await get_balance_snapshots(addresses)
+                emptied: Dict[str, Decimal] = {}
+                deposits: List[uuid.UUID] = []
+
+                for userUid, address in chunk:
+                    balance = balances.get(address)
+                    if balance is None:
+                        stats.failedLookups += 1
+                        continue
+
+                    amount = Decimal(balance.totalBalance) / 10**9
+                    snapshot = snapshots.get(address)
+                    if snapshot is not None and Decimal(snapshot["balance"]) == amount:
+                        stats.unchanged += 1
+                        continue
+                    if not amount:
+                        emptied[address] = amount
+                        continue
+
+                    # the worker reads the balance again when it stakes and claims the new snapshot
+                    deposits.append(userUid)
+
+                await set_balance_snapshots(emptied, checkpoint)
+                try:
+                    stats.deposits += await self._enqueue(deposits)
+                except Exception as e:
+                    LOGGER.error(f"Deposit sweep failed to queue {len(deposits)} deposits: {e}")
+                    stats.failedStakes += len(deposits)
+                await done(tracker)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        stats.elapsed = time.perf_counter() - started
+        if stats.deposits:
+            process_deposit_queue_later()
+
+        latencies.sort()
+        stats.usersPerSecond = stats.users / stats.elapsed if stats.elapsed else 0.0
+        stats.p50Latency = percentile(latencies, 0.50)
+        stats.p99Latency = percentile(latencies, 0.99)
+
+        LOGGER.info(
+            f"Deposit sweep: {stats.users} users in {stats.elapsed:.2f}s "
+            f"({stats.usersPerSecond:.1f} users/s, p50 batch lookup {stats.p50Latency * 1000:.0f}ms, "
+            f"p99 {stats.p99Latency * 1000:.0f}ms), {stats.unchanged} unchanged, {stats.deposits} deposits queued, "
+            f"{stats.failedLookups} failed lookups, {stats.failedStakes} failed to queue"
+        )
+        return stats
+
+
+class DepositIngester:
+    """
+    Event driven deposit detection. Every run tails the checkpoint stream from one cursor kept in
+    redis, loads the balance changes of the transactions in them and picks out positive SUI balance
+    changes on our custodial wallet addresses, matched against the wallet address set in redis, so
+    the RPC cost follows the chain's transaction volume and not the number of users. Every deposit
+    is enqueued exactly once: its digest is claimed in redis before it is queued, released if the
+    queue write fails, and the cursor only moves past checkpoints whose deposits are queued. Pass a
+    `SUIRequests` pointed at a fake node to replay recorded checkpoints.
+    """
+
+    def __init__(
+        self, sui: SUIRequests = SUI, batchSize: Optional[int] = None, maxCheckpoints: Optional[int] = None
+    ) -> None:
+        self.sui = sui
+        self.batchSize = batchSize or Config.DEPOSIT_INGEST_CHECKPOINT_BATCH
+        self.maxCheckpoints = maxCheckpoints or Config.DEPOSIT_INGEST_MAX_CHECKPOINTS
+
+    async def _load_wallet_addresses(self) -> None:
+        """Fills the wallet address set from the database once, registration adds new wallets to it"""
+        if await wallet_addresses_loaded():
+            return None
+        async for rows in stream_keyset(select(UserWallet.address), UserWallet.address):
+            await add_wallet_addresses([row.address for row in rows])
+        await mark_wallet_addresses_loaded()
+        return None
+
+    @staticmethod
+    def _incoming(transactions: List[dict]) -> List[Tuple[str, str]]:
+        """`(digest, address)` of every positive SUI balance change owned by an address"""
+        incoming = []
+        for transaction in transactions:
+            for change in transaction.get("balanceChanges") or []:
+                owner = change.get("owner")
+                if not isinstance(owner, dict) or "AddressOwner" not in owner:
+                    continue
+                if change.get("coinType") == SUI_COIN_TYPE and int(change["amount"]) > 0:
+                    incoming.append((transaction["digest"], owner["AddressOwner"]))
+        return incoming
+
+    async def _enqueue(self, claimed: List[Tuple[str, str]]) -> int:
+        if not claimed:
+            return 0
+        try:
+            async with get_session_context() as session:
+                db_result = await session.exec(
+                    select(UserWallet.userUid).where(UserWallet.address.in_({address for _, address in claimed}))
+                )
+                await enqueue_deposits(session, list(set(db_result.all())))
+                await session.commit()
+        except Exception:
+            for digest, address in claimed:
+                await release_deposit(digest, address)
+            raise
+        return len(claimed)
+
+    async def run(self) -> int:
+        """Ingest the checkpoints since the cursor and return the number of deposits enqueued"""
+        await self._load_wallet_addresses()
+
+        cursor = await get_deposit_checkpoint()
+        if cursor is None:
+            # start at the tip, the reconciliation sweep picks up anything older
+            await set_deposit_checkpoint(await self.sui.getLatestCheckpoint())
+            return 0
+
+        enqueued = 0
+        ingested = 0
+        while ingested < self.maxCheckpoints:
+            page = await self.sui.getCheckpoints(cursor, self.batchSize)
+            checkpoints = page["data"]
+            if not checkpoints:
+                break
+
+            digests = [digest for checkpoint in checkpoints for digest in checkpoint["transactions"]]
+            transactions = await self.sui.getTransactionBalanceChanges(digests)
+            if any(transaction is None for transaction in transactions):
+                # leave the cursor where it is so the page is retried on the next run
+                raise Exception(f"Could not load every transaction after checkpoint {cursor}")
+
+            incoming = self._incoming(transactions)
+            ours = set(await filter_wallet_addresses(list({address for _, address in incoming})))
+            claimed = [
+                (digest, address) for digest, address in incoming
+                if address in ours and await claim_deposit(digest, address)
+            ]
+            enqueued += await self._enqueue(claimed)
+
+            cursor = int(checkpoints[-1]["sequenceNumber"])
+            await set_deposit_checkpoint(cursor)
+            ingested += len(checkpoints)
+            if not page.get("hasNextPage"):
+                break
+
+        if enqueued:
+            process_deposit_queue_later()
+        LOGGER.info(f"Deposit ingester: {ingested} checkpoints up to {cursor}, {enqueued} deposits enqueued")
+        return enqueued
@@ -0,0 +1,23 @@
+from sqlalchemy.orm import joinedload, selectinload
+
+from src.apps.accounts.models import User
+
+# Loader profiles for `User` queries, used as `select(User).options(*PROFILE_VIEW)`.
+# Every relationship on `User` is `lazy="raise"`, so a query only loads what its profile names
+# and touching anything else fails loudly instead of emitting a query per user. The unbounded
+# `activities` and `pendingTransactions` collections are in no profile, query them directly.
+
+# permission checks and lookups that only read the user row
+AUTH = ()
+
+# deposits, staking and withdrawals on a single user, one joined query
+WALLET_OPS = (joinedload(User.wallet), joinedload(User.staking))
+
+# a single user rendered as `UserRead`
+PROFILE_VIEW = (joinedload(User.wallet), joinedload(User.staking), selectinload(User.referrer))
+
+# pages of users rendered as `UserRead`, one IN query per relationship for the whole page
+ADMIN_LIST = (selectinload(User.wallet), selectinload(User.staking), selectinload(User.referrer))
+
+# batch jobs over many users that write to their wallet and stake rows
+BATCH_JOB = (selectinload(User.wallet), selectinload(User.staking))
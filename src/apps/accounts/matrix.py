@@ -0,0 +1,133 @@
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import insert, literal, update
+from sqlalchemy.orm import noload
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.apps.accounts.enum import ActivityType
+from src.apps.accounts.models import Activities, MatrixPool, MatrixPoolUsers, User, UserWallet
+from src.db.engine import get_session_context
+from src.utils.logger import LOGGER
+
+
+class MatrixPoolSettlement:
+    """
+    Matrix pool share calculation and payout. Every participant's share of a pool is
+    `referralsAdded` over the referrals added by everyone in the pool, and is worked out
+    for the whole pool in one `UPDATE`. Once a pool ends it is settled in a single
+    transaction: the earnings are credited to every participant's wallet with one
+    `UPDATE ... FROM`, a payout activity is inserted per participant and the pool is
+    marked as settled, with the pool row locked so a pool is only ever paid out once.
+    """
+
+    async def _update_shares(self, pool: MatrixPool, session: AsyncSession) -> int:
+        db_result = await session.exec(
+            select(func.coalesce(func.sum(MatrixPoolUsers.referralsAdded), 0))
+            .where(MatrixPoolUsers.matrixPoolUid == pool.uid)
+        )
+        totalReferrals = int(db_result.one())
+        if not totalReferrals:
+            return 0
+
+        await session.execute(
+            update(MatrixPoolUsers)
+            .where(MatrixPoolUsers.matrixPoolUid == pool.uid)
+            .values(
+                matrixShare=func.round(MatrixPoolUsers.referralsAdded * Decimal(100) / totalReferrals, 2),
+                matrixEarninig=MatrixPoolUsers.referralsAdded * pool.raisedPoolAmount / totalReferrals,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        return totalReferrals
+
+    async def _credit_wallets(self, pool: MatrixPool, now: datetime, session: AsyncSession) -> int:
+        payouts = (
+            select(User.uid.label("userUid"), func.sum(MatrixPoolUsers.matrixEarninig).label("earning"))
+            .join(User, User.userId == MatrixPoolUsers.userId)
+            .where(MatrixPoolUsers.matrixPoolUid == pool.uid)
+            .group_by(User.uid)
+            .having(func.sum(MatrixPoolUsers.matrixEarninig) > 0)
+            .subquery()
+        )
+
+        result = await session.execute(
+            update(UserWallet)
+            .where(UserWallet.userUid == payouts.c.userUid)
+            .values(
+                earnings=UserWallet.earnings + payouts.c.earning,
+                availableReferralEarning=UserWallet.availableReferralEarning + payouts.c.earning,
+                totalReferralEarnings=UserWallet.totalReferralEarnings + payouts.c.earning,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        await session.execute(
+            insert(Activities).from_select(
+                ["uid", "activityType", "strDetail", "suiAmount", "userUid", "created"],
+                select(
+                    func.gen_random_uuid(),
+                    literal(ActivityType.MATRIXPOOL, Activities.__table__.c.activityType.type),
+                    literal("GMP Payout"),
+                    payouts.c.earning,
+                    payouts.c.userUid,
+                    literal(now),
+                ),
+            )
+        )
+        return result.rowcount
+
+    async def settle(self, poolUid: uuid.UUID, now: Optional[datetime] = None) -> int:
+        """Pays out an ended pool and returns the number of wallets credited, 0 if it was already settled"""
+        now = now or datetime.now()
+        async with get_session_context() as session:
+            # the participants are settled with set based statements, never loaded through `users`
+            db_result = await session.exec(
+                select(MatrixPool)
+                .options(noload(MatrixPool.users))
+                .where(MatrixPool.uid == poolUid)
+                .where(MatrixPool.settled == False)
+                .with_for_update(skip_locked=True)
+            )
+            pool = db_result.first()
+            if pool is None:
+                return 0
+
+            credited = 0
+            if await self._update_shares(pool, session):
+                credited = await self._credit_wallets(pool, now, session)
+
+            pool.settled = True
+            pool.settledAt = now
+            await session.commit()
+
+        LOGGER.info(f"Settled matrix pool {poolUid}: {credited} wallets credited")
+        return credited
+
+    async def run(self, now: Optional[datetime] = None) -> int:
+        """Refreshes the shares of the active pool and settles every pool that has ended"""
+        now = now or datetime.now()
+        async with get_session_context() as session:
+            db_result = await session.exec(
+                select(MatrixPool).options(noload(MatrixPool.users)).where(MatrixPool.endDate >= now)
+            )
+            active = db_result.first()
+            if active is not None:
+                await self._update_shares(active, session)
+                await session.commit()
+
+            db_result = await session.exec(
+                select(MatrixPool.uid)
+                .where(MatrixPool.endDate < now)
+                .where(MatrixPool.settled == False)
+                .order_by(MatrixPool.endDate)
+            )
+            ended = db_result.all()
+
+        credited = 0
+        for poolUid in ended:
+            credited += await self.settle(poolUid, now)
+        return credited
@@ -3,6 +3,7 @@ from decimal import Decimal
 from pydantic import AnyHttpUrl, EmailStr, FileUrl, IPvAnyAddress
 from pydantic_extra_types.payment import PaymentCardBrand, PaymentCardNumber
 from sqlmodel import SQLModel, Field, Relationship, Column
+from sqlalchemy import ForeignKey, Index
 import sqlalchemy.dialects.postgresql as pg
 import uuid
 from typing import List, Optional
@@ -74,43 +75,50 @@ class User(SQLModel, table=True):
     # totalReferrals will also be stored in the schema instead of in the database
     totalReferrals: Decimal = Field(default=Decimal(0), decimal_places=9)
     totalReferralsStakes: Decimal = Field(default=Decimal(0), decimal_places=9, nullable=True)
+    # level 1 referrals holding a stake and the sum of their stakes, kept alongside totalReferrals
+    paidReferrals: int = Field(default=0, sa_column=Column(pg.BIGINT, nullable=False, server_default="0"))
+    referralsDeposit: Decimal = Field(default=Decimal(0), decimal_places=9, sa_column_kwargs={"server_default": "0"})
     # totalNetwork likewise
     totalNetwork: int = Field(default=Decimal(0), sa_column=Column(pg.BIGINT, nullable=False))
 
+    # relationships are only loaded through the profiles in src/apps/accounts/loaders.py
+
     # referral
     referrer: Optional["UserReferral"] = Relationship(
         back_populates="user",
-        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "selectin"}
+        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "raise"}
     )
     referrer_id: uuid.UUID = Field(nullable=True, foreign_key="users.uid")
 
     # Activities
     activities: List["Activities"] = Relationship(
         back_populates="user",
-        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "selectin"}
+        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "raise", "passive_deletes": True}
     )
 
     # Wallet
     wallet: Optional["UserWallet"] = Relationship(
         back_populates="user",
-        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "selectin"}
+        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "raise"}
     )
 
     # user staking
     staking: Optional["UserStaking"] = Relationship(
         back_populates="user",
-        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "selectin"}
+        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "raise"}
     )
 
     # failed transactions
     pendingTransactions: List["PendingTransactions"] = Relationship(
         back_populates="user",
-        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "selectin"}
+        sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "raise", "passive_deletes": True}
     )
 
     joined: datetime = Field(default_factory=datetime.utcnow, nullable=False, description="Record creation timestamp")
     lastRankEarningAddedAt: datetime = Field(default_factory=datetime.utcnow,
                                              nullable=False, description="Last earning calculation timestamp")
+    lastAccrual: Optional[date] = Field(default=None, sa_column=Column(pg.DATE, nullable=True),
+                                        description="Day the daily rank and ROI accrual last ran for the user")
     updatedAt: datetime = Field(default_factory=datetime.utcnow, sa_column=Column(
         pg.TIMESTAMP, nullable=False, onupdate=datetime.utcnow), description="Record last update timestamp")
 
@@ -142,6 +150,65 @@ class UserReferral(SQLModel, table=True):
         return f"<UserReferral {self.userUid}>"
 
 
+class ReferralClosure(SQLModel, table=True):
+    """
+    Closure table of the referral tree. Every user has a depth 0 row to themselves and one
+    row per upline down to 19 levels, so uplines and downlines at any level are plain
+    index lookups instead of walks over `referrer_id`. The descendant's join time is
+    copied in so downlines can be paged in join order straight off the index.
+    """
+    __tablename__ = "referral_closure"
+    __table_args__ = (
+        Index("ix_referral_closure_ancestor_depth_joined", "ancestorUid", "depth", "joined", "descendantUid"),
+        Index("ix_referral_closure_descendant_depth", "descendantUid", "depth"),
+    )
+
+    ancestorUid: uuid.UUID = Field(
+        sa_column=Column(pg.UUID, ForeignKey("users.uid", ondelete="CASCADE"), primary_key=True, nullable=False)
+    )
+    descendantUid: uuid.UUID = Field(
+        sa_column=Column(pg.UUID, ForeignKey("users.uid", ondelete="CASCADE"), primary_key=True, nullable=False)
+    )
+    depth: int = Field(default=0, nullable=False)
+    joined: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column=Column(pg.TIMESTAMP, nullable=False, default=datetime.utcnow),
+    )
+
+    def __repr__(self) -> str:
+        return f"<ReferralClosure {self.ancestorUid} - {self.descendantUid} ({self.depth})>"
+
+
+class DepositQueue(SQLModel, table=True):
+    """
+    Users with a deposit waiting to be staked, at most one entry per user. Workers claim entries
+    with `FOR UPDATE SKIP LOCKED` and delete them in the transaction that credits the stake, so
+    many workers stake disjoint users in parallel and a user is never staked by two at once.
+    The worker reads the wallet balance when it claims the entry, which is what the transfer
+    moves. A failed entry is retried from `availableAt` on.
+    """
+    __tablename__ = "deposit_queue"
+    __table_args__ = (
+        Index("ix_deposit_queue_available_at", "availableAt"),
+    )
+
+    userUid: uuid.UUID = Field(
+        sa_column=Column(pg.UUID, ForeignKey("users.uid", ondelete="CASCADE"), primary_key=True, nullable=False)
+    )
+    attempts: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    enqueuedAt: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column=Column(pg.TIMESTAMP, nullable=False, default=datetime.utcnow),
+    )
+    availableAt: datetime = Field(
+        default_factory=datetime.utcnow,
+        sa_column=Column(pg.TIMESTAMP, nullable=False, default=datetime.utcnow),
+    )
+
+    def __repr__(self) -> str:
+        return f"<DepositQueue {self.userUid} ({self.attempts} attempts)>"
+
+
 class UserWallet(SQLModel, table=True):
     """
     Wallet to hold all financial records of the user, wallet address and private
@@ -257,6 +324,10 @@ class MatrixPool(SQLModel, table=True):
     raisedPoolAmount: Decimal = Field(decimal_places=9, default=Decimal(0.00))
     totalReferrals: int = 0
 
+    # set once the pool has ended and its earnings were paid out
+    settled: bool = Field(default=False, sa_column_kwargs={"server_default": "false"})
+    settledAt: Optional[datetime] = Field(default=None, sa_column=Column(pg.TIMESTAMP, nullable=True))
+
     users: List["MatrixPoolUsers"] = Relationship(
         back_populates="matrixPool",
         sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "selectin"}
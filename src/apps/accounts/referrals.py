@@ -0,0 +1,443 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import sqlalchemy.dialects.postgresql as pg
+from sqlalchemy import String, any_, bindparam, insert, tuple_, union_all, update
+from sqlalchemy.orm import aliased
+from sqlmodel import case, func, literal, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.apps.accounts.enum import ActivityType
+from src.apps.accounts.loaders import ADMIN_LIST
+from src.apps.accounts.models import Activities, ReferralClosure, User, UserReferral, UserStaking
+from src.apps.accounts.schemas import ReferralCounterAudit, UserDownlinesPage, UserReferralRead
+from src.config.settings import Config
+from src.db.bulk import bulk_update
+from src.db.redis import (
+    cache_referral_summary,
+    get_cached_referral_summary,
+    get_referral_counters_cursor,
+    set_referral_counters_cursor,
+)
+from src.errors import InvalidCursor
+from src.utils.logger import LOGGER
+
+# a level 1 referral counts as paid once their stake reaches this amount
+PAID_REFERRAL_MIN = Decimal(1)
+
+# upline levels a stake adds to the team volume of
+TEAM_VOLUME_DEPTH = 5
+
+# the activity recording the share of a withdrawal put back into the stake, which adds to the
+# stake without adding to any team volume
+REDEPOSIT_DETAIL = "New deposit added from withdrawal"
+
+# deepest upline level a user is recorded under
+MAX_REFERRAL_DEPTH = 19
+
+# levels and records per level returned with a user's profile
+REFERRAL_SUMMARY_LEVELS = 5
+REFERRAL_SUMMARY_LIMIT = 50
+
+
+async def add_to_referral_tree(newUser: User, parentUid: Optional[uuid.UUID], session: AsyncSession) -> List[str]:
+    """
+    Adds a new user to the referral closure table under `parentUid`, in the caller's transaction.
+    The closure rows are copied from the parent's with one `INSERT ... SELECT`, which also drives
+    the `UserReferral` record of every upline level and the network counters of every upline.
+    Returns the userIds of the uplines whose referral records were added.
+    """
+    joined = literal(newUser.joined, pg.TIMESTAMP)
+    rows = select(literal(newUser.uid, pg.UUID), literal(newUser.uid, pg.UUID), literal(0), joined)
+    if parentUid is not None:
+        rows = union_all(
+            rows,
+            select(ReferralClosure.ancestorUid, literal(newUser.uid, pg.UUID), ReferralClosure.depth + 1, joined)
+            .where(ReferralClosure.descendantUid == parentUid)
+            .where(ReferralClosure.depth < MAX_REFERRAL_DEPTH),
+        )
+    await session.execute(insert(ReferralClosure).from_select(["ancestorUid", "descendantUid", "depth", "joined"], rows))
+
+    if parentUid is None:
+        return []
+
+    upline = aliased(User)
+    db_result = await session.execute(
+        insert(UserReferral).from_select(
+            ["uid", "level", "name", "reward", "stake", "theirUserId", "userUid", "userId", "created"],
+            select(
+                func.gen_random_uuid(),
+                ReferralClosure.depth,
+                func.coalesce(literal(newUser.firstName, String), upline.userId + " Referral"),
+                literal(Decimal(0)),
+                literal(Decimal(0)),
+                literal(newUser.userId),
+                literal(newUser.uid, pg.UUID),
+                upline.userId,
+                literal(datetime.utcnow()),
+            )
+            .join(upline, upline.uid == ReferralClosure.ancestorUid)
+            .where(ReferralClosure.descendantUid == newUser.uid)
+            .where(ReferralClosure.depth >= 1),
+        )
+        .returning(UserReferral.userId)
+    )
+    uplineUserIds = db_result.scalars().all()
+
+    await session.execute(
+        update(User)
+        .where(User.uid == ReferralClosure.ancestorUid)
+        .where(ReferralClosure.descendantUid == newUser.uid)
+        .where(ReferralClosure.depth >= 1)
+        .values(
+            totalNetwork=User.totalNetwork + 1,
+            totalReferrals=User.totalReferrals + case((ReferralClosure.depth == 1, 1), else_=0),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return uplineUserIds
+
+
+async def remove_from_referral_tree(user: User, session: AsyncSession) -> List[str]:
+    """
+    Takes a user out of their uplines' counters before they are deleted, in the caller's transaction.
+    Every upline loses them from their network, the referrer loses a level 1 referral and its stake,
+    and the `TEAM_VOLUME_DEPTH` levels above lose what they deposited from their team volume, all in
+    one `UPDATE` joined to the closure table. A user with referrals of their own cannot be deleted
+    while `referrer_id` points at them, so the user is the only member of the network that leaves.
+    Returns the userIds of the uplines whose referral records change.
+    """
+    db_result = await session.exec(select(UserStaking.deposit).where(UserStaking.userUid == user.uid))
+    staked = db_result.first() or Decimal(0)
+    db_result = await session.exec(
+        select(func.coalesce(func.sum(Activities.suiAmount), 0))
+        .where(Activities.userUid == user.uid)
+        .where(Activities.activityType == ActivityType.DEPOSIT)
+        .where(Activities.strDetail == REDEPOSIT_DETAIL)
+    )
+    deposited = staked - db_result.one()
+    paid = 1 if staked >= PAID_REFERRAL_MIN else 0
+
+    db_result = await session.execute(
+        update(User)
+        .where(User.uid == ReferralClosure.ancestorUid)
+        .where(ReferralClosure.descendantUid == user.uid)
+        .where(ReferralClosure.depth >= 1)
+        .values(
+            totalNetwork=User.totalNetwork - 1,
+            totalReferrals=User.totalReferrals - case((ReferralClosure.depth == 1, 1), else_=0),
+            paidReferrals=User.paidReferrals - case((ReferralClosure.depth == 1, paid), else_=0),
+            referralsDeposit=User.referralsDeposit - case((ReferralClosure.depth == 1, deposited), else_=Decimal(0)),
+            totalTeamVolume=User.totalTeamVolume
+            - case((ReferralClosure.depth <= TEAM_VOLUME_DEPTH, deposited), else_=Decimal(0)),
+        )
+        .returning(User.userId)
+        .execution_options(synchronize_session=False)
+    )
+    return db_result.scalars().all()
+
+
+async def add_referral_stake(referrerUid: uuid.UUID, stakedBefore: Decimal, staked: Decimal, session: AsyncSession) -> None:
+    """
+    Adds a level 1 referral's new stake to their referrer's counters in the caller's transaction,
+    counting the referral as paid when this stake takes them past `PAID_REFERRAL_MIN`.
+    """
+    becamePaid = stakedBefore < PAID_REFERRAL_MIN <= stakedBefore + staked
+    await session.execute(
+        update(User)
+        .where(User.uid == referrerUid)
+        .values(
+            referralsDeposit=User.referralsDeposit + staked,
+            paidReferrals=User.paidReferrals + (1 if becamePaid else 0),
+        )
+    )
+    return None
+
+
+# referral bonus paid to each upline level on a stake
+REFERRAL_BONUS_RATES = {
+    1: Decimal("0.1"),
+    2: Decimal("0.05"),
+    3: Decimal("0.03"),
+    4: Decimal("0.02"),
+    5: Decimal("0.01"),
+}
+
+# roi added once when an upline's level 1 referrals have staked twice their own stake
+SPEED_BOOST_ROI = Decimal("0.005")
+
+
+def upline_query(uids: List[uuid.UUID], depth: int = 5):
+    """`(descendant, uid, level)` rows for every upline of every user in `uids`, down to `depth` levels"""
+    return (
+        select(
+            ReferralClosure.descendantUid.label("descendant"),
+            ReferralClosure.ancestorUid.label("uid"),
+            ReferralClosure.depth.label("level"),
+        )
+        .where(ReferralClosure.descendantUid.in_(uids))
+        .where(ReferralClosure.depth.between(1, depth))
+        .subquery("uplines")
+    )
+
+
+async def get_uplines(
+    uids: List[uuid.UUID], session: AsyncSession, depth: int = 5
+) -> Dict[uuid.UUID, List[Tuple[uuid.UUID, int]]]:
+    """`(uid, level)` of the uplines of every user in `uids`, nearest first, with one query"""
+    uplines = upline_query(uids, depth)
+    db_result = await session.exec(
+        select(uplines.c.descendant, uplines.c.uid, uplines.c.level).order_by(uplines.c.descendant, uplines.c.level)
+    )
+
+    chains: Dict[uuid.UUID, List[Tuple[uuid.UUID, int]]] = {uid: [] for uid in uids}
+    for descendant, uid, level in db_result.all():
+        chains[descendant].append((uid, level))
+    return chains
+
+
+async def propagate_team_volume(
+    deposits: List[Tuple[uuid.UUID, Decimal]], session: AsyncSession, depth: int = TEAM_VOLUME_DEPTH
+) -> int:
+    """
+    Adds every `(userUid, amount)` deposit to the team volume of the depositor's uplines, `depth`
+    levels up, in the caller's transaction. The upline chains of the whole batch come from one
+    query and the increments are summed per upline before they are written, with a single
+    `UPDATE ... WHERE uid = ANY(...)` when every upline gets the same amount. Returns the number
+    of uplines updated.
+    """
+    deposits = [(userUid, amount) for userUid, amount in deposits if amount]
+    if not deposits:
+        return 0
+
+    chains = await get_uplines(list({userUid for userUid, _ in deposits}), session, depth)
+    volumes: Dict[uuid.UUID, Decimal] = {}
+    for userUid, amount in deposits:
+        for uid, _ in chains[userUid]:
+            volumes[uid] = volumes.get(uid, Decimal(0)) + amount
+
+    if not volumes:
+        return 0
+
+    amounts = set(volumes.values())
+    if len(amounts) == 1:
+        await session.execute(
+            update(User)
+            .where(User.uid == any_(bindparam("uids", list(volumes), type_=pg.ARRAY(pg.UUID(as_uuid=True)))))
+            .values(totalTeamVolume=User.totalTeamVolume + amounts.pop())
+            .execution_options(synchronize_session=False)
+        )
+    else:
+        await bulk_update(
+            session,
+            User,
+            "uid",
+            [{"uid": uid, "totalTeamVolume": volume} for uid, volume in volumes.items()],
+            increments=("totalTeamVolume",),
+        )
+    return len(volumes)
+
+
+def encode_downline_cursor(joined: datetime, uid: uuid.UUID) -> str:
+    return base64.urlsafe_b64encode(json.dumps([joined.isoformat(), str(uid)]).encode()).decode()
+
+
+def decode_downline_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        joined, uid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(joined), uuid.UUID(uid)
+    except Exception:
+        raise InvalidCursor()
+
+
+async def get_downline_page(
+    uid: uuid.UUID,
+    level: int,
+    session: AsyncSession,
+    cursor: Optional[str] = None,
+    size: int = 50,
+    withTotal: bool = True,
+) -> UserDownlinesPage:
+    """
+    One page of the users `level` levels below the user `uid`, in join order. Paging is keyset based on
+    `(joined, uid)` and runs off the closure table index, so every page costs the same however
+    large the downline is. The level 1 total comes from the `totalReferrals` counter, deeper
+    levels are counted on the same index.
+    """
+    page = (
+        select(ReferralClosure.descendantUid, ReferralClosure.joined)
+        .where(ReferralClosure.ancestorUid == uid)
+        .where(ReferralClosure.depth == level)
+        .order_by(ReferralClosure.joined, ReferralClosure.descendantUid)
+        .limit(size + 1)
+    )
+    if cursor is not None:
+        after = tuple_(*decode_downline_cursor(cursor))
+        page = page.where(tuple_(ReferralClosure.joined, ReferralClosure.descendantUid) > after)
+    page = page.subquery("page")
+
+    db_result = await session.exec(
+        select(User)
+        .options(*ADMIN_LIST)
+        .join(page, page.c.descendantUid == User.uid)
+        .order_by(page.c.joined, page.c.descendantUid)
+    )
+    users = db_result.all()
+
+    nextCursor = None
+    if len(users) > size:
+        users = users[:size]
+        nextCursor = encode_downline_cursor(users[-1].joined, users[-1].uid)
+
+    total = None
+    if withTotal:
+        if level == 1:
+            db_result = await session.exec(select(User.totalReferrals).where(User.uid == uid))
+            total = int(db_result.one())
+        else:
+            db_result = await session.exec(
+                select(func.count())
+                .select_from(ReferralClosure)
+                .where(ReferralClosure.ancestorUid == uid)
+                .where(ReferralClosure.depth == level)
+            )
+            total = db_result.one()
+
+    return UserDownlinesPage(items=users, total=total, size=size, nextCursor=nextCursor)
+
+
+def referral_summary_query(userId: str, levels: int = REFERRAL_SUMMARY_LEVELS, limit: int = REFERRAL_SUMMARY_LIMIT):
+    """The first `limit` referral records of every level down to `levels` in one query, oldest first"""
+    ranked = (
+        select(
+            UserReferral,
+            func.row_number()
+            .over(partition_by=UserReferral.level, order_by=(UserReferral.created, UserReferral.uid))
+            .label("position"),
+        )
+        .where(UserReferral.userId == userId)
+        .where(UserReferral.level.between(1, levels))
+        .subquery("ranked")
+    )
+    referral = aliased(UserReferral, ranked)
+    return select(referral).where(ranked.c.position <= limit).order_by(ranked.c.level, ranked.c.position)
+
+
+async def get_referral_summary(user: User, session: AsyncSession) -> Dict[str, List[UserReferralRead]]:
+    """
+    `referralsLv1` to `referralsLv5` of a user for the profile responses, served from redis until
+    the user's referral records change.
+    """
+    cached = await get_cached_referral_summary(user.userId)
+    if cached is not None:
+        return {key: [UserReferralRead.model_validate(row) for row in rows] for key, rows in cached.items()}
+
+    summary: Dict[str, List[UserReferralRead]] = {
+        f"referralsLv{level}": [] for level in range(1, REFERRAL_SUMMARY_LEVELS + 1)
+    }
+    db_result = await session.exec(referral_summary_query(user.userId))
+    for referral in db_result.all():
+        summary[f"referralsLv{referral.level}"].append(UserReferralRead.model_validate(referral))
+
+    await cache_referral_summary(
+        user.userId, {key: [row.model_dump(mode="json") for row in rows] for key, rows in summary.items()}
+    )
+    return summary
+
+
+def redeposit_totals():
+    """
+    `(userUid, redeposited)` rows with the share of their withdrawals each user put back into their
+    stake, which counts towards the stake but never towards an upline's `referralsDeposit`
+    """
+    return (
+        select(Activities.userUid, func.sum(Activities.suiAmount).label("redeposited"))
+        .where(Activities.activityType == ActivityType.DEPOSIT)
+        .where(Activities.strDetail == REDEPOSIT_DETAIL)
+        .group_by(Activities.userUid)
+        .subquery("redeposits")
+    )
+
+
+class ReferralCounterReconciler:
+    """
+    Incremental audit of the denormalized level 1 referral counters on `User`. Each run
+    recounts the next `batchSize` users (in uid order, from a cursor kept in redis) from the
+    referral tree and the stakes, reports every user whose counters drifted and optionally
+    writes the recounted values back. The cursor wraps around once the last user is checked.
+    """
+
+    def __init__(self, batchSize: Optional[int] = None) -> None:
+        self.batchSize = batchSize or Config.BULK_WRITE_CHUNK_SIZE
+
+    def _recount(self, uids: List[uuid.UUID]):
+        referred = aliased(User)
+        redeposits = redeposit_totals()
+        return (
+            select(
+                referred.referrer_id,
+                func.count(referred.uid).label("referrals"),
+                func.sum(case((UserStaking.deposit >= PAID_REFERRAL_MIN, 1), else_=0)).label("paid"),
+                func.coalesce(
+                    func.sum(UserStaking.deposit - func.coalesce(redeposits.c.redeposited, 0)), 0
+                ).label("deposit"),
+            )
+            .outerjoin(UserStaking, UserStaking.userUid == referred.uid)
+            .outerjoin(redeposits, redeposits.c.userUid == referred.uid)
+            .where(referred.referrer_id.in_(uids))
+            .group_by(referred.referrer_id)
+        )
+
+    async def run(self, session: AsyncSession, repair: bool = True) -> ReferralCounterAudit:
+        cursor = await get_referral_counters_cursor()
+
+        page = (
+            select(User.uid, User.userId, User.totalReferrals, User.paidReferrals, User.referralsDeposit)
+            .order_by(User.uid)
+            .limit(self.batchSize)
+        )
+        if cursor is not None:
+            page = page.where(User.uid > uuid.UUID(cursor))
+        db_result = await session.exec(page)
+        users = db_result.all()
+
+        audit = ReferralCounterAudit(checked=len(users), repaired=repair)
+        if users:
+            db_result = await session.exec(self._recount([user.uid for user in users]))
+            counts = {row.referrer_id: row for row in db_result.all()}
+
+            fixes = []
+            for user in users:
+                count = counts.get(user.uid)
+                expected = (
+                    Decimal(count.referrals if count else 0),
+                    int(count.paid if count else 0),
+                    Decimal(count.deposit if count else 0),
+                )
+                if expected != (user.totalReferrals, user.paidReferrals, user.referralsDeposit):
+                    audit.mismatchedUserIds.append(user.userId)
+                    fixes.append({
+                        "uid": user.uid,
+                        "totalReferrals": expected[0],
+                        "paidReferrals": expected[1],
+                        "referralsDeposit": expected[2],
+                    })
+
+            audit.mismatched = len(fixes)
+            if repair and fixes:
+                await bulk_update(session, User, "uid", fixes)
+                await session.commit()
+
+        # a short page means we reached the last user, start over on the next run
+        audit.cursor = users[-1].uid if len(users) == self.batchSize else None
+        await set_referral_counters_cursor(str(audit.cursor) if audit.cursor else None)
+
+        LOGGER.info(
+            f"Referral counters: {audit.checked} users checked, {audit.mismatched} mismatched"
+            f"{', repaired' if repair and audit.mismatched else ''}"
+        )
+        return audit
@@ -8,11 +8,12 @@ from pydantic_extra_types.payment import PaymentCardBrand, PaymentCardNumber
 from pydantic_extra_types.country import CountryInfo
 
 from datetime import date, datetime
-from typing import Optional, List, Annotated
+from typing import Dict, Optional, List, Annotated
 
 from sqlmodel import select
 
 from src.apps.accounts.enum import ActivityType
+from src.apps.accounts.loaders import AUTH
 from src.apps.accounts.models import MatrixPool, MatrixPoolUsers, User
 from src.db.engine import get_session_context
 
@@ -80,6 +81,36 @@ class SuiTransferResponse(BaseModel):
     txBytes: str
 
 
+class DepositSweepStats(BaseModel):
+    users: int = 0
+    unchanged: int = 0
+    deposits: int = 0
+    failedLookups: int = 0
+    failedStakes: int = 0
+    elapsed: float = 0.0
+    usersPerSecond: float = 0.0
+    p50Latency: float = 0.0
+    p99Latency: float = 0.0
+
+
+class ReferralCounterAudit(BaseModel):
+    checked: int = 0
+    mismatched: int = 0
+    repaired: bool = False
+    mismatchedUserIds: List[str] = []
+    cursor: Optional[uuid.UUID] = None
+
+
+class ReferralTreeAudit(BaseModel):
+    checked: int = 0
+    mismatched: int = 0
+    repaired: bool = False
+    # number of users each counter drifted on
+    mismatchedCounters: Dict[str, int] = {}
+    mismatchedUserIds: List[str] = []
+    elapsed: float = 0.0
+
+
 class AllStatisticsRead(BaseModel):
     totalAmountStaked: Decimal = Decimal(0)
     totalMatrixPoolGenerated: Decimal = Decimal(0)
@@ -179,6 +210,8 @@ class UserRead(UserBaseSchema):
     totalTeamVolume: Decimal = Decimal(0)
     totalReferrals: Decimal = Decimal(0)
     totalReferralsStakes: Decimal = Decimal(0)
+    paidReferrals: int = 0
+    referralsDeposit: Decimal = Decimal(0)
     totalNetwork: Decimal = Decimal(0)
 
     age: Optional[int] = 0
@@ -269,6 +302,13 @@ class UserWithReferralsRead(BaseModel):
     referralsLv5: List[UserReferralRead]
 
 
+class UserDownlinesPage(BaseModel):
+    items: List[UserRead]
+    total: Optional[int] = None
+    size: int
+    nextCursor: Optional[str] = None
+
+
 class WalletBaseSchema(BaseModel):
     address: str
     # phrase: str
@@ -334,6 +374,18 @@ class StakingRead(StakingBaseSchema):
         from_attributes = True  # Allows loading from ORM models like SQLModel
 
 
+class AuthPrincipal(BaseModel):
+    """The identity and permissions of a user, all the auth path needs, cached in redis between requests"""
+    uid: uuid.UUID
+    userId: str
+    isBlocked: bool = False
+    isAdmin: bool = False
+    isSuperuser: bool = False
+
+    class Config:
+        from_attributes = True
+
+
 class TokenMeterCreate(BaseModel):
     tokenAddress: str
     tokenPrivateKey: Optional[str] = None
@@ -393,6 +445,7 @@ class MatrixPoolRead(MatrixPoolBase):
 
     users: List["MatrixUsersRead"]
     totalReferrals: int = 0
+    settled: bool = False
 
 
 class MatrixUserCreateUpdate(BaseModel):
@@ -426,7 +479,7 @@ class MatrixUsersRead(BaseModel):
     @staticmethod
     async def return_name(matrixPoolUser: "MatrixUsersRead"):
         async with get_session_context() as session:
-            mp_db = await session.exec(select(User).where(User.userid == matrixPoolUser.userId))
+            mp_db = await session.exec(select(User).options(*AUTH).where(User.userid == matrixPoolUser.userId))
             mp = mp_db.first()
 
             name = matrixPoolUser.userId
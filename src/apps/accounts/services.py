@@ -6,7 +6,7 @@ import random
 import uuid
 
 from datetime import date, datetime, timedelta
-from typing import Annotated, Any, List, Optional
+from typing import Annotated, Any, Dict, List, Optional
 from uuid import UUID
 
 from fastapi import BackgroundTasks, Depends, File, HTTPException, Request, UploadFile
@@ -16,23 +16,60 @@ from fastapi_pagination.ext.sqlalchemy import paginate
 from apscheduler.schedulers.background import BackgroundScheduler  # runs tasks in the background
 from apscheduler.triggers.cron import CronTrigger  # allows us to specify a recurring time for execution
 
-import requests
-from sqlalchemy import Date, cast
-from sqlmodel import select, func, literal
+from sqlalchemy import Date, cast, update
+from sqlmodel import select, func
 from sqlmodel.ext.asyncio.session import AsyncSession
 
 from src.apps.accounts.dependencies import user_exists_check
 from src.apps.accounts.enum import ActivityType
+from src.apps.accounts.loaders import ADMIN_LIST, AUTH, PROFILE_VIEW
 from src.apps.accounts.models import Activities, MatrixPool, MatrixPoolUsers, PendingTransactions, TokenMeter, User, UserReferral, UserStaking, UserWallet
-from src.apps.accounts.schemas import AdminLogin, AllStatisticsRead, MatrixUserCreateUpdate, TokenMeterCreate, TokenMeterUpdate, UserCreateOrLoginSchema, UserLoginSchema, UserUpdateSchema, Wallet
+from src.apps.accounts.referrals import (
+    REDEPOSIT_DETAIL,
+    REFERRAL_BONUS_RATES,
+    SPEED_BOOST_ROI,
+    ReferralCounterReconciler,
+    add_referral_stake,
+    add_to_referral_tree,
+    get_downline_page,
+    get_referral_summary,
+    propagate_team_volume,
+    upline_query,
+)
+from src.apps.accounts.schemas import (
+    AdminLogin,
+    AllStatisticsRead,
+    MatrixUserCreateUpdate,
+    ReferralCounterAudit,
+    ReferralTreeAudit,
+    TokenMeterCreate,
+    TokenMeterUpdate,
+    UserCreateOrLoginSchema,
+    UserDownlinesPage,
+    UserLoginSchema,
+    UserReferralRead,
+    UserUpdateSchema,
+    Wallet,
+)
+from src.apps.accounts.tree import ReferralTreeAuditor
 from src.celery_beat import TemplateScheduleSQLRepository
-from src.utils.calculations import get_rank
+from src.utils.http import http_client
 from src.utils.sui_json_rpc_apis import SUI
 from src.errors import ActivePoolNotFound, InsufficientBalance, InvalidCredentials, InvalidStakeAmount, InvalidTelegramAuthData, OnlyOneTokenMeterRequired, ReferrerNotFound, StakingExpired, TokenMeterDoesNotExists, TokenMeterExists, UserAlreadyExists, UserBlocked, UserNotFound
-from src.utils.hashing import createAccessToken, verifyHashKey, verifyTelegramAuthData
+from src.utils.crypto import crypto_executor
+from src.utils.hashing import createAccessToken, verifyHashKeyAsync, verifyTelegramAuthData
 from src.utils.logger import LOGGER
 from src.config.settings import Config
-from src.db.redis import get_sui_usd_price
+from src.db.bulk import bulk_update
+from src.db.redis import (
+    add_wallet_addresses,
+    claim_balance_snapshot,
+    get_sui_usd_price,
+    invalidate_auth_principals,
+    invalidate_referral_summaries,
+    restore_balance_snapshot,
+    set_balance_snapshots,
+)
 
 
 from mnemonic import Mnemonic
@@ -158,22 +195,39 @@ class AdminServices:
 
     async def getAllUsers(self, date: date, session: AsyncSession):
         if date is not None:
-            users: Page[User] = await paginate(session, select(User).where(User.isSuperuser == False).where(User.joined.date() >= date).order_by(User.joined, User.firstName))
+            users: Page[User] = await paginate(
+                session,
+                select(User)
+                .options(*ADMIN_LIST)
+                .where(User.isSuperuser == False)
+                .where(User.joined.date() >= date)
+                .order_by(User.joined, User.firstName),
+            )
             return users
-        users = await paginate(session, select(User).where(User.isSuperuser == False).order_by(User.joined, User.firstName))
+        users = await paginate(
+            session,
+            select(User).options(*ADMIN_LIST).where(User.isSuperuser == False).order_by(User.joined, User.firstName),
+        )
         return users
 
     async def banUser(self, userId: str, session: AsyncSession) -> bool:
-        db_result = await session.exec(select(User).where(User.userId == userId))
+        db_result = await session.exec(select(User).options(*AUTH).where(User.userId == userId))
         user = db_result.first()
         if user is None:
             raise UserNotFound()
 
         user.isBlocked = False if user.isBlocked else True
         await session.commit()
+        await invalidate_auth_principals([user.userId])
         await session.refresh(user)
         return True
 
+    async def reconcileReferralCounters(self, repair: bool, session: AsyncSession) -> ReferralCounterAudit:
+        return await ReferralCounterReconciler().run(session, repair)
+
+    async def auditReferralTree(self, repair: bool, session: AsyncSession) -> ReferralTreeAudit:
+        return await ReferralTreeAuditor().run(session, repair)
+
 
 class UserServices:
     # #####  WORKING ENDOINT
@@ -185,9 +239,8 @@ class UserServices:
 
         LOGGER.debug(body)
 
-        response = requests.post(url, headers=headers, json=body)
-        LOGGER.debug(response.json())
-        result = response.json()
+        result = await http_client.post_json(url, body, headers=headers)
+        LOGGER.debug(result)
         if 'error' in result:
             raise Exception(f"Error: {result['error']}")
         res = result
@@ -195,94 +248,30 @@ class UserServices:
         return res
 
 
-    async def get_user_downlines(self, user: User, level: int, session: AsyncSession):
-        cte = (
-            select(
-                User.uid.label("uid"),
-                User.userId.label("userId"),
-                User.firstName.label("firstName"),
-                User.referrer_id.label("referrer_id"),
-                literal(1).label("level"),
-            )
-            .where(User.referrer_id == user.uid)
-            .cte(recursive=True)
-        )
-
-        cte = cte.union_all(
-            select(
-                User.uid,
-                User.userId,
-                User.firstName,
-                User.referrer_id,
-                (cte.c.level + 1).label("level"),
-            ).join(User, User.referrer_id == cte.c.uid)
-        )
-
-        query = (
-            select(User)
-            .join(cte, User.uid == cte.c.uid)
-            .where(cte.c.level == level)
-        )
-
-        results = await session.exec(query)
-        return results.all()
-
-    async def create_referral_level(self, new_user: User, referring_user: User, level: int, session: AsyncSession):
-        referrer = referring_user
-        if level < 20:
-            referrer.totalNetwork += 1
-            referrer.totalReferrals += 1 if level == 1 else 0
-
-            name = f"{referring_user.userId} Referral"
-            if new_user.firstName:
-                name = f"{new_user.firstName}"
-
-            new_referral = UserReferral(
-                level=level,
-                name=name,
-                reward=Decimal(0.00),
-                theirUserId=new_user.userId,
-                userUid=new_user.uid,
-                userId=referrer.userId,
-            )
-            session.add(new_referral)
-            if level == 1:
-                session.add(Activities(activityType=ActivityType.REFERRAL, strDetail=f"New Level {level} referral added", userUid=referrer.uid))
-            await session.commit()
-
-            if new_referral is not None:
-                LOGGER.debug(f"New Referral for {referrer.userId}: {new_referral.name}")
-
-# ##### MOVED TO RUN IN CELRY TASK FOR EVERY 15 mins
-                # # ###### ADD FAST ADD BONUS FOR THE FIRST REFERRING USER
-                # if level == 1:
-
-                #     fast_boost_time = referring_user.joined + timedelta(hours=24)
-                #     db_referrals = await session.exec(select(UserReferral).where(UserReferral.userId == referring_user.userId).where(UserReferral.level == 1))
-                #     referrals = db_referrals.all()
-
-                #     paid_users = []
-                #     for u in referrals:
-                #         ref_db = await session.exec(select(User).where(User.userId == u.userId))
-                #         referrer = ref_db.first()
-                #         if referrer and referrer.staking.deposit >= Decimal(1):
-                #             paid_users.append(u)
-
-                #     if referring_user.joined < fast_boost_time and len(paid_users) >= 2:
-                #         referring_user.wallet.totalFastBonus += Decimal(1.00)
-                #         referring_user.staking.deposit += Decimal(1.00)
-
-                # # ###### CHECK IF THE REFERRING USER HAS A REFERRER THEN REPEAT THE PROCESS AGAIN
-
-            if referring_user.referrer is not None:
-                db_result = await session.exec(select(User).where(User.userId == referring_user.referrer.userId))
-                referrers_referrer = db_result.first()
-                new_level = level + 1
-                await self.create_referral_level(new_user, referrers_referrer, new_level, session)
+    async def get_downline_page(
+        self,
+        uid: uuid.UUID,
+        level: int,
+        session: AsyncSession,
+        cursor: Optional[str] = None,
+        size: int = 50,
+        withTotal: bool = True,
+    ) -> UserDownlinesPage:
+        return await get_downline_page(uid, level, session, cursor, size, withTotal)
+
+    async def create_referral_level(self, new_user: User, referring_user: User, session: AsyncSession):
+        """Records `new_user` under `referring_user` at every upline level in one round of statements"""
+        uplineUserIds = await add_to_referral_tree(new_user, referring_user.uid, session)
+        session.add(Activities(
+            activityType=ActivityType.REFERRAL, strDetail="New Level 1 referral added", userUid=referring_user.uid
+        ))
+        await session.commit()
+        await invalidate_referral_summaries(uplineUserIds)
+        LOGGER.debug(f"New Referral for {referring_user.userId}: {new_user.userId}")
         return None
 
     async def create_referrer(self, referrer_userId: Optional[str], new_user: User, session: AsyncSession):
-        db_result = await session.exec(select(User).where(User.userId == referrer_userId))
+        db_result = await session.exec(select(User).options(*AUTH).where(User.userId == referrer_userId))
         referring_user = db_result.first()
 
         if not referring_user:
@@ -323,14 +312,14 @@ class UserServices:
         new_user.referrer_id = referring_user.uid
         await session.commit()
 
-        await self.create_referral_level(new_user, referring_user, 1, session)
+        await self.create_referral_level(new_user, referring_user, session)
 
         # check for fast boost and credit the users wallet balance accordingly
         return None
 
     async def create_wallet(self, user: User, session: AsyncSession):
         # mnemonic_phrase = Mnemonic("english").generate(strength=128)
-        mnemonic_phrase = Bip39MnemonicGenerator().FromWordsNumber(Bip39WordsNum.WORDS_NUM_12)
+        mnemonic_phrase = await crypto_executor.run(Bip39MnemonicGenerator().FromWordsNumber, Bip39WordsNum.WORDS_NUM_12)
         url = "https://suiwallet.sui-bison.live/wallet"
 
         res = await self.sui_wallet_endpoint(url, None)
@@ -359,7 +348,7 @@ class UserServices:
         if user is None:
             raise UserNotFound()
 
-        valid_password = verifyHashKey(form_data.password, user.passwordHash)
+        valid_password = await verifyHashKeyAsync(form_data.password, user.passwordHash)
         if not valid_password:
             raise InvalidCredentials()
 
@@ -462,6 +451,11 @@ class UserServices:
             LOGGER.info(f"CREATING A NEW REFERRAL FOR: {referrer_userId}")
             await self.create_referrer(referrer_userId, new_user, session)
 
+        # users without a referrer still need their own row in the referral tree
+        if new_user.referrer_id is None:
+            await session.flush()
+            await add_to_referral_tree(new_user, None, session)
+
         stake = await self.create_staking_account(new_user, session)
         LOGGER.debug(f"Stake:: {stake}")
 
@@ -473,7 +467,13 @@ class UserServices:
         LOGGER.debug(f"NEW WALLET:: {new_wallet}")
 
         await session.commit()
-        await session.refresh(new_user)
+        # the deposit ingester only watches the addresses in the wallet address set
+        await add_wallet_addresses([new_wallet.address])
+        # a new user was not loaded through a profile, so reload it with one for the response
+        db_result = await session.exec(
+            select(User).options(*PROFILE_VIEW).where(User.uid == new_user.uid).execution_options(populate_existing=True)
+        )
+        new_user = db_result.one()
 
         # generate access and refresh token so long the telegram init data is valid
         accessToken = createAccessToken(
@@ -493,7 +493,7 @@ class UserServices:
         return accessToken, refreshToken, new_user
 
     async def return_user_by_userId(self, userId: int, session: AsyncSession):
-        db_result = await session.exec(select(User).where(User.userId == userId))
+        db_result = await session.exec(select(User).options(*PROFILE_VIEW).where(User.userId == userId))
         user = db_result.first()
         if user is None:
             raise UserNotFound()
@@ -512,11 +512,17 @@ class UserServices:
             the_referred_user.name = f"{form_data.firstName} {form_data.lastName}" if form_data.firstName or form_data.lastName else the_referred_user.name
 
         await session.commit()
+        await invalidate_auth_principals([user.userId])
+        if the_referred_user is not None:
+            await invalidate_referral_summaries([the_referred_user.userId])
         await session.refresh(user)
         return user
 
-    async def getUserActivities(self, user: User, session: AsyncSession):
-        query = select(Activities).where(Activities.userUid == user.uid).order_by(Activities.created).limit(25)
+    async def get_referral_summary(self, user: User, session: AsyncSession) -> Dict[str, List[UserReferralRead]]:
+        return await get_referral_summary(user, session)
+
+    async def getUserActivities(self, userUid: uuid.UUID, session: AsyncSession):
+        query = select(Activities).where(Activities.userUid == userUid).order_by(Activities.created).limit(25)
         db = await session.exec(query)
         allActivities = db.all()
         return allActivities
@@ -528,17 +534,6 @@ class UserServices:
         user.wallet.totalTokenPurchased += token_worth_in_usd_purchased
         return None
 
-    async def calc_team_volume(self, referrer: User, amount: Decimal, level: int, session: AsyncSession):
-        LOGGER.info(F"Debuggin here::::: {amount} {level} {referrer}")
-        if level < 6:
-            referrer.totalTeamVolume += amount
-            await session.commit()
-            if referrer.referrer:
-                level_referrer_db = await session.exec(select(User).where(User.userId == referrer.referrer.userId))
-                level_referrer = level_referrer_db.first()
-                await self.calc_team_volume(level_referrer, amount, level + 1, session)
-        return None
-
     async def transferToAdminWallet(self, user: User, amount: Decimal, session: AsyncSession):
         """Transfer the current sui wallet balance of a user to the admin wallet specified in the tokenMeter"""
         db_result = await session.exec(select(TokenMeter))
@@ -647,12 +642,29 @@ class UserServices:
         user.wallet.totalDeposit += amount
         user.wallet.balance += amount
 
-    async def stake_sui(self, user: User, session: AsyncSession):
-        LOGGER.debug(f"Got here 1:::: {user.firstName} {user.userId} {user.uid} -- {user.referrer_id} - {user.referrer.userUid if user.referrer else None} {user.referrer.userId if user.referrer else None}")
-        deposit_amount = await self._get_user_balance(user.wallet.address)
-
+    async def stake_sui(self, user: User, session: AsyncSession) -> bool:
+        """
+        Credit the on-chain balance of the user's wallet as a stake and return whether it was
+        committed. The balance is read here, as it is the whole balance that the transfer moves,
+        and claimed against the wallet's balance snapshot before anything is written, so a balance
+        already credited or being credited by another worker is left untouched. A failed stake puts
+        the previous snapshot back. The upline team volume of the stake is written in the stake's
+        own transaction, so it commits or rolls back with it. When the balance can't be read the
+        session is rolled back, as for a failed stake, so the caller tries again later.
+        """
+        LOGGER.debug(f"Got here 1:::: {user.firstName} {user.userId} {user.uid} -- {user.referrer_id}")
+        address = user.wallet.address
+        deposit_amount = await self._get_user_balance(address)
+        if deposit_amount is None:
+            LOGGER.error(f"Could not read the balance of {address} to stake it")
+            await session.rollback()
+            return False
         if not deposit_amount:
-            return
+            return False
+
+        changed, previousSnapshot = await claim_balance_snapshot(address, deposit_amount)
+        if not changed:
+            return False
 
         LOGGER.debug(f"Got here 2")
 
@@ -663,9 +675,10 @@ class UserServices:
 
             if deposit_amount < STAKING_MIN:
                 LOGGER.debug(f"Got here 4")
+                # the deposit stays in the wallet until it adds up to a stake, so the claimed snapshot is the balance itself
                 await session.commit()
                 await session.refresh(user)
-                return
+                return True
 
             LOGGER.debug(f"Got here 5")
 
@@ -679,6 +692,7 @@ class UserServices:
             LOGGER.debug(f"Got here 6")
 
             # perform stake calculations
+            stakedBefore = user.staking.deposit
             try:
                 await self.handle_stake_logic(deposit_amount, token_meter, user, session)
                 LOGGER.debug(f"Got here 7")
@@ -687,18 +701,17 @@ class UserServices:
                 raise HTTPException(status_code=400, detail="Staking Failed")
 
             LOGGER.debug(f"Got here 9")
+            uplineUserIds: List[str] = []
             if user.referrer_id:
-                db_result = await session.exec(select(User).where(User.uid == user.referrer_id))
-                user_referrer = db_result.first()
+                await add_referral_stake(user.referrer_id, stakedBefore, user.staking.deposit - stakedBefore, session)
 
-                LOGGER.debug(f"Got here 10. Referrer name: {user_referrer.userId}")
+                LOGGER.debug(f"Got here 10. Referrer uid: {user.referrer_id}")
                 # if not user.hasMadeFirstDeposit:
-                await self.add_referrer_earning(user, user_referrer.userId, deposit_amount, 1, session)
+                uplineUserIds = await self.add_referrer_earning(user, deposit_amount, session)
                     # user.hasMadeFirstDeposit = True
                 LOGGER.debug(f"USER HHAS REF: {True}")
                 amount_to_show = Decimal(deposit_amount - Decimal(deposit_amount * Decimal(0.1)))
- 
-                await self.calc_team_volume(user_referrer, amount_to_show, 1, session)
+                await propagate_team_volume([(user.uid, amount_to_show)], session)
 
             LOGGER.debug(f"Got here 11")
 
@@ -709,12 +722,18 @@ class UserServices:
             #     await self.calc_team_volume(referrer, amount_to_show, 1, session)
 
 
+            # the transfer swept the whole balance to the admin wallet, so the next deposit of any amount shows as a change
+            await set_balance_snapshots({address: Decimal(0)})
             await session.commit()
+            await invalidate_referral_summaries(uplineUserIds)
             await session.refresh(user)
+            return True
         except Exception as e:
             LOGGER.error(e)
             LOGGER.debug(f"Got here 12")
             await session.rollback()
+            await restore_balance_snapshot(address, previousSnapshot)
+            return False
 
     # ##### WORKING ENDPOINT ENDING
 
@@ -723,82 +742,98 @@ class UserServices:
 
     # ###### TODO: CHECK FOR REASONS THE REFERRAL BONUS IS NOT WORKING
 
-    async def add_referrer_earning(self, referral: User, referrer: Optional[str], amount: Decimal, level: int, session: AsyncSession):
-        LOGGER.debug(f"executing referral earning calculations, level: {level}, referrerId: {referrer}")
-
-        db_result = await session.exec(select(User).where(User.userId == referrer))
-
-        referring_user = db_result.first()
-
-        if not referring_user:
-            LOGGER.debug(f"NO REFERRER TO GIVE BONUS TO")
-            return None
-
-        LOGGER.debug(f"passed user check:: {referring_user.userId}, referrer referrer: {referring_user.referrer.userId if referring_user.referrer else None}")
-
-        # check for speed boost
-        # fetch referrals for the referrer if available
-        ref_db_result = await session.exec(select(UserReferral).where(UserReferral.userId == referrer))
-        referrals = ref_db_result.all()
-        LOGGER.debug("Fetched all referrals")
-
-        # add referrals and their rewards
-        rf_db = await session.exec(select(UserReferral).where(UserReferral.theirUserId == referral.userId).where(UserReferral.userId == referrer))
-        referral_to_update = rf_db.first()
-
-        if not referral_to_update:
-            LOGGER.debug(f"NO REFERRER TO GIVE BONUS TO 2")
-            return None
-
-        # ####### Calculate Referral Bonuses
-        percentage = Decimal(0.1)
-        if level == 2:
-            percentage = Decimal(0.05)
-        elif level == 3:
-            percentage = Decimal(0.03)
-        elif level == 4:
-            percentage = Decimal(0.02)
-        elif level == 5:
-            percentage = Decimal(0.01)
-
-        LOGGER.debug(f"REFERRAL TO UPDATE: {referral_to_update.user.firstName}")
-        referral_to_update.stake += amount
-        referral_to_update.reward += percentage * amount
-
-        referring_user.totalReferralsStakes += amount
-        # Save the referral level down to the 5th level in redis for improved performance
-        referring_user.wallet.earnings += percentage * amount
-        referring_user.wallet.availableReferralEarning += percentage * amount
-        referring_user.wallet.totalReferralEarnings += percentage * amount
-        referring_user.wallet.totalReferralBonus += percentage * amount
-
-        LOGGER.info(f"REFERAL EARNING FOR {referring_user.firstName if referring_user.firstName else referring_user.userId} from {referral.firstName if referral.firstName else referral.userId}: {Decimal(percentage * amount):.2f}")
-        # ####### END ######### #
-
-        ref_activity = Activities(activityType=ActivityType.REFERRAL, strDetail="Referral Bonus", suiAmount=Decimal(percentage * amount), userUid=referring_user.uid)
-
-
-        # if the referrer is not none and has atleast one referral
-        ref_deposit = Decimal(0.000000000)
-        if referring_user.totalReferrals > Decimal(0):
-            for ref in referrals:
-                refd_db = await session.exec(select(User).where(User.uid == ref.userUid))
-                refd = refd_db.first()
-                if refd is not None:
-                    ref_deposit += refd.staking.deposit
-
-            if (ref_deposit >= (referring_user.staking.deposit * 2)) and not referring_user.usedSpeedBoost:
-                referring_user.staking.roi += Decimal(0.005)
-                referring_user.usedSpeedBoost = True
-        # End Speed Boost
-
-        session.add(ref_activity)
-
-        await session.commit()
+    async def add_referrer_earning(self, referral: User, amount: Decimal, session: AsyncSession) -> List[str]:
+        """
+        Pays the referral bonus on a stake of `amount` by `referral` to their uplines, five levels up.
+        The whole upline chain is loaded with one recursive CTE and the bonuses are written with one
+        batched update per table, in the caller's transaction. Returns the userIds of the uplines
+        paid, whose cached referral summaries the caller drops once it commits.
+        """
+        uplines = upline_query([referral.uid], depth=len(REFERRAL_BONUS_RATES))
+        db_result = await session.exec(
+            select(
+                uplines.c.level,
+                User.uid,
+                User.userId,
+                User.totalReferrals,
+                User.referralsDeposit,
+                User.usedSpeedBoost,
+                UserStaking.deposit,
+                UserReferral.uid.label("referralUid"),
+            )
+            .join(User, User.uid == uplines.c.uid)
+            .outerjoin(UserStaking, UserStaking.userUid == User.uid)
+            .outerjoin(UserReferral, (UserReferral.userId == User.userId) & (UserReferral.theirUserId == referral.userId))
+            .order_by(uplines.c.level)
+        )
 
-        if level <= 5 and referring_user.referrer:
-            return await self.add_referrer_earning(referral, referring_user.referrer.userId, amount, level + 1, session)
-        return None
+        referrals, users, wallets, activities, speedBoosts, uplineUserIds = [], [], [], [], [], []
+        levels = set()
+        for row in db_result.all():
+            if row.level in levels:
+                continue
+            levels.add(row.level)
+
+            if row.referralUid is None:
+                LOGGER.debug(f"NO REFERRAL RECORD FOR {referral.userId} UNDER {row.userId}, STOPPING AT LEVEL {row.level}")
+                break
+
+            # ####### Calculate Referral Bonuses
+            bonus = REFERRAL_BONUS_RATES[row.level] * amount
+            referrals.append({"uid": row.referralUid, "stake": amount, "reward": bonus})
+            uplineUserIds.append(row.userId)
+            users.append({"uid": row.uid, "totalReferralsStakes": amount})
+            wallets.append({
+                "userUid": row.uid,
+                "earnings": bonus,
+                "availableReferralEarning": bonus,
+                "totalReferralEarnings": bonus,
+                "totalReferralBonus": bonus,
+            })
+            activities.append(
+                Activities(activityType=ActivityType.REFERRAL, strDetail="Referral Bonus", suiAmount=bonus, userUid=row.uid)
+            )
+            referredBy = referral.firstName if referral.firstName else referral.userId
+            LOGGER.info(f"REFERAL EARNING FOR {row.userId} from {referredBy}: {bonus:.2f}")
+
+            # speed boost once the level 1 referrals have staked twice the upline's own stake
+            if (
+                row.deposit is not None
+                and row.totalReferrals > Decimal(0)
+                and not row.usedSpeedBoost
+                and row.referralsDeposit >= row.deposit * 2
+            ):
+                speedBoosts.append(row.uid)
+
+        await bulk_update(session, UserReferral, "uid", referrals, increments=("stake", "reward"))
+        await bulk_update(session, User, "uid", users, increments=("totalReferralsStakes",))
+        await bulk_update(
+            session,
+            UserWallet,
+            "userUid",
+            wallets,
+            increments=("earnings", "availableReferralEarning", "totalReferralEarnings", "totalReferralBonus"),
+        )
+        session.add_all(activities)
+
+        if speedBoosts:
+            db_result = await session.execute(
+                update(User)
+                .where(User.uid.in_(speedBoosts))
+                .where(User.usedSpeedBoost == False)
+                .values(usedSpeedBoost=True)
+                .returning(User.uid)
+                .execution_options(synchronize_session=False)
+            )
+            boosted = db_result.scalars().all()
+            if boosted:
+                await session.execute(
+                    update(UserStaking)
+                    .where(UserStaking.userUid.in_(boosted))
+                    .values(roi=UserStaking.roi + SPEED_BOOST_ROI)
+                    .execution_options(synchronize_session=False)
+                )
+        return uplineUserIds
 
     # ##### TODO:END
 
@@ -871,7 +906,7 @@ class UserServices:
         user.wallet.availableReferralEarning += 0.00
         user.wallet.totalWithdrawn += withdawable_amount
         user.wallet.staking.deposit += redepositable_amount
-        new_activity = Activities(activityType=ActivityType.DEPOSIT, strDetail="New deposit added from withdrawal", suiAmount=redepositable_amount, userUid=user.uid)
+        new_activity = Activities(activityType=ActivityType.DEPOSIT, strDetail=REDEPOSIT_DETAIL, suiAmount=redepositable_amount, userUid=user.uid)
         session.add(new_activity)
 
         # Share another 10% to the global matrix pool
@@ -0,0 +1,155 @@
+import asyncio
+import contextlib
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Sequence
+
+from sqlalchemy import String, cast
+from sqlmodel import func
+
+from src.apps.accounts.models import User
+from src.config.settings import Config
+from src.db.redis import acquire_lease, get_sweep_cursor, lease_held, release_lease, renew_lease, set_sweep_cursor
+from src.db.streaming import stream_keyset
+from src.errors import LeaseLost
+from src.utils.logger import LOGGER
+
+
+@contextlib.asynccontextmanager
+async def lease(name: str, ttl: Optional[int] = None) -> AsyncIterator[bool]:
+    """
+    Holds the redis lease on `name` while the block runs, yielding False when another worker
+    already holds it. The lease is renewed in the background every third of `ttl`, so a long run
+    keeps it and a crashed one loses it within `ttl` seconds. When the lease is lost, or can't be
+    renewed before it runs out, the block is cancelled where it is waiting, before it gets to
+    commit alongside the worker that takes the lease over, and `LeaseLost` is raised.
+    """
+    ttl = ttl or Config.SWEEP_LEASE_TTL
+    token = uuid.uuid4().hex
+    if not await acquire_lease(name, token, ttl):
+        yield False
+        return
+
+    guarded = asyncio.current_task()
+    lost = False
+
+    async def renew() -> None:
+        nonlocal lost
+        expires = time.monotonic() + ttl
+        while True:
+            await asyncio.sleep(ttl / 3)
+            started = time.monotonic()
+            try:
+                renewed = await renew_lease(name, token, ttl)
+            except Exception as e:
+                LOGGER.error(f"Could not renew the lease on {name}: {e}")
+                # retried on the next round while the lease outlasts it
+                if started + ttl / 3 < expires:
+                    continue
+                renewed = False
+            if not renewed:
+                LOGGER.error(f"Lost the lease on {name}, stopping the run before another worker starts it")
+                lost = True
+                guarded.cancel()
+                return
+            expires = started + ttl
+
+    renewer = asyncio.create_task(renew())
+    try:
+        yield True
+    except asyncio.CancelledError:
+        # only the cancellation sent by the renewer becomes LeaseLost, any other one goes on
+        if lost and guarded.uncancel() == 0:
+            raise LeaseLost(f"Lost the lease on {name}") from None
+        raise
+    finally:
+        renewer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await renewer
+        try:
+            await release_lease(name, token)
+        except Exception as e:
+            # the lease runs out by itself, don't hide how the block ended
+            LOGGER.error(f"Could not release the lease on {name}: {e}")
+
+
+async def run_exclusive(job: str, run: Callable[[], Awaitable]) -> bool:
+    """Runs a periodic job unless the previous run still holds its lease, returns whether it ran"""
+    async with lease(job) as acquired:
+        if not acquired:
+            LOGGER.info(f"{job} is still running, skipping this run")
+            return False
+        await run()
+    return True
+
+
+class ShardedSweep:
+    """
+    Splits a periodic sweep over the users into `shards` shards by the hash of their uid, so each
+    shard runs as its own celery task and the sweep spreads over every worker. A shard holds the
+    lease `{job}:{shard}` while it runs, so a shard still running is skipped instead of stacked.
+    It walks its users in uid order a page at a time and checkpoints the last uid in redis after
+    each page, a crashed shard picks up from there on its next run. The checkpoint is cleared once
+    the shard reaches its last user.
+    """
+
+    def __init__(self, job: str, shards: Optional[int] = None, pageSize: Optional[int] = None) -> None:
+        self.job = job
+        self.shards = shards or Config.SWEEP_SHARDS
+        self.pageSize = pageSize or Config.SWEEP_PAGE_SIZE
+
+    def in_shard(self, shard: int):
+        """Where clause matching the users of `shard`"""
+        # hashtext can be negative, masking the sign bit keeps the modulo in range
+        return func.hashtext(cast(User.uid, String)).op("&")(0x7FFFFFFF) % self.shards == shard
+
+    def _lease_name(self, shard: int) -> str:
+        return f"{self.job}:{shard}"
+
+    async def dispatch(self, task) -> List[int]:
+        """Queues `task(shard)` for every shard not already running, returns the queued shards"""
+        queued = []
+        for shard in range(self.shards):
+            if await lease_held(self._lease_name(shard)):
+                LOGGER.info(f"{self.job} shard {shard} is still running, skipping it")
+                continue
+            task.delay(shard)
+            queued.append(shard)
+        return queued
+
+    async def run_shard(
+        self, shard: int, query, process: Callable[[AsyncIterator[Sequence], Callable[[Sequence], Awaitable]], Awaitable]
+    ) -> int:
+        """
+        Streams the users of `shard` from its checkpoint on, a page at a time, into one
+        `process(pages, pageDone)` call. `process` awaits `pageDone(page)` once a page is handled,
+        in page order, which moves the checkpoint past it. `query` is a select of plain columns
+        including `User.uid`, returns the number of rows processed.
+        """
+        if not 0 <= shard < self.shards:
+            raise ValueError(f"{self.job} has no shard {shard}, it has {self.shards}")
+
+        processed = 0
+        async with lease(self._lease_name(shard)) as acquired:
+            if not acquired:
+                LOGGER.info(f"{self.job} shard {shard} is still running, skipping it")
+                return processed
+
+            cursor = await get_sweep_cursor(self.job, shard)
+            if cursor is not None:
+                LOGGER.info(f"{self.job} shard {shard} resuming after {cursor}")
+            after = uuid.UUID(cursor) if cursor is not None else None
+            pages = stream_keyset(query.where(self.in_shard(shard)), User.uid, chunkSize=self.pageSize, after=after)
+
+            async def pageDone(rows: Sequence) -> None:
+                nonlocal processed
+                processed += len(rows)
+                await set_sweep_cursor(self.job, shard, str(rows[-1].uid))
+
+            await process(pages, pageDone)
+
+            # the shard is done, the next run starts from its first user
+            await set_sweep_cursor(self.job, shard, None)
+
+        LOGGER.info(f"{self.job} shard {shard}: {processed} users swept")
+        return processed
@@ -1,65 +1,71 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from decimal import Decimal
-import pprint
-from typing import Annotated, List, Optional
-from celery import shared_task
-from fastapi import Depends
 
-from sqlalchemy.orm import sessionmaker
-from sqlmodel.ext.asyncio.session import AsyncSession
-
-import ast
-
-from src.apps.accounts.models import MatrixPool, MatrixPoolUsers, TokenMeter, User, UserReferral, UserStaking, UserWallet
+from src.apps.accounts.models import MatrixPool, User, UserWallet
 import yfinance as yf
 
-from src.apps.accounts.services import UserServices
-from src.celery_tasks import celery_app
-from src.db import engine
-from src.db.engine import get_session, get_session_context
+from src.apps.accounts.accruals import DailyAccrual
+from src.apps.accounts.deposits import DepositIngester, DepositPoller, DepositQueueWorker
+from src.apps.accounts.matrix import MatrixPoolSettlement
+from src.apps.accounts.referrals import ReferralCounterReconciler
+from src.apps.accounts.sweeps import ShardedSweep, run_exclusive
+from src.apps.accounts.tree import ReferralTreeAuditor
+from src.celery_tasks import celery_app, run_async
+from src.db.engine import get_session_context
 from src.db.redis import redis_client
-from src.utils.calculations import get_rank, matrix_share
+from src.db.streaming import stream_keyset
 from src.utils.logger import LOGGER
 from sqlmodel import select
 
-user_services = UserServices()
+deposit_poller = DepositPoller()
+deposit_ingester = DepositIngester()
+deposit_queue_worker = DepositQueueWorker()
+daily_accrual = DailyAccrual()
+matrix_pool_settlement = MatrixPoolSettlement()
+referral_counter_reconciler = ReferralCounterReconciler()
+referral_tree_auditor = ReferralTreeAuditor()
+balance_sweep = ShardedSweep("balances")
 
 @celery_app.task(name="fetch_sui_usd_price_hourly")
 def fetch_sui_usd_price_hourly():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(run_cncurrent_tasks())
-    loop.close()
+    run_async(run_cncurrent_tasks())
 
 @celery_app.task(name="check_and_update_balances")
 def check_and_update_balances():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(fetch_sui_balance())
-    loop.close()
+    run_async(balance_sweep.dispatch(run_check_and_update_balances_shard))
+
+@celery_app.task(name="run_check_and_update_balances_shard")
+def run_check_and_update_balances_shard(shard: int):
+    run_async(fetch_sui_balance(shard))
+
+@celery_app.task(name="run_ingest_sui_deposits")
+def run_ingest_sui_deposits():
+    run_async(run_exclusive("ingest_sui_deposits", ingest_sui_deposits))
+
+@celery_app.task(name="run_process_deposit_queue")
+def run_process_deposit_queue():
+    run_async(process_deposit_queue())
 
 @celery_app.task(name="run_calculate_daily_tasks")
 def run_calculate_daily_tasks():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(calculate_daily_tasks())
-    loop.close()
+    run_async(run_exclusive("calculate_daily_tasks", calculate_daily_tasks))
+
+@celery_app.task(name="run_reconcile_referral_counters")
+def run_reconcile_referral_counters():
+    run_async(run_exclusive("reconcile_referral_counters", reconcile_referral_counters))
+
+@celery_app.task(name="run_audit_referral_tree")
+def run_audit_referral_tree():
+    run_async(run_exclusive("audit_referral_tree", audit_referral_tree))
 
 @celery_app.task(name="run_create_matrix_pool")
 def run_create_matrix_pool():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(create_matrix_pool())
-    loop.close()
+    run_async(create_matrix_pool())
 
 @celery_app.task(name="run_calculate_users_matrix_pool_share")
 def run_calculate_users_matrix_pool_share():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(calculate_users_matrix_pool_share())
-    loop.close()
+    run_async(run_exclusive("calculate_users_matrix_pool_share", calculate_users_matrix_pool_share))
 
 
 async def run_cncurrent_tasks():
@@ -79,114 +85,55 @@ async def fetch_sui_price():
         LOGGER.error(e)
 
 
-async def fetch_sui_balance():
-    async with get_session_context() as session:
-        try:
-            now = datetime.now()
-            user_db = await session.exec(select(User).where(User.isBlocked == False))
-            users = user_db.all()
+async def fetch_sui_balance(shard: int):
+    wallets = (
+        select(User.uid, UserWallet.address)
+        .join(UserWallet, UserWallet.userUid == User.uid)
+        .where(User.isBlocked == False)
+    )
+    try:
+        # each user is staked in its own session by the poller
+        await balance_sweep.run_shard(shard, wallets, deposit_poller.sweep)
+    except Exception as e:
+        LOGGER.error(e)
 
-            for user in users:
-                LOGGER.debug(f"checking here: user")
-                await user_services.stake_sui(user, session)
-            await session.close()
-        except Exception as e:
-            LOGGER.error(e)
-            await session.close()
+async def ingest_sui_deposits():
+    try:
+        await deposit_ingester.run()
+    except Exception as e:
+        LOGGER.error(e)
+
+async def process_deposit_queue():
+    try:
+        await deposit_queue_worker.drain()
+    except Exception as e:
+        LOGGER.error(e)
 
 async def calculate_users_matrix_pool_share():
+    try:
+        await matrix_pool_settlement.run()
+    except Exception as e:
+        LOGGER.error(e)
+
+async def calculate_daily_tasks():
+    try:
+        await daily_accrual.run()
+    except Exception as e:
+        LOGGER.error(e)
+
+async def reconcile_referral_counters():
     async with get_session_context() as session:
         try:
-            now = datetime.now()
-            # ###### CALCULATE USERS SHARE TO AN ACTIVE POOL
-            matrix_db = await session.exec(select(MatrixPool).where(MatrixPool.endDate >= now))
-            active_matrix_pool_or_new: Optional[MatrixPool] = matrix_db.first()
-
-            if active_matrix_pool_or_new:
-                payoutTime = active_matrix_pool_or_new.endDate + timedelta(minutes=30)
-                mp_users_db = await session.exec(select(MatrixPoolUsers).where(MatrixPoolUsers.matrixPoolUid == active_matrix_pool_or_new.uid))
-                mp_users: List[MatrixPoolUsers] = mp_users_db.all()
-
-                for mp_user in mp_users:
-                    percentage, earning = await matrix_share(mp_user)
-                    mp_user.matrixShare = percentage
-                    mp_user.matrixEarning = earning
-                    if active_matrix_pool_or_new.endDate <= payoutTime:
-                        mpu_db = await session.exec(select(User).where(User.userId == mp_user.userId))
-                        mpu: Optional[User] = mpu_db.first()
-
-                        mpu.wallet.earnings += earning
-                        mpu.wallet.availableReferralEarning += earning
-                        mpu.wallet.totalReferralEarnings += earning
-
-                    await session.commit()
-                    await session.refresh(mp_user)
-            await session.close()
+            await referral_counter_reconciler.run(session)
         except Exception as e:
             LOGGER.error(e)
-            await session.close()
 
-async def calculate_daily_tasks():
+async def audit_referral_tree():
     async with get_session_context() as session:
         try:
-            now = datetime.now()
-            user_db = await session.exec(select(User).where(User.isBlocked == False))
-            users: List[User] = user_db.all()
-
-            for user in users:
-                # ######### CALCULATTE RANK EARNING ########## #
-
-                db_result = await session.exec(select(UserReferral).where(UserReferral.userUid == user.uid).where(UserReferral.level == 1))
-                referrals = db_result.all()
-
-                rankErning, rank = await get_rank(user.totalTeamVolume, user.wallet.totalDeposit, referrals)
-                stake = user.staking
-
-                if user.rank != rank:
-                    user.rank = rank
-
-                user.wallet.weeklyRankEarnings = rankErning
-                if now.date() == user.lastRankEarningAddedAt.date():
-                    user.wallet.earnings += Decimal(user.wallet.weeklyRankEarnings)
-                    user.wallet.totalRankBonus += Decimal(user.wallet.weeklyRankEarnings)
-                    user.wallet.expectedRankBonus += Decimal(user.wallet.weeklyRankEarnings)
-                    # Update lastRankEarningAddedAt to reflect the latest calculation
-                    user.lastRankEarningAddedAt = now + timedelta(days=7)
-
-
-
-
-
-
-                # ########## CALCULATE ROI AND INTEREST ########## #
-
-                # accrue interest until it reaches 4% then create the end date to be 100 days in the future
-                if (stake.end is None and stake.start is not None) and (stake.roi < Decimal(0.04)) and (stake.nextRoiIncrease == now):
-                    # calculate interest based on remaining days and ensure the roi is less than 4%
-                    new_roi = stake.roi + Decimal(0.005)
-                    stake.roi = new_roi
-                    stake.nextRoiIncrease = now + timedelta(days=5)
-                elif (stake.end is None and stake.start is not None) and stake.roi == Decimal(0.04):
-                    stake.end = now + timedelta(days=100)
-
-                if stake.start is not None:
-                    interest_earned = stake.deposit * new_roi
-                    user.wallet.earnings += Decimal(interest_earned)
-
-                if stake.end.date() == now.date():
-                    stake.roi = Decimal(0)
-                    stake.end = None
-                    stake.nextRoiIncrease = None
-
-
-
-                # session.add(user)
-                await session.commit()
-                await session.refresh(user)
-            await session.close()
+            await referral_tree_auditor.run(session)
         except Exception as e:
             LOGGER.error(e)
-            await session.close()
 
 async def create_matrix_pool():
     async with get_session_context() as session:
@@ -209,37 +156,23 @@ async def create_matrix_pool():
 
 
 async def add_fast_bonus():
-    async with get_session_context() as session:
-        try:
-            now = datetime.now()
-            user_db = await session.exec(select(User).where(User.isBlocked == False))
-            users: List[User] = user_db.all()
-
-            for user in users:
-                ref_db = await session.exec(select(UserReferral).where(UserReferral.userId == user.userId))
-                refs: List[UserReferral] = ref_db.all()
-
-                if refs.level == 1:
-                    fast_boost_time = user.joined + timedelta(hours=24)
-                    # db_referrals = await session.exec(select(UserReferral).where(UserReferral.userId == referring_user.userId).where(UserReferral.level == 1))
-                    # referrals = db_referrals.all()
-
-                    paid_users = []
-                    for u in refs:
-                        ref_db = await session.exec(select(User).where(User.userId == u.userId))
-                        referrer = ref_db.first()
-                        if referrer and referrer.staking.deposit >= Decimal(1):
-                            paid_users.append(u)
-
-                    if user.joined < fast_boost_time and len(paid_users) >= 2:
-                        user.wallet.totalFastBonus += Decimal(1.00)
-                        user.staking.deposit += Decimal(1.00)
-
-                # ###### CHECK IF THE REFERRING USER HAS A REFERRER THEN REPEAT THE PROCESS AGAIN
-            await session.close()
-        except Exception as e:
-            LOGGER.error(e)
-            await session.close()
+    """
+    Counts the users the fast bonus is meant for, streamed in keyset chunks so only one chunk of
+    users is held at a time. The bonus has never been written, the job always closed its session
+    without committing, so nothing is paid until its rules are settled.
+    """
+    # paidReferrals is the number of level 1 referrals holding a stake
+    candidates = select(User.uid).where(User.isBlocked == False).where(User.paidReferrals >= 2)
+    eligible = 0
+    try:
+        async for rows in stream_keyset(candidates, User.uid):
+            eligible += len(rows)
+    except Exception as e:
+        LOGGER.error(e)
+        return None
+    LOGGER.info(f"Fast bonus: {eligible} users with two paid referrals, nothing paid")
+    return None
+
 
 
 
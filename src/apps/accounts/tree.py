@@ -0,0 +1,197 @@
+import time
+import uuid
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.apps.accounts.models import User, UserStaking
+from src.apps.accounts.referrals import MAX_REFERRAL_DEPTH, PAID_REFERRAL_MIN, TEAM_VOLUME_DEPTH, redeposit_totals
+from src.apps.accounts.schemas import ReferralTreeAudit
+from src.db.bulk import bulk_update
+from src.db.engine import get_session_context
+from src.db.streaming import stream_keyset
+from src.utils.logger import LOGGER
+
+# stakes are held as integer nano sui so the sums are exact
+NANO = 10**9
+
+# mismatched userIds listed in an audit
+AUDIT_USER_IDS_LIMIT = 100
+
+
+# counters kept incrementally on `User` that the snapshot recomputes, with the sui amounts in nano sui
+COUNTERS = ("totalTeamVolume", "totalNetwork", "totalReferrals", "paidReferrals", "referralsDeposit")
+SUI_COUNTERS = ("totalTeamVolume", "referralsDeposit")
+
+
+class ReferralTreeSnapshot:
+    """
+    Columnar copy of the whole referral tree read in one scan: the users in uid order, the index of
+    every user's referrer in `parent` (-1 without one), their stake and what they staked from
+    deposits, both in nano sui, and the network counters currently stored on them. The counters of
+    every user are recomputed from it with vectorized passes up the tree, one per level, instead of
+    walking uplines user by user. A stake only ever grows, by a deposit, which adds the same amount
+    to the team volume of the staker's uplines and to their referrer's referral deposits, or by a
+    redeposit from a withdrawal, which adds to neither, so the deposits are the stake less its
+    redeposits.
+    """
+
+    def __init__(
+        self,
+        uids: List[uuid.UUID],
+        userIds: List[str],
+        parent: np.ndarray,
+        stake: np.ndarray,
+        deposited: np.ndarray,
+        counters: Dict[str, np.ndarray],
+    ) -> None:
+        self.uids = uids
+        self.userIds = userIds
+        self.parent = parent
+        self.stake = stake
+        self.deposited = deposited
+        self.counters = counters
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    @classmethod
+    async def load(cls) -> "ReferralTreeSnapshot":
+        """
+        Reads the tree in a session of its own whose transaction is repeatable read from its first
+        statement, so every chunk is read from the same snapshot of the database.
+        """
+        uids: List[uuid.UUID] = []
+        userIds: List[str] = []
+        referrers: List[Optional[uuid.UUID]] = []
+        stakes: List[int] = []
+        deposits: List[int] = []
+        counters: Dict[str, List[int]] = {name: [] for name in COUNTERS}
+        redeposits = redeposit_totals()
+        query = (
+            select(
+                User.uid,
+                User.userId,
+                User.referrer_id,
+                func.coalesce(UserStaking.deposit, 0).label("deposit"),
+                func.coalesce(redeposits.c.redeposited, 0).label("redeposited"),
+                *(getattr(User, name) for name in COUNTERS),
+            )
+            .outerjoin(UserStaking, UserStaking.userUid == User.uid)
+            .outerjoin(redeposits, redeposits.c.userUid == User.uid)
+        )
+        async with get_session_context() as session:
+            await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            async for rows in stream_keyset(query, User.uid, session):
+                for row in rows:
+                    uids.append(row.uid)
+                    userIds.append(row.userId)
+                    referrers.append(row.referrer_id)
+                    stakes.append(_nano(row.deposit))
+                    deposits.append(_nano(row.deposit) - _nano(row.redeposited))
+                    for name in COUNTERS:
+                        value = getattr(row, name) or 0
+                        counters[name].append(_nano(value) if name in SUI_COUNTERS else int(value))
+
+        index: Dict[uuid.UUID, int] = {uid: position for position, uid in enumerate(uids)}
+        parent = np.fromiter((index.get(referrer, -1) for referrer in referrers), dtype=np.int64, count=len(uids))
+        return cls(
+            uids,
+            userIds,
+            parent,
+            np.asarray(stakes, dtype=np.int64),
+            np.asarray(deposits, dtype=np.int64),
+            {name: np.asarray(values, dtype=np.int64) for name, values in counters.items()},
+        )
+
+    def sum_up(self, values: np.ndarray, depth: int) -> np.ndarray:
+        """Sum of `values` over every user's downlines from level 1 to level `depth`"""
+        totals = np.zeros(len(self), dtype=np.int64)
+        sources = np.arange(len(self), dtype=np.int64)
+        ancestor = self.parent.copy()
+        for _ in range(depth):
+            alive = ancestor >= 0
+            if not alive.any():
+                break
+            sources, ancestor = sources[alive], ancestor[alive]
+            np.add.at(totals, ancestor, values[sources])
+            ancestor = self.parent[ancestor]
+        return totals
+
+    def recompute(self) -> Dict[str, np.ndarray]:
+        """What each of the `COUNTERS` of every user should be, the sui amounts in nano sui"""
+        members = np.ones(len(self), dtype=np.int64)
+        paid = (self.stake >= _nano(PAID_REFERRAL_MIN)).astype(np.int64)
+        return {
+            "totalTeamVolume": self.sum_up(self.deposited, TEAM_VOLUME_DEPTH),
+            "totalNetwork": self.sum_up(members, MAX_REFERRAL_DEPTH),
+            "totalReferrals": self.sum_up(members, 1),
+            "paidReferrals": self.sum_up(paid, 1),
+            "referralsDeposit": self.sum_up(self.deposited, 1),
+        }
+
+
+def _nano(value) -> int:
+    return int((Decimal(value) * NANO).to_integral_value())
+
+
+def _from_nano(value: int) -> Decimal:
+    return Decimal(value) / NANO
+
+
+class ReferralTreeAuditor:
+    """
+    Whole-network audit of the network counters kept incrementally on `User`: team volume, network
+    size and the level 1 referral counters. A `ReferralTreeSnapshot` recomputes them for every user
+    and the drifted ones are optionally written back. The fixes are increments of the drift seen in
+    the snapshot, written after it is released, so counters bumped by deposits or sign ups since
+    the snapshot was read keep those.
+    """
+
+    async def run(self, session: AsyncSession, repair: bool = False) -> ReferralTreeAudit:
+        started = time.perf_counter()
+        snapshot = await ReferralTreeSnapshot.load()
+
+        expected = snapshot.recompute()
+        drift = {name: expected[name] - snapshot.counters[name] for name in COUNTERS}
+        # the stored amounts carry more than nine decimals and every stake is rounded to the nano
+        # in the snapshot, so a sum may be off by up to a nano per stake in it without any drift
+        staked = (snapshot.stake > 0).astype(np.int64)
+        for name, depth in (("totalTeamVolume", TEAM_VOLUME_DEPTH), ("referralsDeposit", 1)):
+            drift[name][np.abs(drift[name]) <= snapshot.sum_up(staked, depth)] = 0
+        drifted = np.zeros(len(snapshot), dtype=bool)
+        for name in COUNTERS:
+            drifted |= drift[name] != 0
+        mismatched = np.flatnonzero(drifted)
+
+        audit = ReferralTreeAudit(
+            checked=len(snapshot),
+            mismatched=len(mismatched),
+            repaired=repair,
+            mismatchedCounters={
+                name: int(np.count_nonzero(drift[name])) for name in COUNTERS if np.count_nonzero(drift[name])
+            },
+            mismatchedUserIds=[snapshot.userIds[position] for position in mismatched[:AUDIT_USER_IDS_LIMIT]],
+        )
+
+        if repair and len(mismatched):
+            fixes = []
+            for position in mismatched:
+                fix = {"uid": snapshot.uids[position]}
+                for name in COUNTERS:
+                    delta = int(drift[name][position])
+                    fix[name] = _from_nano(delta) if name in SUI_COUNTERS else delta
+                fix["totalReferrals"] = Decimal(fix["totalReferrals"])
+                fixes.append(fix)
+            await bulk_update(session, User, "uid", fixes, increments=COUNTERS)
+            await session.commit()
+        audit.elapsed = time.perf_counter() - started
+
+        LOGGER.info(
+            f"Referral tree audit: {audit.checked} users in {audit.elapsed:.2f}s, {audit.mismatched} mismatched"
+            f"{', repaired' if repair and audit.mismatched else ''} {audit.mismatchedCounters}"
+        )
+        return audit
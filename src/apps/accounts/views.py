@@ -6,18 +6,73 @@ from fastapi import APIRouter, BackgroundTasks, Body, Depends, File, Path, Query
 from fastapi.responses import JSONResponse
 from fastapi_pagination import Page, paginate
 
+from sqlalchemy import delete
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from src.apps.accounts.dependencies import AccessTokenBearer, RefreshTokenBearer, TokenBearer, admin_permission_check, get_current_user
-from src.apps.accounts.models import MatrixPool, MatrixPoolUsers, TokenMeter, User, UserReferral, UserWallet
-from src.apps.accounts.schemas import AccessToken, ActivitiesRead, AdminLogin, AllStatisticsRead, DeleteMessage, Message, MatrixPoolRead, MatrixUserCreateUpdate, RegAndLoginResponse, SignedTTransactionBytesMessage, StakingCreate, SuiDollarRate, TokenMeterCreate, TokenMeterRead, TokenMeterUpdate, UserCreateOrLoginSchema, UserLoginSchema, UserRead, UserUpdateSchema, UserWithReferralsRead, WithdrawEarning, Withdrawal
+from src.apps.accounts.dependencies import (
+    AccessTokenBearer,
+    RefreshTokenBearer,
+    TokenBearer,
+    admin_permission_check,
+    get_current_principal,
+    get_current_user,
+)
+from src.apps.accounts.deposits import enqueue_deposits, process_deposit_queue_later
+from src.apps.accounts.loaders import AUTH, PROFILE_VIEW, WALLET_OPS
+from src.apps.accounts.models import (
+    Activities,
+    MatrixPool,
+    MatrixPoolUsers,
+    PendingTransactions,
+    TokenMeter,
+    User,
+    UserReferral,
+    UserStaking,
+    UserWallet,
+)
+from src.apps.accounts.referrals import remove_from_referral_tree
+from src.apps.accounts.schemas import (
+    AccessToken,
+    ActivitiesRead,
+    AdminLogin,
+    AuthPrincipal,
+    AllStatisticsRead,
+    DeleteMessage,
+    Message,
+    MatrixPoolRead,
+    MatrixUserCreateUpdate,
+    ReferralCounterAudit,
+    ReferralTreeAudit,
+    RegAndLoginResponse,
+    SignedTTransactionBytesMessage,
+    StakingCreate,
+    SuiDollarRate,
+    TokenMeterCreate,
+    TokenMeterRead,
+    TokenMeterUpdate,
+    UserCreateOrLoginSchema,
+    UserDownlinesPage,
+    UserLoginSchema,
+    UserRead,
+    UserUpdateSchema,
+    UserWithReferralsRead,
+    WithdrawEarning,
+    Withdrawal,
+)
 from src.apps.accounts.services import AdminServices, UserServices
 from src.celery_beat import TemplateScheduleSQLRepository
 from src.db.engine import get_session
 from src.config.settings import Config
-from src.db.redis import add_jti_to_blocklist, get_level_referrers, get_sui_usd_price
+from src.db.redis import (
+    add_jti_to_blocklist,
+    get_level_referrers,
+    get_sui_usd_price,
+    invalidate_auth_principals,
+    invalidate_referral_summaries,
+)
 from src.errors import ActivePoolNotFound, InvalidTelegramAuthData, InvalidToken, UserAlreadyExists, UserNotFound
+from src.utils.crypto import CryptoExecutorStats, crypto_executor
 from src.utils.hashing import createAccessToken , verifyTelegramAuthData
 from src.utils.logger import LOGGER
 
@@ -40,26 +95,11 @@ celery_beat = TemplateScheduleSQLRepository()
 )
 async def start(form_data: Annotated[UserCreateOrLoginSchema, Body()], session: session, referrer: Optional[str] = None):
     accessToken, refershToken, user = await user_service.register_new_user(referrer, form_data, session)
-    referralsLv1List = await session.exec(select(UserReferral).where(UserReferral.level == 1).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv2List = await session.exec(select(UserReferral).where(UserReferral.level == 2).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv3List = await session.exec(select(UserReferral).where(UserReferral.level == 3).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv4List = await session.exec(select(UserReferral).where(UserReferral.level == 4).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv5List = await session.exec(select(UserReferral).where(UserReferral.level == 5).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    LOGGER.debug(referralsLv2List.all())
-
-    referralsLv1 = referralsLv1List.all()
-    referralsLv2 = referralsLv2List.all()
-    referralsLv3 = referralsLv3List.all()
-    referralsLv4 = referralsLv4List.all()
-    referralsLv5 = referralsLv5List.all()
+    referrals = await user_service.get_referral_summary(user, session)
 
     userResp = {
         "user": user,
-        "referralsLv1": referralsLv1,
-        "referralsLv2": referralsLv2,
-        "referralsLv3": referralsLv3,
-        "referralsLv4": referralsLv4,
-        "referralsLv5": referralsLv5
+        **referrals,
     }
     return {
         "message": "Authorization Successful",
@@ -76,26 +116,11 @@ async def start(form_data: Annotated[UserCreateOrLoginSchema, Body()], session:
 )
 async def login(form_data: Annotated[UserLoginSchema, Body()], session: session):
     accessToken, refershToken, user = await user_service.login_user(form_data, session)
-    referralsLv1List = await session.exec(select(UserReferral).where(UserReferral.level == 1).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv2List = await session.exec(select(UserReferral).where(UserReferral.level == 2).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv3List = await session.exec(select(UserReferral).where(UserReferral.level == 3).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv4List = await session.exec(select(UserReferral).where(UserReferral.level == 4).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv5List = await session.exec(select(UserReferral).where(UserReferral.level == 5).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    LOGGER.debug(referralsLv2List.all())
-
-    referralsLv1 = referralsLv1List.all()
-    referralsLv2 = referralsLv2List.all()
-    referralsLv3 = referralsLv3List.all()
-    referralsLv4 = referralsLv4List.all()
-    referralsLv5 = referralsLv5List.all()
+    referrals = await user_service.get_referral_summary(user, session)
 
     userResp = {
         "user": user,
-        "referralsLv1": referralsLv1,
-        "referralsLv2": referralsLv2,
-        "referralsLv3": referralsLv3,
-        "referralsLv4": referralsLv4,
-        "referralsLv5": referralsLv5
+        **referrals,
     }
     return {
         "message": "Authorization Successful",
@@ -112,25 +137,11 @@ async def login(form_data: Annotated[UserLoginSchema, Body()], session: session)
 )
 async def admin_login(request: Request, form_data: Annotated[AdminLogin, Body(...)], session: session):
     accessToken, refershToken, user = await user_service.authenticate_user(form_data, session)
-    referralsLv1List = await session.exec(select(UserReferral).where(UserReferral.level == 1).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv2List = await session.exec(select(UserReferral).where(UserReferral.level == 2).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv3List = await session.exec(select(UserReferral).where(UserReferral.level == 3).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv4List = await session.exec(select(UserReferral).where(UserReferral.level == 4).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv5List = await session.exec(select(UserReferral).where(UserReferral.level == 5).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-
-    referralsLv1 = referralsLv1List.all()
-    referralsLv2 = referralsLv2List.all()
-    referralsLv3 = referralsLv3List.all()
-    referralsLv4 = referralsLv4List.all()
-    referralsLv5 = referralsLv5List.all()
+    referrals = await user_service.get_referral_summary(user, session)
 
     userResp = {
         "user": user,
-        "referralsLv1": referralsLv1,
-        "referralsLv2": referralsLv2,
-        "referralsLv3": referralsLv3,
-        "referralsLv4": referralsLv4,
-        "referralsLv5": referralsLv5
+        **referrals,
     }
     return {
         "message": "Authorization Successful",
@@ -241,6 +252,47 @@ async def update_token_meter(form_data: Annotated[TokenMeterUpdate, Body()], ses
     tokenMeter = await admin_service.updateTokenRecord(form_data, session)
     return tokenMeter
 
+@auth_router.post(
+    "/reconcile-referral-counters",
+    status_code=status.HTTP_200_OK,
+    response_model=ReferralCounterAudit,
+    dependencies=[Depends(admin_permission_check)],
+    description=(
+        "Audits the next batch of level 1 referral counters against the referral tree, "
+        "repairing any that drifted unless repair is false."
+    )
+)
+async def reconcile_referral_counters(session: session, repair: bool = True):
+    audit = await admin_service.reconcileReferralCounters(repair, session)
+    return audit
+
+@auth_router.post(
+    "/audit-referral-tree",
+    status_code=status.HTTP_200_OK,
+    response_model=ReferralTreeAudit,
+    dependencies=[Depends(admin_permission_check)],
+    description=(
+        "Recomputes the team volume, network and level 1 referral counters of every user from a snapshot "
+        "of the referral tree, writing back the ones that drifted when repair is true."
+    )
+)
+async def audit_referral_tree(session: session, repair: bool = False):
+    audit = await admin_service.auditReferralTree(repair, session)
+    return audit
+
+@auth_router.get(
+    "/crypto-metrics",
+    status_code=status.HTTP_200_OK,
+    response_model=CryptoExecutorStats,
+    dependencies=[Depends(admin_permission_check)],
+    description=(
+        "Returns the queue depth and the p50/p99 wait and run times in seconds "
+        "of the hashing and signing thread pool of this worker."
+    )
+)
+async def crypto_metrics():
+    return crypto_executor.stats()
+
 @auth_router.get(
     "/{userId}",
     status_code=status.HTTP_200_OK,
@@ -249,27 +301,13 @@ async def update_token_meter(form_data: Annotated[TokenMeterUpdate, Body()], ses
     description="Returns a specific user to an admin"
 )
 async def get_a_user(userId: str, session: session):
-    db_user = await session.exec(select(User).where(User.userId == userId))
+    db_user = await session.exec(select(User).options(*PROFILE_VIEW).where(User.userId == userId))
     user = db_user.first()
-    referralsLv1List = await session.exec(select(UserReferral).where(UserReferral.level == 1).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv2List = await session.exec(select(UserReferral).where(UserReferral.level == 2).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv3List = await session.exec(select(UserReferral).where(UserReferral.level == 3).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv4List = await session.exec(select(UserReferral).where(UserReferral.level == 4).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv5List = await session.exec(select(UserReferral).where(UserReferral.level == 5).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-
-    referralsLv1 = referralsLv1List.all()
-    referralsLv2 = referralsLv2List.all()
-    referralsLv3 = referralsLv3List.all()
-    referralsLv4 = referralsLv4List.all()
-    referralsLv5 = referralsLv5List.all()
+    referrals = await user_service.get_referral_summary(user, session)
 
     return {
         "user": user,
-        "referralsLv1": referralsLv1,
-        "referralsLv2": referralsLv2,
-        "referralsLv3": referralsLv3,
-        "referralsLv4": referralsLv4,
-        "referralsLv5": referralsLv5,
+        **referrals,
     }
 
 @auth_router.delete(
@@ -280,37 +318,21 @@ async def get_a_user(userId: str, session: session):
     description="Returns a specific user to an admin"
 )
 async def delete_a_user(userId: str, session: session):
-    db_user = await session.exec(select(User).where(User.userId == userId))
+    db_user = await session.exec(select(User).options(*AUTH).where(User.userId == userId))
     user = db_user.first()
-    db_pool_users = await session.exec(select(MatrixPoolUsers).where(MatrixPoolUsers.userId == userId))
-    all_pool = db_pool_users.all()
-    ref_db = await session.exec(select(User).where(User.userId == user.referrer.userId))
-    referrer = ref_db.first()
+    if user is None:
+        raise UserNotFound()
 
-    if referrer is not None:
-        referrer.totalNetwork -= 1
-        referrer.totalReferrals -= 1
+    uplineUserIds = await remove_from_referral_tree(user, session)
 
-    if user.wallet:
-        await session.delete(user.wallet)
-
-    if user.staking:
-        await session.delete(user.staking)
-
-    if user.referrer:
-        await session.delete(user.referrer)
-
-    for ctivity in user.activities:
-        await session.delete(ctivity)
-
-    for pu in all_pool:
-        await session.delete(pu)
-
-    for pt in user.pendingTransactions:
-        await session.delete(pt)
-
-    await session.delete(user)
+    # the user's rows go with one DELETE per table instead of loading their collections
+    for model in (UserWallet, UserStaking, UserReferral, Activities, PendingTransactions):
+        await session.execute(delete(model).where(model.userUid == user.uid))
+    await session.execute(delete(MatrixPoolUsers).where(MatrixPoolUsers.userId == userId))
+    await session.execute(delete(User).where(User.uid == user.uid))
     await session.commit()
+    await invalidate_auth_principals([userId])
+    await invalidate_referral_summaries([userId, *uplineUserIds])
 
     return {
         "message": "Successfully Deleted",
@@ -324,29 +346,15 @@ async def delete_a_user(userId: str, session: session):
     description="Update records for a specific user by providing their userId as a required field ad then the body form data to update with"
 )
 async def update_profile(userId: str, form_data: Annotated[UserUpdateSchema, Body()], session: session):
-    db_user = await session.exec(select(User).where(User.userId == userId))
+    db_user = await session.exec(select(User).options(*PROFILE_VIEW).where(User.userId == userId))
     user = db_user.first()
 
     res_user = await user_service.updateUserProfile(user, form_data, session)
-    referralsLv1List = await session.exec(select(UserReferral).where(UserReferral.level == 1).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv2List = await session.exec(select(UserReferral).where(UserReferral.level == 2).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv3List = await session.exec(select(UserReferral).where(UserReferral.level == 3).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv4List = await session.exec(select(UserReferral).where(UserReferral.level == 4).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv5List = await session.exec(select(UserReferral).where(UserReferral.level == 5).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-
-    referralsLv1 = referralsLv1List.all()
-    referralsLv2 = referralsLv2List.all()
-    referralsLv3 = referralsLv3List.all()
-    referralsLv4 = referralsLv4List.all()
-    referralsLv5 = referralsLv5List.all()
+    referrals = await user_service.get_referral_summary(user, session)
 
     return {
         "user": res_user,
-        "referralsLv1": referralsLv1,
-        "referralsLv2": referralsLv2,
-        "referralsLv3": referralsLv3,
-        "referralsLv4": referralsLv4,
-        "referralsLv5": referralsLv5,
+        **referrals,
     }
 
 
@@ -385,49 +393,46 @@ async def get_token_meter(session: session):
 async def me(user: Annotated[User, Depends(get_current_user)], session: session):
     LOGGER.debug(f"user: {user}")
 
-    referralsLv1List = await session.exec(statement = select(UserReferral).where(UserReferral.level == 1).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv2List = await session.exec(statement = select(UserReferral).where(UserReferral.level == 2).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv3List = await session.exec(statement = select(UserReferral).where(UserReferral.level == 3).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv4List = await session.exec(statement = select(UserReferral).where(UserReferral.level == 4).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv5List = await session.exec(statement = select(UserReferral).where(UserReferral.level == 5).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-
-    referralsLv1 = referralsLv1List.all()
-    referralsLv2 = referralsLv2List.all()
-    referralsLv3 = referralsLv3List.all()
-    referralsLv4 = referralsLv4List.all()
-    referralsLv5 = referralsLv5List.all()
+    referrals = await user_service.get_referral_summary(user, session)
 
     return {
         "user": user,
-        "referralsLv1": referralsLv1,
-        "referralsLv2": referralsLv2,
-        "referralsLv3": referralsLv3,
-        "referralsLv4": referralsLv4,
-        "referralsLv5": referralsLv5,
+        **referrals,
     }
 
 @user_router.get(
     "/referrals",
     status_code=status.HTTP_200_OK,
-    response_model=Page[UserRead],
-    dependencies=[Depends(get_current_user)],
-    description="Returns a paginated list of all actvities to an admin"
+    response_model=UserDownlinesPage,
+    dependencies=[Depends(get_current_principal)],
+    description=(
+        "Returns a page of the user's downlines at a level in join order. Pass the `nextCursor` of a page as `cursor` "
+        "to get the next one, and `withTotal=false` to skip counting the level."
+    )
 )
-async def user_referrals(user: Annotated[User, Depends(get_current_user)], session: session, level: int):
-    LOGGER.debug(f"user: {user}")
-    referrals = await user_service.get_user_downlines(user, level, session)
-
-    return paginate(referrals)
+async def user_referrals(
+    principal: Annotated[AuthPrincipal, Depends(get_current_principal)],
+    session: session,
+    level: Annotated[int, Query(ge=1)],
+    cursor: Optional[str] = None,
+    size: Annotated[int, Query(ge=1, le=100)] = 50,
+    withTotal: bool = True,
+):
+    referrals = await user_service.get_downline_page(principal.uid, level, session, cursor, size, withTotal)
+    return referrals
 
 @user_router.post(
     "/me/stake",
     status_code=status.HTTP_201_CREATED,
     response_model=SignedTTransactionBytesMessage,
-    dependencies=[Depends(get_current_user)],
+    dependencies=[Depends(get_current_principal)],
     description="Initiates a stake and staarts the countdown to a 100days"
 )
-async def initiate_a_stake(user: Annotated[User, Depends(get_current_user)], session: session):
-    await user_service.stake_sui(user, session)
+async def initiate_a_stake(principal: Annotated[AuthPrincipal, Depends(get_current_principal)], session: session):
+    # staked by a deposit queue worker, never alongside a sweep of the same user
+    if await enqueue_deposits(session, [principal.uid]):
+        await session.commit()
+        process_deposit_queue_later()
 
     # staked = await user_service.stake_sui(user, session)
     # message = "Initialized/Toppped a Stake"
@@ -441,10 +446,20 @@ async def initiate_a_stake(user: Annotated[User, Depends(get_current_user)], ses
     "/me/withdraw",
     status_code=status.HTTP_201_CREATED,
     response_model=SignedTTransactionBytesMessage,
-    dependencies=[Depends(get_current_user)],
+    dependencies=[Depends(get_current_principal)],
     description="Initiates a withdrawal from the users earning"
 )
-async def withdraw_from_earning(wallet: Annotated[Withdrawal, Body(...)], user: Annotated[User, Depends(get_current_user)], session: session):
+async def withdraw_from_earning(
+    wallet: Annotated[Withdrawal, Body(...)],
+    principal: Annotated[AuthPrincipal, Depends(get_current_principal)],
+    session: session,
+):
+    # the withdrawal only touches the wallet and stake rows, not the rest of the profile
+    db_user = await session.exec(select(User).options(*WALLET_OPS).where(User.uid == principal.uid))
+    user = db_user.first()
+    if user is None:
+        raise UserNotFound()
+
     await user_service.withdrawToUserWallet(user, wallet, session)
     return "Withdrawal successful"
 
@@ -452,11 +467,11 @@ async def withdraw_from_earning(wallet: Annotated[Withdrawal, Body(...)], user:
     "/me/activities",
     status_code=status.HTTP_200_OK,
     response_model=Page[ActivitiesRead],
-    dependencies=[Depends(get_current_user)],
+    dependencies=[Depends(get_current_principal)],
     description="Returns a paginated list of all actvities to an admin"
 )
-async def get_my_activities(user: Annotated[User, Depends(get_current_user)], session: session):
-    activities = await user_service.getUserActivities(user, session)
+async def get_my_activities(principal: Annotated[AuthPrincipal, Depends(get_current_principal)], session: session):
+    activities = await user_service.getUserActivities(principal.uid, session)
     return paginate(activities)
 
 @user_router.patch(
@@ -468,35 +483,21 @@ async def get_my_activities(user: Annotated[User, Depends(get_current_user)], se
 )
 async def update_profile(user: Annotated[User, Depends(get_current_user)], form_data: Annotated[UserUpdateSchema, Body()], session: session):
     res_user = await user_service.updateUserProfile(user, form_data, session)
-    referralsLv1List = await session.exec(select(UserReferral).where(UserReferral.level == 1).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv2List = await session.exec(select(UserReferral).where(UserReferral.level == 2).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv3List = await session.exec(select(UserReferral).where(UserReferral.level == 3).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv4List = await session.exec(select(UserReferral).where(UserReferral.level == 4).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-    referralsLv5List = await session.exec(select(UserReferral).where(UserReferral.level == 5).where(UserReferral.userId == user.userId).order_by(UserReferral.created).limit(50))
-
-    referralsLv1 = referralsLv1List.all()
-    referralsLv2 = referralsLv2List.all()
-    referralsLv3 = referralsLv3List.all()
-    referralsLv4 = referralsLv4List.all()
-    referralsLv5 = referralsLv5List.all()
+    referrals = await user_service.get_referral_summary(user, session)
 
     return {
         "user": res_user,
-        "referralsLv1": referralsLv1,
-        "referralsLv2": referralsLv2,
-        "referralsLv3": referralsLv3,
-        "referralsLv4": referralsLv4,
-        "referralsLv5": referralsLv5,
+        **referrals,
     }
 
 @user_router.get(
     "/matrix-pool",
     status_code=status.HTTP_200_OK,
     response_model=Optional[MatrixPoolRead],
-    dependencies=[Depends(get_current_user)],
+    dependencies=[Depends(get_current_principal)],
     description="Returns the current matrix pool"
 )
-async def get_active_matrix_pool(user: Annotated[User, Depends(get_current_user)], session: session):
+async def get_active_matrix_pool(principal: Annotated[AuthPrincipal, Depends(get_current_principal)], session: session):
     now = datetime.now()
     mp_db = await session.exec(select(MatrixPool).where(MatrixPool.endDate >= now))
     matrix = mp_db.first()
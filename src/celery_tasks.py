@@ -1,13 +1,16 @@
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import json
-from typing import Annotated
+from typing import Annotated, Any, Coroutine, Optional
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_process_shutdown
 from fastapi import Depends
 # from src.celery_beat import TemplateScheduleSQLRepository
 from src.config.settings import Config
 from src.db import engine
+from src.db.redis import redis_pool
+from src.utils.http import http_client
 from src.utils.logger import LOGGER
 
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -44,9 +47,29 @@ celery_app.conf.beat_schedule = {
         'task': 'run_calculate_daily_tasks',
         'schedule': 60 * 60 * 24
     },
+    'run_ingest_sui_deposits': {
+        'task': 'run_ingest_sui_deposits',
+        'schedule': 10
+    },
+    # picks up queued deposits whose worker never got to them and retries the failed ones
+    'run_process_deposit_queue': {
+        'task': 'run_process_deposit_queue',
+        'schedule': 30
+    },
+    # reconciliation sweep for anything the deposit ingester missed
     'check_and_update_balances': {
         'task': 'check_and_update_balances',
-        'schedule': 60
+        'schedule': 60 * 15
+    },
+    # audits the next batch of denormalized referral counters
+    'run_reconcile_referral_counters': {
+        'task': 'run_reconcile_referral_counters',
+        'schedule': 60 * 5
+    },
+    # recomputes every network counter from a snapshot of the referral tree and reports the drift
+    'run_audit_referral_tree': {
+        'task': 'run_audit_referral_tree',
+        'schedule': 60 * 60 * 24
     },
     'run_create_matrix_pool': {
         'task': 'run_create_matrix_pool',
@@ -60,6 +83,54 @@ celery_app.conf.beat_schedule = {
 
 
 
+# Async runtime of the worker processes. Every process runs its tasks on one event loop that lives
+# as long as the process, so the pooled database, redis and http connections bound to that loop are
+# reused from task to task instead of being reopened (with a fresh TLS handshake) on every run.
+worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+@worker_process_init.connect
+def start_worker_loop(**kwargs) -> None:
+    global worker_loop
+    worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(worker_loop)
+    # connections forked from the parent belong to its loop, drop them without closing the parent's sockets
+    engine.engine.sync_engine.dispose(close=False)
+    redis_pool.reset()
+    LOGGER.info("Worker event loop started")
+
+
+@worker_process_shutdown.connect
+def stop_worker_loop(**kwargs) -> None:
+    global worker_loop
+    if worker_loop is None or worker_loop.is_closed():
+        return
+    worker_loop.run_until_complete(http_client.close())
+    worker_loop.run_until_complete(engine.engine.dispose())
+    worker_loop.run_until_complete(redis_pool.disconnect())
+    worker_loop.close()
+    worker_loop = None
+
+
+def run_async(coro: Coroutine[Any, Any, Any]) -> Any:
+    """
+    Runs a task coroutine to completion on the worker process loop. Outside a prefork worker
+    process (solo pool, scripts) it gets a loop of its own, whose connections are closed with it.
+    """
+    if worker_loop is not None and not worker_loop.is_closed():
+        return worker_loop.run_until_complete(coro)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.run_until_complete(http_client.close())
+        loop.run_until_complete(engine.engine.dispose())
+        loop.run_until_complete(redis_pool.disconnect())
+        loop.close()
+
+
 # @celery_app.on_after_configure.connect
 # def setup_periodic_tasks(sender, **kwargs):
 #     loop = asyncio.new_event_loop()
@@ -16,6 +16,54 @@ class BaseConfig(BaseSettings):
     ACCESS_TOKEN_EXPIRY: Optional[int] = 1800
     DOMAIN: str
 
+    # database, SCHEMA is set as the search_path of every connection
+    SCHEMA: Optional[str] = None
+    # web, worker or bot, picks the connection pool size of the process
+    PROCESS_ROLE: Optional[str] = "web"
+    DB_POOL_SIZE_WEB: Optional[int] = 5
+    DB_MAX_OVERFLOW_WEB: Optional[int] = 10
+    DB_POOL_SIZE_WORKER: Optional[int] = 3
+    DB_MAX_OVERFLOW_WORKER: Optional[int] = 5
+    DB_POOL_SIZE_BOT: Optional[int] = 1
+    DB_MAX_OVERFLOW_BOT: Optional[int] = 2
+
+    # deposit sweep
+    DEPOSIT_SWEEP_CONCURRENCY: Optional[int] = 25
+    DEPOSIT_INGEST_CHECKPOINT_BATCH: Optional[int] = 50
+    DEPOSIT_INGEST_MAX_CHECKPOINTS: Optional[int] = 1000
+
+    # deposit queue, failed entries are retried after DEPOSIT_QUEUE_RETRY_DELAY seconds, doubled per attempt.
+    # Every claimer holds a connection, so the concurrency is capped at the process role's pool size.
+    DEPOSIT_QUEUE_CONCURRENCY: Optional[int] = 10
+    DEPOSIT_QUEUE_MAX_CLAIMS: Optional[int] = 1000
+    DEPOSIT_QUEUE_MAX_ATTEMPTS: Optional[int] = 5
+    DEPOSIT_QUEUE_RETRY_DELAY: Optional[int] = 30
+
+    # batch jobs
+    BULK_WRITE_CHUNK_SIZE: Optional[int] = 1000
+
+    # periodic sweeps, users are split into SWEEP_SHARDS shards by uid hash
+    SWEEP_SHARDS: Optional[int] = 8
+    SWEEP_PAGE_SIZE: Optional[int] = 500
+    SWEEP_LEASE_TTL: Optional[int] = 120
+
+    # verified telegram init data kept per worker
+    TELEGRAM_INIT_DATA_CACHE_SIZE: Optional[int] = 4096
+
+    # crypto thread pool
+    CRYPTO_WORKERS: Optional[int] = 4
+    CRYPTO_MAX_QUEUE: Optional[int] = 256
+
+    # sui json rpc
+    SUI_RPC_BATCH_SIZE: Optional[int] = 200
+
+    # outgoing http connection pool
+    HTTP_POOL_LIMIT: Optional[int] = 100
+    HTTP_POOL_LIMIT_PER_HOST: Optional[int] = 50
+    HTTP_TIMEOUT: Optional[float] = 30
+    HTTP_CONNECT_TIMEOUT: Optional[float] = 10
+    HTTP_KEEPALIVE_TIMEOUT: Optional[float] = 60
+
     model_config = SettingsConfigDict(
         env_file=".env",
         extra="ignore",
@@ -0,0 +1,48 @@
+from typing import Iterable, List, Optional, Type
+
+from sqlalchemy import cast, column, update, values
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.config.settings import Config
+
+
+async def bulk_update(
+    session: AsyncSession,
+    model: Type[SQLModel],
+    key: str,
+    rows: List[dict],
+    increments: Iterable[str] = (),
+    chunkSize: Optional[int] = None,
+) -> int:
+    """
+    Writes many rows back with `UPDATE ... FROM (VALUES ...)` statements of `chunkSize` rows, matching
+    them on the `key` column. Every other column in the rows is assigned, or added to the current value
+    when it is listed in `increments`. Runs in the caller's transaction, returns the number of rows sent.
+    """
+    if not rows:
+        return 0
+
+    chunkSize = chunkSize or Config.BULK_WRITE_CHUNK_SIZE
+    increments = set(increments)
+    table = model.__table__
+    names = list(rows[0].keys())
+
+    for start in range(0, len(rows), chunkSize):
+        chunk = rows[start:start + chunkSize]
+        data = values(*(column(name, table.c[name].type) for name in names), name="v").data(
+            [tuple(row[name] for name in names) for row in chunk]
+        )
+
+        assignments = {}
+        for name in names:
+            if name == key:
+                continue
+            # a chunk where a column is all NULL gives postgres nothing to infer its type from
+            value = cast(data.c[name], table.c[name].type)
+            assignments[name] = table.c[name] + value if name in increments else value
+
+        statement = update(table).where(table.c[key] == cast(data.c[key], table.c[key].type)).values(assignments)
+        await session.execute(statement)
+
+    return len(rows)
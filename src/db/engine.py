@@ -4,7 +4,6 @@ from contextlib import asynccontextmanager
 
 from sqlmodel import SQLModel  # , create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import text
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
 
@@ -12,7 +11,41 @@ from src.config.settings import Config
 from src.utils.logger import LOGGER
 
 
-engine = create_async_engine(url=Config.DATABASE_URL, echo=False, pool_size=5, max_overflow=10)
+# (pool_size, max_overflow) of each process role
+POOL_SIZES = {
+    "web": (Config.DB_POOL_SIZE_WEB, Config.DB_MAX_OVERFLOW_WEB),
+    "worker": (Config.DB_POOL_SIZE_WORKER, Config.DB_MAX_OVERFLOW_WORKER),
+    "bot": (Config.DB_POOL_SIZE_BOT, Config.DB_MAX_OVERFLOW_BOT),
+}
+
+
+def engine_options(role: str) -> dict:
+    """
+    Engine arguments for a process role. The connection level settings are sent by asyncpg in the
+    startup packet of every new connection, so sessions never spend a round trip on them.
+    """
+    if role not in POOL_SIZES:
+        raise ValueError(f"Unknown PROCESS_ROLE {role!r}, expected one of {', '.join(POOL_SIZES)}")
+    poolSize, maxOverflow = POOL_SIZES[role]
+
+    serverSettings = {"application_name": f"suibison-{role}"}
+    if Config.SCHEMA:
+        serverSettings["search_path"] = Config.SCHEMA
+
+    return {
+        "pool_size": poolSize,
+        "max_overflow": maxOverflow,
+        "connect_args": {"server_settings": serverSettings},
+    }
+
+
+def pool_capacity(role: str) -> int:
+    """How many connections the engine of a process role can hold at once"""
+    poolSize, maxOverflow = POOL_SIZES[role]
+    return poolSize + maxOverflow
+
+
+engine = create_async_engine(url=Config.DATABASE_URL, echo=False, **engine_options(Config.PROCESS_ROLE))
 Session = sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -28,14 +61,14 @@ async def init_db() -> None:
         await conn.run_sync(SQLModel.metadata.create_all)
 
 async def get_session() -> AsyncGenerator[AsyncSession,  None]:
+    """
+    Request scoped session. A connection is only checked out of the pool by the first statement,
+    so a request that never queries, like one served from the principal cache, holds none.
+    """
     async with Session() as session:
         if session is None:
             raise Exception("Database session is None")
         try:
-            if hasattr(Config, 'SCHEMA'):
-                await session.execute(
-                    text(f"SET search_path TO {Config.SCHEMA}")
-                )
             yield session
         except Exception as e:
             LOGGER.debug("Database session error")
@@ -51,10 +84,6 @@ async def get_session_context() -> AsyncSession: # type: ignore
         if session is None:
             raise Exception("Database session is None")
         try:
-            if hasattr(Config, 'SCHEMA'):
-                await session.execute(
-                    text(f"SET search_path TO {Config.SCHEMA}")
-                )
             yield session
         except Exception as e:
             LOGGER.debug("Database session error")
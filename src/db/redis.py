@@ -1,6 +1,9 @@
+import asyncio
+import contextlib
 from decimal import Decimal
 import json
-from typing import Optional
+import time
+from typing import Dict, List, Optional, Tuple
 import uuid
 import redis.asyncio as aioredis
 from src.apps.accounts.models import User
@@ -15,6 +18,31 @@ REDIS_TIMEOUT = 5
 JTI_EXPIRY = 3600
 VERIFICATION_CODE_EXPIRY = 900  # 15 minutes
 SECURITY_EXPIRY = 2592000  # 1 month
+BALANCE_SNAPSHOT_EXPIRY = 604800  # 1 week
+DEPOSIT_DEDUPE_EXPIRY = 2592000  # 1 month
+DEPOSIT_CHECKPOINT_KEY = "deposits:checkpoint_cursor"
+WALLET_ADDRESSES_KEY = "wallets:addresses"
+WALLET_ADDRESSES_LOADED_KEY = "wallets:addresses:loaded"
+REFERRAL_COUNTERS_CURSOR_KEY = "referrals:counters_cursor"
+REVOKED_JTIS_KEY = "jti:revoked"
+REVOKED_JTIS_CHANNEL = "jti:revoked"
+REFERRAL_SUMMARY_EXPIRY = 300  # 5 minutes
+AUTH_PRINCIPAL_EXPIRY = 60  # 1 minute
+SWEEP_CURSOR_EXPIRY = 604800  # 1 week
+
+# only the holder of a lease, the one that knows its token, may renew or release it
+RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
 
 # Initialize Redis with connection pooling
 redis_pool = aioredis.ConnectionPool.from_url(
@@ -24,14 +52,96 @@ redis_client = aioredis.Redis(connection_pool=redis_pool)
 
 
 # Blacklisting
+class RevokedTokenFilter:
+    """
+    In-process copy of the JTIs revoked in the last `JTI_EXPIRY` seconds, so checking a token against
+    the blocklist needs no redis round trip unless the token may have been revoked. Each process loads
+    the current revocations when it subscribes to `REVOKED_JTIS_CHANNEL` and follows new ones from
+    there. While it is not subscribed every check falls through to redis.
+    """
+
+    def __init__(self, pollTimeout: float = 1.0) -> None:
+        self.pollTimeout = pollTimeout
+        self.synced = False
+        self._revoked: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, jti: str, expiry: float) -> None:
+        now = time.time()
+        # revocations are rare, so expired ones are only dropped when a new one comes in
+        self._revoked = {key: value for key, value in self._revoked.items() if value > now}
+        if expiry > now:
+            self._revoked[jti] = expiry
+        return None
+
+    def might_be_revoked(self, jti: str) -> bool:
+        if not self.synced:
+            return True
+        expiry = self._revoked.get(jti)
+        return expiry is not None and expiry > time.time()
+
+    async def _load(self) -> None:
+        now = time.time()
+        await redis_client.zremrangebyscore(REVOKED_JTIS_KEY, "-inf", now)
+        revoked = await redis_client.zrangebyscore(REVOKED_JTIS_KEY, now, "+inf", withscores=True)
+        for jti, expiry in revoked:
+            self.add(jti.decode(), expiry)
+        return None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(REVOKED_JTIS_CHANNEL)
+                    # loaded after subscribing so nothing revoked in between is missed
+                    await self._load()
+                    self.synced = True
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=self.pollTimeout)
+                        if message is not None:
+                            jti, expiry = json.loads(message["data"])
+                            self.add(jti, expiry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(f"Token revocation listener failed, retrying: {e}")
+            finally:
+                self.synced = False
+            await asyncio.sleep(self.pollTimeout)
+
+    def start(self) -> None:
+        """Starts following revocations on the running loop, call this from the app lifespan"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+        return None
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        return None
+
+
+revoked_token_filter = RevokedTokenFilter()
+
+
 async def add_jti_to_blocklist(jti: str) -> None:
-    """Adds a JTI (JWT ID) to the Redis blocklist with an expiry."""
-    # Use the 'set' command with an expiry to add the JTI to the blocklist
-    await redis_client.set(jti, "", ex=JTI_EXPIRY)
+    """Adds a JTI (JWT ID) to the Redis blocklist with an expiry and tells every process about it."""
+    expiry = time.time() + JTI_EXPIRY
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(jti, "", ex=JTI_EXPIRY)
+        pipe.zadd(REVOKED_JTIS_KEY, {jti: expiry})
+        pipe.publish(REVOKED_JTIS_CHANNEL, json.dumps([jti, expiry]))
+        await pipe.execute()
+    revoked_token_filter.add(jti, expiry)
 
 async def token_in_blocklist(jti: str) -> bool:
-    """Checks if a JTI (JWT ID) is in the Redis blocklist."""
-    
+    """Checks if a JTI (JWT ID) is in the Redis blocklist, only asking redis when the local filter has it."""
+    if not revoked_token_filter.might_be_revoked(jti):
+        return False
+
     # Use 'exists' instead of 'get' for better performance
     is_blocked = await redis_client.exists(jti)
     LOGGER.debug(f"Token is blocked: {is_blocked == 1}")
@@ -73,6 +183,173 @@ async def get_level_referrers(userId: str, level: int):
     return []
     
     
+# Wallet balance snapshots
+def _balance_snapshot_key(address: str) -> str:
+    return f"wallet:{address}:balance"
+
+async def get_balance_snapshots(addresses: List[str]) -> Dict[str, Optional[dict]]:
+    """Returns the last seen `{"balance", "checkpoint"}` snapshot of every address, None when never seen"""
+    if not addresses:
+        return {}
+    values = await redis_client.mget([_balance_snapshot_key(address) for address in addresses])
+    return {
+        address: json.loads(value.decode("utf-8")) if value else None
+        for address, value in zip(addresses, values)
+    }
+
+async def set_balance_snapshots(balances: Dict[str, Decimal], checkpoint: Optional[int] = None) -> None:
+    """Records the on-chain balance of many addresses as seen at `checkpoint`"""
+    if not balances:
+        return None
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for address, balance in balances.items():
+            snapshot = json.dumps({"balance": str(balance), "checkpoint": checkpoint})
+            pipe.set(_balance_snapshot_key(address), snapshot, ex=BALANCE_SNAPSHOT_EXPIRY)
+        await pipe.execute()
+    return None
+
+async def claim_balance_snapshot(
+    address: str, balance: Decimal, checkpoint: Optional[int] = None
+) -> Tuple[bool, Optional[dict]]:
+    """
+    Records `balance` as the snapshot of the address and returns whether it changed, together with
+    the snapshot it replaced. The swap is atomic, so of two workers seeing the same new balance only
+    the first one gets True.
+    """
+    snapshot = json.dumps({"balance": str(balance), "checkpoint": checkpoint})
+    previous = await redis_client.set(_balance_snapshot_key(address), snapshot, ex=BALANCE_SNAPSHOT_EXPIRY, get=True)
+    previous = json.loads(previous.decode("utf-8")) if previous else None
+    return previous is None or Decimal(previous["balance"]) != balance, previous
+
+async def restore_balance_snapshot(address: str, snapshot: Optional[dict]) -> None:
+    """Puts back a snapshot replaced by `claim_balance_snapshot`, None clears it"""
+    if snapshot is None:
+        await redis_client.delete(_balance_snapshot_key(address))
+    else:
+        await redis_client.set(_balance_snapshot_key(address), json.dumps(snapshot), ex=BALANCE_SNAPSHOT_EXPIRY)
+    return None
+
+
+# Deposit ingestion
+async def get_deposit_checkpoint() -> Optional[int]:
+    """Sequence number of the last checkpoint ingested, None before the first run"""
+    checkpoint = await redis_client.get(DEPOSIT_CHECKPOINT_KEY)
+    return int(checkpoint) if checkpoint is not None else None
+
+async def set_deposit_checkpoint(checkpoint: int) -> None:
+    await redis_client.set(DEPOSIT_CHECKPOINT_KEY, checkpoint)
+    return None
+
+async def add_wallet_addresses(addresses: List[str]) -> None:
+    if addresses:
+        await redis_client.sadd(WALLET_ADDRESSES_KEY, *addresses)
+    return None
+
+async def wallet_addresses_loaded() -> bool:
+    return await redis_client.exists(WALLET_ADDRESSES_LOADED_KEY) == 1
+
+async def mark_wallet_addresses_loaded() -> None:
+    await redis_client.set(WALLET_ADDRESSES_LOADED_KEY, "")
+    return None
+
+async def filter_wallet_addresses(addresses: List[str]) -> List[str]:
+    """Returns the addresses that belong to one of our custodial wallets"""
+    if not addresses:
+        return []
+    members = await redis_client.smismember(WALLET_ADDRESSES_KEY, addresses)
+    return [address for address, member in zip(addresses, members) if member]
+
+async def get_referral_counters_cursor() -> Optional[str]:
+    cursor = await redis_client.get(REFERRAL_COUNTERS_CURSOR_KEY)
+    return cursor.decode() if cursor is not None else None
+
+async def set_referral_counters_cursor(uid: Optional[str]) -> None:
+    if uid is None:
+        await redis_client.delete(REFERRAL_COUNTERS_CURSOR_KEY)
+        return None
+    await redis_client.set(REFERRAL_COUNTERS_CURSOR_KEY, uid)
+    return None
+
+# Periodic job leases and sweep shard progress
+def _lease_key(name: str) -> str:
+    return f"lease:{name}"
+
+async def acquire_lease(name: str, token: str, ttl: int) -> bool:
+    """Takes the lease on `name` for `ttl` seconds, returns False when someone else holds it"""
+    acquired = await redis_client.set(_lease_key(name), token, nx=True, ex=ttl)
+    return bool(acquired)
+
+async def renew_lease(name: str, token: str, ttl: int) -> bool:
+    """Extends a held lease by `ttl` seconds, returns False when it expired or was taken over"""
+    renewed = await redis_client.eval(RENEW_LEASE_SCRIPT, 1, _lease_key(name), token, ttl * 1000)
+    return renewed == 1
+
+async def release_lease(name: str, token: str) -> None:
+    await redis_client.eval(RELEASE_LEASE_SCRIPT, 1, _lease_key(name), token)
+    return None
+
+async def lease_held(name: str) -> bool:
+    return await redis_client.exists(_lease_key(name)) == 1
+
+def _sweep_cursor_key(job: str, shard: int) -> str:
+    return f"sweeps:{job}:{shard}:cursor"
+
+async def get_sweep_cursor(job: str, shard: int) -> Optional[str]:
+    cursor = await redis_client.get(_sweep_cursor_key(job, shard))
+    return cursor.decode() if cursor is not None else None
+
+async def set_sweep_cursor(job: str, shard: int, uid: Optional[str]) -> None:
+    if uid is None:
+        await redis_client.delete(_sweep_cursor_key(job, shard))
+        return None
+    await redis_client.set(_sweep_cursor_key(job, shard), uid, ex=SWEEP_CURSOR_EXPIRY)
+    return None
+
+def _referral_summary_key(userId: str) -> str:
+    return f"referrals:{userId}:summary"
+
+async def get_cached_referral_summary(userId: str) -> Optional[dict]:
+    summary = await redis_client.get(_referral_summary_key(userId))
+    return json.loads(summary) if summary is not None else None
+
+async def cache_referral_summary(userId: str, summary: dict) -> None:
+    await redis_client.set(_referral_summary_key(userId), json.dumps(summary), ex=REFERRAL_SUMMARY_EXPIRY)
+    return None
+
+async def invalidate_referral_summaries(userIds: List[str]) -> None:
+    """Drops the cached referral summary of every user whose referral records changed"""
+    if userIds:
+        await redis_client.delete(*{_referral_summary_key(userId) for userId in userIds})
+    return None
+
+# Authenticated principals
+def _auth_principal_key(userId: str) -> str:
+    return f"auth:{userId}:principal"
+
+async def get_cached_auth_principal(userId: str) -> Optional[dict]:
+    principal = await redis_client.get(_auth_principal_key(userId))
+    return json.loads(principal) if principal is not None else None
+
+async def cache_auth_principal(userId: str, principal: dict) -> None:
+    await redis_client.set(_auth_principal_key(userId), json.dumps(principal), ex=AUTH_PRINCIPAL_EXPIRY)
+    return None
+
+async def invalidate_auth_principals(userIds: List[str]) -> None:
+    """Drops the cached principal of every user whose identity or permissions changed, or who was deleted"""
+    if userIds:
+        await redis_client.delete(*{_auth_principal_key(userId) for userId in userIds})
+    return None
+
+async def claim_deposit(digest: str, address: str) -> bool:
+    """Marks a deposit as seen, returns False when it had already been claimed"""
+    claimed = await redis_client.set(f"deposit:{digest}:{address}", "", nx=True, ex=DEPOSIT_DEDUPE_EXPIRY)
+    return bool(claimed)
+
+async def release_deposit(digest: str, address: str) -> None:
+    await redis_client.delete(f"deposit:{digest}:{address}")
+    return None
+
+
 async def get_sui_usd_price():
     price = await redis_client.get("sui_price")
     return Decimal(json.loads(price.decode("utf-8")))
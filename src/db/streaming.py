@@ -0,0 +1,43 @@
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.config.settings import Config
+from src.db.engine import get_session_context
+
+
+async def stream_keyset(
+    query,
+    key: InstrumentedAttribute,
+    session: Optional[AsyncSession] = None,
+    chunkSize: Optional[int] = None,
+    after: Optional[Any] = None,
+) -> AsyncIterator[Sequence]:
+    """
+    Yields the rows of `query` in chunks of `chunkSize`, ordered by the unique `key` column, which
+    has to be one of the selected columns. Every chunk is its own `key > last` query, so at most one
+    chunk is held in memory however many rows match. Select plain columns rather than models so no
+    ORM objects pile up in the session. Chunks are read in `session` when given, keeping a job and
+    its writes in one transaction, otherwise each chunk is read in a short session of its own.
+    Starts after the `after` key when given.
+    """
+    chunkSize = chunkSize or Config.BULK_WRITE_CHUNK_SIZE
+    while True:
+        chunk = query.order_by(key).limit(chunkSize)
+        if after is not None:
+            chunk = chunk.where(key > after)
+
+        if session is not None:
+            db_result = await session.execute(chunk)
+            rows = db_result.all()
+        else:
+            async with get_session_context() as own_session:
+                db_result = await own_session.execute(chunk)
+                rows = db_result.all()
+
+        if rows:
+            yield rows
+            after = getattr(rows[-1], key.key)
+        if len(rows) < chunkSize:
+            return
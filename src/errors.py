@@ -154,6 +154,21 @@ class StakingExpired(SuiBisonException):
     pass
 
 
+class InvalidCursor(SuiBisonException):
+    """Pagination cursor could not be decoded"""
+    pass
+
+
+class CryptoQueueFull(SuiBisonException):
+    """Too many hashing or signing calls are already waiting for a worker"""
+    pass
+
+
+class LeaseLost(SuiBisonException):
+    """A periodic job lost its lease while running and was stopped"""
+    pass
+
+
 # Exception handler generator
 # def create_exception_handler(
 #     status_code: int, initial_detail: Any
@@ -400,3 +415,17 @@ def register_all_errors(app: FastAPI):
             status_code=status.HTTP_404_NOT_FOUND,
             content={"message": "User does not exist", "error_code": "user_not_found"}
         )
+
+    @app.exception_handler(InvalidCursor)
+    async def InvalidCursorError(request: Request, exc: InvalidCursor):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": "The page cursor is invalid.", "error_code": "invalid_cursor"}
+        )
+
+    @app.exception_handler(CryptoQueueFull)
+    async def CryptoQueueFullError(request: Request, exc: CryptoQueueFull):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"message": "The server is busy, please try again shortly.", "error_code": "server_busy"}
+        )
@@ -1,44 +1,78 @@
 from decimal import Decimal
-from typing import List
+from typing import List, Optional, Sequence, Tuple
 
+import numpy as np
 
-from src.apps.accounts.models import MatrixPoolUsers, UserReferral
-from src.db.redis import get_sui_usd_price
+from src.apps.accounts.models import MatrixPoolUsers
 
 
-async def get_rank(tteamVolume: Decimal, tdeposit: Decimal, referrals: List[UserReferral]):
-    usd__price = await get_sui_usd_price()
-    rankEarnings = Decimal(0.00)
-    rank = None
-    
+# (rank, weekly bonus in usd, team volume band, deposit band, minimum level 1 referrals), bands are [low, high) in usd
+RANK_TABLE: Tuple[Tuple[str, Decimal, Decimal, Decimal, Decimal, Decimal, int], ...] = (
+    ("Leader", Decimal(25), Decimal(1000), Decimal(5000), Decimal(50), Decimal(100), 3),
+    ("Bison King", Decimal(100), Decimal(5000), Decimal(20000), Decimal(100), Decimal(500), 5),
+    ("Bison Hon", Decimal(250), Decimal(20000), Decimal(100000), Decimal(500), Decimal(2000), 10),
+    ("Accumulator", Decimal(1000), Decimal(100000), Decimal(250000), Decimal(2000), Decimal(5000), 10),
+    ("Bison Diamond", Decimal(3000), Decimal(250000), Decimal(500000), Decimal(5000), Decimal(10000), 10),
+    ("Bison Legend", Decimal(5000), Decimal(500000), Decimal(1000000), Decimal(10000), Decimal(15000), 10),
+    ("Supreme Bison", Decimal(7000), Decimal(1000000), Decimal("Infinity"), Decimal(150000), Decimal("Infinity"), 10),
+)
+
+RANK_NAMES = np.array([None] + [tier[0] for tier in RANK_TABLE], dtype=object)
+RANK_BONUSES = np.array([Decimal(0)] + [tier[1] for tier in RANK_TABLE], dtype=object)
+VOLUME_LOWER = np.array([float(tier[2]) for tier in RANK_TABLE])
+VOLUME_UPPER = np.array([float(tier[3]) for tier in RANK_TABLE])
+DEPOSIT_LOWER = np.array([float(tier[4]) for tier in RANK_TABLE])
+DEPOSIT_UPPER = np.array([float(tier[5]) for tier in RANK_TABLE])
+MIN_REFERRALS = np.array([tier[6] for tier in RANK_TABLE])
+
+
+def rank_for(
+    tteamVolume: Decimal, tdeposit: Decimal, referralCount: int, usd__price: Decimal
+) -> Tuple[Decimal, Optional[str]]:
+    """Rank and rank bonus of a user given the sui/usd price, so batch jobs only read the price once"""
     teamVolume = tteamVolume * Decimal(usd__price)
     deposit = Decimal(tdeposit) * Decimal(usd__price)
-    
-    if teamVolume >= Decimal(1000) and teamVolume < Decimal(5000) and deposit >= Decimal(50) and deposit < Decimal(100) and len(referrals) >= 3:
-        rankEarnings = Decimal(25)
-        rank = "Leader"
-    elif teamVolume >= Decimal(5000) and teamVolume < Decimal(20000) and deposit >= Decimal(100) and deposit < Decimal(500) and len(referrals) >= 5:
-        rankEarnings = Decimal(100)
-        rank = "Bison King"
-    elif teamVolume >= Decimal(20000) and teamVolume < Decimal(100000) and deposit >= Decimal(500) and deposit < Decimal(2000) and len(referrals) >= 10:
-        rankEarnings = Decimal(250)
-        rank = "Bison Hon"
-    elif teamVolume >= Decimal(100000) and teamVolume < Decimal(250000) and deposit >= Decimal(2000) and deposit < Decimal(5000) and len(referrals) >= 10:
-        rankEarnings = Decimal(1000)
-        rank = "Accumulator"
-    elif teamVolume >= Decimal(250000) and teamVolume < Decimal(500000) and deposit >= Decimal(5000) and deposit < Decimal(10000) and len(referrals) >= 10:
-        rankEarnings = Decimal(3000)
-        rank = "Bison Diamond"
-    elif teamVolume >= Decimal(500000) and teamVolume < Decimal(1000000) and deposit >= Decimal(10000) and deposit < Decimal(15000) and len(referrals) >= 10:
-        rankEarnings = Decimal(5000)
-        rank = "Bison Legend"
-    elif teamVolume >= Decimal(1000000) and deposit >= Decimal(150000) and len(referrals) >= 10:
-        rankEarnings = Decimal(7000)
-        rank = "Supreme Bison"
-
-    return rankEarnings, rank
+
+    for rank, rankEarnings, minVolume, maxVolume, minDeposit, maxDeposit, minReferrals in RANK_TABLE:
+        if minVolume <= teamVolume < maxVolume and minDeposit <= deposit < maxDeposit and referralCount >= minReferrals:
+            return rankEarnings, rank
+    return Decimal(0.00), None
+
+
+def classify_ranks(
+    teamVolumes: Sequence[Decimal],
+    deposits: Sequence[Decimal],
+    referralCounts: Sequence[int],
+    usd__price: Decimal,
+) -> Tuple[List[Decimal], List[Optional[str]]]:
+    """
+    Batch version of `rank_for` over columnar inputs, returns the rank bonuses and rank names in input order.
+    The volume and deposit bands both rise with the rank, so each user's tier is found with one
+    `searchsorted` per column and only kept when both columns land in the same tier.
+    """
+    if not len(teamVolumes):
+        return [], []
+
+    price = float(usd__price)
+    volume = np.fromiter((float(value or 0) for value in teamVolumes), dtype=np.float64, count=len(teamVolumes)) * price
+    deposit = np.fromiter((float(value or 0) for value in deposits), dtype=np.float64, count=len(deposits)) * price
+    referrals = np.asarray(referralCounts, dtype=np.int64)
+
+    tier = np.searchsorted(VOLUME_LOWER, volume, side="right") - 1
+    depositTier = np.searchsorted(DEPOSIT_LOWER, deposit, side="right") - 1
+    safeTier = np.clip(tier, 0, len(RANK_TABLE) - 1)
+
+    matched = (
+        (tier >= 0)
+        & (tier == depositTier)
+        & (volume < VOLUME_UPPER[safeTier])
+        & (deposit < DEPOSIT_UPPER[safeTier])
+        & (referrals >= MIN_REFERRALS[safeTier])
+    )
+    index = np.where(matched, tier + 1, 0)
+    return RANK_BONUSES[index].tolist(), RANK_NAMES[index].tolist()
 
 async def matrix_share(matrixUser: MatrixPoolUsers):
-    percentageShare = (matrixUser.matrixPool.totalReferrals / matrixUser.referralsAdded) * 100
+    percentageShare = (matrixUser.referralsAdded / matrixUser.matrixPool.totalReferrals) * 100
     earning = matrixUser.matrixPool.raisedPoolAmount * Decimal(percentageShare / 100)
-    return Decimal(percentageShare), earning
\ No newline at end of file
+    return Decimal(percentageShare), earning
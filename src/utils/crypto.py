@@ -0,0 +1,110 @@
+import asyncio
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, List, Optional
+
+from pydantic import BaseModel
+
+from src.config.settings import Config
+from src.errors import CryptoQueueFull
+from src.utils.logger import LOGGER
+
+
+class CryptoExecutorStats(BaseModel):
+    """Call counters and the wait and run time percentiles, in seconds, of a `CryptoExecutor`"""
+    workers: int
+    maxQueue: int
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    rejected: int = 0
+    p50Wait: float = 0.0
+    p99Wait: float = 0.0
+    p50Run: float = 0.0
+    p99Run: float = 0.0
+
+
+def _percentile(values: List[float], n: int) -> float:
+    """The `n`th percentile of `values`, 0 when there are none"""
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[n - 1]
+
+
+class CryptoExecutor:
+    """
+    Bounded thread pool for the CPU bound crypto work of the API: bcrypt hashing, mnemonic generation
+    and transaction signing. Handlers await `run` instead of calling these inline, so a burst of
+    logins queues up here instead of stalling the event loop. At most `maxQueue` calls wait for a
+    worker, beyond that `CryptoQueueFull` is raised. Wait and run times of the last `window` calls are
+    kept for `stats`.
+    """
+
+    def __init__(self, workers: Optional[int] = None, maxQueue: Optional[int] = None, window: int = 1000) -> None:
+        self.workers = workers or Config.CRYPTO_WORKERS
+        self.maxQueue = maxQueue or Config.CRYPTO_MAX_QUEUE
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="crypto")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._waits: Deque[float] = deque(maxlen=window)
+        self._runs: Deque[float] = deque(maxlen=window)
+
+    def _call(self, submitted: float, fn: Callable[..., Any], args: tuple) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._waits.append(started - submitted)
+        failed = False
+        try:
+            return fn(*args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._runs.append(time.perf_counter() - started)
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Runs `fn(*args)` on the pool and returns its result"""
+        with self._lock:
+            if self._queued >= self.maxQueue:
+                self._rejected += 1
+                LOGGER.warning(f"Crypto queue full, rejecting {getattr(fn, '__name__', fn)}")
+                raise CryptoQueueFull()
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, time.perf_counter(), fn, args)
+
+    def stats(self) -> CryptoExecutorStats:
+        with self._lock:
+            waits, runs = list(self._waits), list(self._runs)
+            return CryptoExecutorStats(
+                workers=self.workers,
+                maxQueue=self.maxQueue,
+                queued=self._queued,
+                running=self._running,
+                completed=self._completed,
+                failed=self._failed,
+                rejected=self._rejected,
+                p50Wait=_percentile(waits, 50),
+                p99Wait=_percentile(waits, 99),
+                p50Run=_percentile(runs, 50),
+                p99Run=_percentile(runs, 99),
+            )
+
+
+crypto_executor = CryptoExecutor()
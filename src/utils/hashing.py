@@ -1,12 +1,16 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import hmac
 import hashlib
+import json
+from typing import Dict, Optional, Tuple
 import urllib.parse
 import uuid
 from passlib.context import CryptContext
 import jwt
 from src.config.settings import Config
 from src.errors import InvalidToken, TelegramAuthDataTokenExpired, TokenExpired, UnAuthorizedTelegramAccess
+from src.utils.crypto import crypto_executor
 from src.utils.logger import LOGGER
 from init_data_py import InitData
 
@@ -43,40 +47,83 @@ def verifyHashKey(word: str, hash: str) -> bool:
     correct = bcrypt_context.verify(word, hash)
     return correct
 
+async def verifyHashKeyAsync(word: str, hash: str) -> bool:
+    """`verifyHashKey` on the crypto thread pool, for use inside request handlers"""
+    return await crypto_executor.run(verifyHashKey, word, hash)
+
+class TelegramInitDataValidator:
+    """
+    Validates Telegram mini-app `initData`. The `WebAppData` secret is derived from the bot token
+    once, the query string is parsed in a single pass, and init data that already verified is kept
+    in a bounded LRU cache until it expires. A returning mini-app session that sends the same init
+    data again skips the HMAC. The cache is keyed on the whole init data string and not on its
+    `hash` field, so a known hash can never vouch for altered fields.
+    """
+
+    def __init__(self, botToken: str, cacheSize: Optional[int] = None) -> None:
+        self._secret = hmac.new(b"WebAppData", botToken.encode(), hashlib.sha256).digest()
+        self.cacheSize = cacheSize or Config.TELEGRAM_INIT_DATA_CACHE_SIZE
+        # init data -> (expiry, telegram user id)
+        self._verified: "OrderedDict[str, Tuple[datetime, str]]" = OrderedDict()
+
+    @staticmethod
+    def parse(initData: str) -> Dict[str, str]:
+        fields = {}
+        for pair in initData.split("&"):
+            key, _, value = pair.partition("=")
+            fields[key] = urllib.parse.unquote(value)
+        return fields
+
+    @staticmethod
+    def _check(telegramUserId: str, expiry: datetime, userId: str) -> None:
+        if telegramUserId != str(userId):
+            raise UnAuthorizedTelegramAccess()
+        # init data is valid for the rest of the day it was issued on
+        if datetime.now() >= expiry:
+            raise TelegramAuthDataTokenExpired()
+        return None
+
+    def verify(self, initData: str, userId: str) -> bool:
+        cached = self._verified.get(initData)
+        if cached is not None:
+            expiry, telegramUserId = cached
+            if datetime.now() >= expiry:
+                del self._verified[initData]
+            else:
+                self._verified.move_to_end(initData)
+            self._check(telegramUserId, expiry, userId)
+            return True
+
+        fields = self.parse(initData)
+        receivedHash = fields.pop("hash", None)
+        if receivedHash is None or "auth_date" not in fields or "user" not in fields:
+            return False
+
+        try:
+            telegramUserId = str(json.loads(fields["user"])["id"])
+            issued = datetime.fromtimestamp(int(fields["auth_date"]))
+        except (ValueError, TypeError, KeyError):
+            return False
+        expiry = issued.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self._check(telegramUserId, expiry, userId)
+
+        dataCheckString = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+        computedHash = hmac.new(self._secret, dataCheckString.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(computedHash, receivedHash):
+            LOGGER.debug(f"Telegram init data hash mismatch for user {userId}")
+            return False
+
+        self._verified[initData] = (expiry, telegramUserId)
+        while len(self._verified) > self.cacheSize:
+            self._verified.popitem(last=False)
+        return True
+
+
+telegram_validator = TelegramInitDataValidator(Config.TELEGRAM_TOKEN)
+
+
 def verifyTelegramAuthData(telegram_init_data: str, userId: str) -> bool:
-    bot_token=Config.TELEGRAM_TOKEN
-    
-    vals = {k: urllib.parse.unquote(v) for k, v in [s.split('=', 1) for s in telegram_init_data.split('&')]}
-    LOGGER.debug(f"TELEGRAM AUTH VALUES: {vals}")
-    data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted(vals.items()) if k != 'hash')
-    auth_date_check = vals["auth_date"]
-    datetime_object = datetime.fromtimestamp(int(auth_date_check))
-    
-    data_list = data_check_string.strip().split('\n')
-
-    # Create a dictionary to store the parsed data
-    data_dict = {}
-    for pair in data_list:
-        key, value = pair.split('=')
-        data_dict[key] = value
-
-    user_id = data_dict["user"]
-    LOGGER.debug(f"DATETIME: {datetime_object.date()}")
-    LOGGER.debug(f"CURRENT: {datetime.now().date()}")
-    LOGGER.debug(f"TELEGRAM USER ID: {user_id[6:16]}")
-    LOGGER.debug(f"USER ID: {userId}")
-    
-    if userId not in telegram_init_data:
-        raise UnAuthorizedTelegramAccess()
-    
-    if datetime.now().date() > datetime_object.date():
-        raise TelegramAuthDataTokenExpired()
-
-    secret_key = hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
-    h = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256)
-    LOGGER.info(h.hexdigest())
-    LOGGER.info(vals['hash'])
-    return h.hexdigest() == vals['hash']    
+    return telegram_validator.verify(telegram_init_data, userId)
 
 def createAccessToken(user_data: dict, expiry: timedelta = None, refresh: bool = False) -> str:
     payload = {}
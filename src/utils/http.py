@@ -0,0 +1,62 @@
+import asyncio
+import weakref
+from typing import Any, Optional
+
+import aiohttp
+
+from src.config.settings import Config
+
+
+class HTTPClient:
+    """
+    Shared async HTTP client for the SUI RPC node and the wallet service. Every
+    event loop gets one pooled aiohttp session, so connections (and their TLS
+    sessions) are kept alive and reused across balance checks and transfers
+    instead of being opened per request.
+    """
+
+    def __init__(
+        self,
+        limit: int = Config.HTTP_POOL_LIMIT,
+        limitPerHost: int = Config.HTTP_POOL_LIMIT_PER_HOST,
+        timeout: float = Config.HTTP_TIMEOUT,
+        connectTimeout: float = Config.HTTP_CONNECT_TIMEOUT,
+        keepaliveTimeout: float = Config.HTTP_KEEPALIVE_TIMEOUT,
+    ) -> None:
+        self.limit = limit
+        self.limitPerHost = limitPerHost
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connectTimeout)
+        self.keepaliveTimeout = keepaliveTimeout
+        # aiohttp sessions are bound to the loop they were created on
+        self._sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limitPerHost,
+                keepalive_timeout=self.keepaliveTimeout,
+                ttl_dns_cache=300,
+            )
+            session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._sessions[loop] = session
+        return session
+
+    async def post_json(self, url: str, payload: Any, headers: Optional[dict] = None) -> Any:
+        """POST `payload` as json and return the decoded json response, raising on non 2xx statuses"""
+        async with self.session().post(url, json=payload, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def close(self) -> None:
+        """Close the session of the running loop, call this before the loop shuts down"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+
+http_client = HTTPClient()
@@ -1,15 +1,16 @@
 from decimal import Decimal
 import pprint
-from typing import List
+from typing import Dict, List, Optional
 import base64
 import hashlib
 import asyncio
 import nacl.signing
-import requests
 
 from src.apps.accounts.models import User
 from src.apps.accounts.schemas import Coin, CoinBalance, MetaData, SuiTransferResponse, TransactionResponseData
 from src.config.settings import Config
+from src.utils.crypto import crypto_executor
+from src.utils.http import http_client
 from src.utils.logger import LOGGER
 from sui_python_sdk.wallet import SuiWallet
 import ecdsa
@@ -21,6 +22,10 @@ class SUIRequests:
         self.decimals = 10**9
                 
     async def sign_transaction(self, txBytes: str, pk: bytes, pubKey: bytes):
+        """Signs the transaction on the crypto thread pool, ecdsa is pure python and would block the loop"""
+        return await crypto_executor.run(self._sign_transaction, txBytes, pk, pubKey)
+
+    def _sign_transaction(self, txBytes: str, pk: bytes, pubKey: bytes) -> bytes:
         bytesTx = base64.b64decode(txBytes)
         hasher = hashlib.blake2b(bytesTx, digest_size=32)
         digest = hasher.digest()
@@ -56,18 +61,122 @@ class SUIRequests:
             ]
         }
         
-        response = await asyncio.to_thread(requests.post, self.url, json=payload)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if 'error' in result:
-                raise Exception(f"Error: {result['error']}")
-            res = result["result"]
-            LOGGER.debug(res)
-            return CoinBalance(**res)
-        else:
-            response.raise_for_status()
+        result = await http_client.post_json(self.url, payload)
+        
+        if 'error' in result:
+            raise Exception(f"Error: {result['error']}")
+        res = result["result"]
+        LOGGER.debug(res)
+        return CoinBalance(**res)
             
+    async def batchCall(self, method: str, paramsList: List[list], chunkSize: Optional[int] = None) -> List[Optional[dict]]:
+        """
+        Calls `method` once per params list with JSON-RPC batch requests of `chunkSize` calls per
+        round trip and returns the results in the same order. A call that failed (or whose round
+        trip failed) yields None so one bad call never fails the rest of the batch.
+        """
+        chunkSize = chunkSize or Config.SUI_RPC_BATCH_SIZE
+        results: List[Optional[dict]] = []
+
+        for start in range(0, len(paramsList), chunkSize):
+            chunk = paramsList[start:start + chunkSize]
+            payload = [
+                {
+                    "jsonrpc": "2.0",
+                    "id": index,
+                    "method": method,
+                    "params": params
+                }
+                for index, params in enumerate(chunk)
+            ]
+
+            try:
+                responses = await http_client.post_json(self.url, payload)
+                if not isinstance(responses, list):
+                    raise Exception(f"Error: {responses.get('error', responses)}")
+            except Exception as e:
+                LOGGER.error(f"BATCH-{method}-Error for {len(chunk)} calls: {e}")
+                results.extend([None] * len(chunk))
+                continue
+
+            responses_by_id = {response.get("id"): response for response in responses}
+            for index, params in enumerate(chunk):
+                response = responses_by_id.get(index)
+                if response is None or 'error' in response:
+                    error = response["error"] if response else "missing response"
+                    LOGGER.error(f"BATCH-{method}-Error for {params}: {error}")
+                    results.append(None)
+                    continue
+                results.append(response["result"])
+
+        return results
+
+    async def getBalances(
+        self, addresses: List[str], coinType: str = "0x2::sui::SUI", chunkSize: Optional[int] = None
+    ) -> Dict[str, Optional[CoinBalance]]:
+        """
+        Gets the balances of many addresses in JSON-RPC batches of `chunkSize` addresses. Every
+        address maps to its balance, or to None when its lookup failed.
+        """
+        results = await self.batchCall("suix_getBalance", [[address, coinType] for address in addresses], chunkSize)
+        return {
+            address: CoinBalance(**result) if result is not None else None
+            for address, result in zip(addresses, results)
+        }
+
+    async def getLatestCheckpoint(self) -> int:
+        """
+        Gets the sequence number of the latest executed checkpoint
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "sui_getLatestCheckpointSequenceNumber",
+            "params": []
+        }
+
+        result = await http_client.post_json(self.url, payload)
+
+        if 'error' in result:
+            raise Exception(f"Error: {result['error']}")
+        return int(result["result"])
+
+    async def getCheckpoints(self, cursor: Optional[int], limit: int) -> dict:
+        """
+        Gets up to `limit` checkpoints after the `cursor` sequence number in ascending order
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "sui_getCheckpoints",
+            "params": [
+                str(cursor) if cursor is not None else None,
+                limit,
+                False
+            ]
+        }
+
+        result = await http_client.post_json(self.url, payload)
+
+        if 'error' in result:
+            raise Exception(f"Error: {result['error']}")
+        return result["result"]
+
+    async def getTransactionBalanceChanges(self, digests: List[str]) -> List[Optional[dict]]:
+        """
+        Gets the balance changes of many transaction blocks, batching `sui_multiGetTransactionBlocks`
+        calls of at most 50 digests (the node's limit) into JSON-RPC batch requests. A transaction
+        whose call failed yields None.
+        """
+        options = {"showBalanceChanges": True}
+        pages = [[digests[start:start + 50], options] for start in range(0, len(digests), 50)]
+        results = await self.batchCall("sui_multiGetTransactionBlocks", pages)
+
+        transactions: List[Optional[dict]] = []
+        for page, result in zip(pages, results):
+            transactions.extend(result if result is not None else [None] * len(page[0]))
+        return transactions
+
     async def getCoinMetadata(self, coinType: str = "0x2::sui::SUI"):
         """
         Gets the metadata for a specified coin type defaults to sui and returns a response which includes the coin id used for transafers 
@@ -81,16 +190,12 @@ class SUIRequests:
             ]
         }
         
-        response = await asyncio.to_thread(requests.post, self.url, json=payload)
+        result = await http_client.post_json(self.url, payload)
         
-        if response.status_code == 200:
-            result = response.json()
-            if 'error' in result:
-                raise Exception(f"Error: {result['error']}")
-            metadata = result["result"]
-            return MetaData(**metadata)
-        else:
-            response.raise_for_status()
+        if 'error' in result:
+            raise Exception(f"Error: {result['error']}")
+        metadata = result["result"]
+        return MetaData(**metadata)
  
     async def getCoins(self, address: str):
         payload = {
@@ -102,19 +207,15 @@ class SUIRequests:
             ]
         }
         
-        response = await asyncio.to_thread(requests.post, self.url, json=payload)
+        result = await http_client.post_json(self.url, payload)
         coins: List[Coin] = []
-        if response.status_code == 200:
-            result = response.json()
-            LOGGER.debug(f"COINIDS: {result}")
-            if 'error' in result:
-                raise Exception(f"Error: {result['error']}")
-            for coin in result['result']["data"]:
-                if coin["coinType"] == "0x2::sui::SUI":
-                    coins.append(Coin(**coin))
-            return coins
-        else:
-            response.raise_for_status()
+        LOGGER.debug(f"COINIDS: {result}")
+        if 'error' in result:
+            raise Exception(f"Error: {result['error']}")
+        for coin in result['result']["data"]:
+            if coin["coinType"] == "0x2::sui::SUI":
+                coins.append(Coin(**coin))
+        return coins
 
     async def paySui(self, address: str, recipient: str, amount: Decimal, gas_budget: Decimal, coinIds: List[Coin]):
         coins = []
@@ -134,18 +235,14 @@ class SUIRequests:
             ]
         }
         
-        response = await asyncio.to_thread(requests.post, self.url, json=payload)
+        result = await http_client.post_json(self.url, payload)
         
-        if response.status_code == 200:
-            result = response.json()
-            LOGGER.debug(f"PAYSUI RESPONSE: {result}")
-            if 'error' in result:
-                raise Exception(f"PAYSUI-Error: {result['error']}")
-            LOGGER.debug(pprint.pprint(result, indent=4))
-            res = result["result"]
-            return SuiTransferResponse(**res)
-        else:
-            response.raise_for_status()
+        LOGGER.debug(f"PAYSUI RESPONSE: {result}")
+        if 'error' in result:
+            raise Exception(f"PAYSUI-Error: {result['error']}")
+        LOGGER.debug(pprint.pprint(result, indent=4))
+        res = result["result"]
+        return SuiTransferResponse(**res)
         
     async def payAllSui(self, address: str, recipient: str, gas_budget: Decimal, coinIds: List[Coin]):
         coins = []
@@ -166,17 +263,13 @@ class SUIRequests:
             ]
         }
         
-        response = await asyncio.to_thread(requests.post, self.url, json=payload)
-        
-        if response.status_code == 200:
-            result = response.json()
-            LOGGER.debug(f"PAYALLSUI RESPONSE: {result}")
-            if 'error' in result:
-                raise Exception(f"PAYALLSUI- Error: {result['error']}")
-            res = result["result"]
-            return SuiTransferResponse(**res)
-        else:
-            response.raise_for_status()
+        result = await http_client.post_json(self.url, payload)
+        
+        LOGGER.debug(f"PAYALLSUI RESPONSE: {result}")
+        if 'error' in result:
+            raise Exception(f"PAYALLSUI- Error: {result['error']}")
+        res = result["result"]
+        return SuiTransferResponse(**res)
             
     async def dryRun(self, txBytes: str):
         payload = {
@@ -187,28 +280,22 @@ class SUIRequests:
                 txBytes,
             ]
         }
-        response = await asyncio.to_thread(requests.post, self.url, json=payload)
-        LOGGER.debug(response)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if 'error' in result:
-                raise Exception(f"Error: {result['error']}")
-            res = result["result"]["transaction"]["txSignatures"]
-            LOGGER.debug(pprint.pprint(res, indent=4))
-            return TransactionResponseData(**res)
-        else:
-            response.raise_for_status()
+        result = await http_client.post_json(self.url, payload)
+        LOGGER.debug(result)
+        
+        if 'error' in result:
+            raise Exception(f"Error: {result['error']}")
+        res = result["result"]["transaction"]["txSignatures"]
+        LOGGER.debug(pprint.pprint(res, indent=4))
+        return TransactionResponseData(**res)
 
     async def executeTransaction(self, bcsTxBytes: str, privateKey: str):
         payload = {
             "secret": privateKey,
             "txBytes": bcsTxBytes,
         }
-        response = await asyncio.to_thread(requests.post, "https://suiwallet.sui-bison.live/wallet/se-transactions", json=payload)
-        LOGGER.debug(response.json)
-        
-        result = response.json()
+        result = await http_client.post_json("https://suiwallet.sui-bison.live/wallet/se-transactions", payload)
+        LOGGER.debug(result)
         return result
 
 SUI = SUIRequests()
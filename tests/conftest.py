@@ -0,0 +1,89 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def throwaway_database_url():
+    """Starts a postgres cluster in a temporary directory, deleted at exit, when pgserver is installed"""
+    try:
+        import pgserver
+    except ImportError:
+        return None
+    server = pgserver.get_server(tempfile.mkdtemp(prefix="suibison-tests-"), cleanup_mode="delete")
+    return server.get_uri().replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+# database tests drop and recreate the public schema, so they run against an explicit test database
+# or a throwaway one, never against DATABASE_URL
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL") or throwaway_database_url()
+
+for key, value in {
+    "ENVIRONMENT": "dev",
+    "SECRET_KEY": "test-secret",
+    "WEBAPP_URL": "http://localhost",
+    "TELEGRAM_TOKEN": "123456:test-token",
+    "DOMAIN": "localhost",
+    "DATABASE_URL": TEST_DATABASE_URL or "postgresql+asyncpg://postgres@localhost/postgres",
+    "CELERY_BROKER_URL": "redis://localhost:6379/0",
+    "RESULT_BACKEND": "redis://localhost:6379/0",
+    "SUI_RPC": "http://localhost:9000",
+    "SUI_FAUCET": "http://localhost:9000",
+}.items():
+    os.environ.setdefault(key, value)
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+# importing `src` purges the celery queues, which needs a running broker the unit tests do not
+import celery.app.control  # noqa: E402
+
+celery.app.control.Control.purge = lambda self, *args, **kwargs: 0
+
+
+@pytest.fixture
+def run():
+    """Runs a coroutine on a fresh loop, closing the pooled connections bound to it afterwards"""
+    from src.db.engine import engine
+
+    def runner(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await engine.dispose()
+        return asyncio.run(main())
+    return runner
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """An empty in-memory redis in place of the shared client"""
+    fakeredis = pytest.importorskip("fakeredis")
+    import src.db.redis
+
+    monkeypatch.setattr(src.db.redis, "redis_client", fakeredis.FakeAsyncRedis())
+
+
+@pytest.fixture
+def db(run):
+    """An empty schema in the test database"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set and pgserver is not installed")
+
+    from sqlmodel import SQLModel, text
+
+    import src.apps.accounts.models  # noqa: F401
+    from src.db.engine import engine
+
+    async def reset():
+        async with engine.begin() as connection:
+            await connection.execute(text("DROP SCHEMA public CASCADE"))
+            await connection.execute(text("CREATE SCHEMA public"))
+            await connection.run_sync(SQLModel.metadata.create_all)
+    run(reset())
+    return run
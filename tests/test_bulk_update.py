@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from sqlmodel import select
+
+from src.apps.accounts.models import User
+from src.db.bulk import bulk_update
+from src.db.engine import get_session_context
+
+
+async def seed(count: int):
+    async with get_session_context() as session:
+        users = [
+            User(userId=str(index), firstName="user", totalTeamVolume=Decimal("1.5"), totalNetwork=index)
+            for index in range(count)
+        ]
+        session.add_all(users)
+        await session.commit()
+        return [user.uid for user in users]
+
+
+async def counters():
+    async with get_session_context() as session:
+        db_result = await session.exec(select(User.userId, User.firstName, User.totalTeamVolume, User.totalNetwork))
+        return {row.userId: (row.firstName, row.totalTeamVolume, row.totalNetwork) for row in db_result.all()}
+
+
+async def write(rows, increments=(), chunkSize=None):
+    async with get_session_context() as session:
+        sent = await bulk_update(session, User, "uid", rows, increments=increments, chunkSize=chunkSize)
+        await session.commit()
+        return sent
+
+
+def test_bulk_update_assigns_and_increments(db):
+    uids = db(seed(5))
+    rows = [
+        {"uid": uid, "firstName": f"renamed-{index}", "totalTeamVolume": Decimal("0.25") * index, "totalNetwork": -1}
+        for index, uid in enumerate(uids)
+    ]
+
+    # chunks of 2 rows send three statements
+    assert db(write(rows, increments=("totalTeamVolume", "totalNetwork"), chunkSize=2)) == 5
+
+    assert db(counters()) == {
+        str(index): (f"renamed-{index}", Decimal("1.5") + Decimal("0.25") * index, index - 1)
+        for index in range(5)
+    }
+
+
+def test_bulk_update_increments_add_up(db):
+    uids = db(seed(2))
+    rows = [{"uid": uids[0], "totalNetwork": 3}]
+
+    db(write(rows, increments=("totalNetwork",)))
+    db(write(rows, increments=("totalNetwork",)))
+
+    assert db(counters())["0"][2] == 6
+    # rows not sent are left alone
+    assert db(counters())["1"] == ("user", Decimal("1.5"), 1)
+
+
+def test_bulk_update_without_rows(db):
+    assert db(write([])) == 0
@@ -0,0 +1,38 @@
+import asyncio
+
+from sqlalchemy import text
+
+from src import celery_tasks
+from src.celery_tasks import run_async, start_worker_loop, stop_worker_loop
+from src.db.engine import engine
+
+
+async def backend():
+    """The running loop and the postgres backend of the pooled connection it is handed"""
+    async with engine.connect() as conn:
+        pid = (await conn.execute(text("SELECT pg_backend_pid()"))).scalar()
+    return asyncio.get_running_loop(), pid
+
+
+def test_worker_process_reuses_its_loop_and_connections(db):
+    start_worker_loop()
+    try:
+        firstLoop, firstPid = run_async(backend())
+        secondLoop, secondPid = run_async(backend())
+        assert firstLoop is secondLoop is celery_tasks.worker_loop
+        assert firstPid == secondPid
+    finally:
+        stop_worker_loop()
+
+    assert celery_tasks.worker_loop is None
+    assert firstLoop.is_closed()
+
+
+def test_outside_a_worker_every_run_gets_a_loop_of_its_own(db):
+    firstLoop, _ = run_async(backend())
+    secondLoop, _ = run_async(backend())
+
+    assert firstLoop is not secondLoop
+    assert firstLoop.is_closed() and secondLoop.is_closed()
+    # the pool was emptied with the loop its connections belonged to
+    assert engine.pool.checkedin() == 0
@@ -0,0 +1,214 @@
+import json
+import os
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from sqlmodel import select
+
+from src.apps.accounts import deposits
+from src.apps.accounts.deposits import DepositIngester
+from src.apps.accounts.models import DepositQueue, User, UserWallet
+from src.db.engine import get_session_context
+from src.utils.http import http_client
+from src.utils.sui_json_rpc_apis import SUIRequests
+
+RECORDING = os.path.join(os.path.dirname(__file__), "fixtures", "sui_transactions.json")
+
+
+class RecordedNode:
+    """
+    Serves `sui_getCheckpoints`, `sui_multiGetTransactionBlocks` and the latest checkpoint from
+    recorded transactions, only the first `visible` of which have happened yet. Every recorded
+    transaction sits in the checkpoint it names, and the calls are counted by method.
+    """
+
+    def __init__(self, recording: dict, visible: int) -> None:
+        self.transactions = recording["transactions"]
+        self.visible = visible
+        self.calls = Counter()
+
+    def _checkpoints(self) -> Dict[int, List[str]]:
+        checkpoints = defaultdict(list)
+        for transaction in self.transactions[:self.visible]:
+            checkpoints[int(transaction["checkpoint"])].append(transaction["digest"])
+        return checkpoints
+
+    def _page(self, cursor: Optional[str], limit: int) -> dict:
+        checkpoints = self._checkpoints()
+        after = [
+            {"sequenceNumber": str(sequence), "transactions": checkpoints[sequence]}
+            for sequence in sorted(checkpoints)
+            if cursor is None or sequence > int(cursor)
+        ]
+        data = after[:limit]
+        return {
+            "data": data,
+            "nextCursor": data[-1]["sequenceNumber"] if data else cursor,
+            "hasNextPage": len(after) > limit,
+        }
+
+    def _result(self, method: str, params: list):
+        self.calls[method] += 1
+        if method == "sui_getLatestCheckpointSequenceNumber":
+            return str(max(self._checkpoints()))
+        if method == "sui_getCheckpoints":
+            cursor, limit, _ = params
+            return self._page(cursor, limit)
+        if method == "sui_multiGetTransactionBlocks":
+            digests, _ = params
+            byDigest = {transaction["digest"]: transaction for transaction in self.transactions}
+            return [
+                {"digest": digest, "balanceChanges": byDigest[digest]["balanceChanges"]}
+                for digest in digests
+            ]
+        raise AssertionError(f"unexpected call to {method}")
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        calls = [body] if isinstance(body, dict) else body
+        responses = [
+            {"jsonrpc": "2.0", "id": call["id"], "result": self._result(call["method"], call["params"])}
+            for call in calls
+        ]
+        return web.json_response(responses[0] if isinstance(body, dict) else responses)
+
+
+@pytest.fixture
+def recording():
+    with open(RECORDING) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    """Every wallet address whose owner the ingester put on the deposit queue, once per deposit"""
+    addresses = []
+    enqueue = deposits.enqueue_deposits
+
+    async def enqueue_deposits(session, userUids):
+        db_result = await session.exec(select(UserWallet.address).where(UserWallet.userUid.in_(userUids)))
+        addresses.extend(db_result.all())
+        return await enqueue(session, userUids)
+
+    monkeypatch.setattr(deposits, "enqueue_deposits", enqueue_deposits)
+    monkeypatch.setattr(deposits, "process_deposit_queue_later", lambda: None)
+    return addresses
+
+
+async def seed_wallets(recording: dict, others: int = 0) -> None:
+    """A user with a wallet for every recorded address, plus `others` users whose wallets get nothing"""
+    addresses = dict(recording["addresses"])
+    addresses.update({f"other-{index}": f"0x{index:064x}" for index in range(others)})
+    async with get_session_context() as session:
+        for index, (name, address) in enumerate(addresses.items()):
+            user = User(userId=name, firstName=name)
+            session.add(user)
+            await session.flush()
+            session.add(UserWallet(userUid=user.uid, address=address, phrase=f"phrase-{index}", privateKey=f"key-{index}"))
+        await session.commit()
+
+
+async def ingest(node: RecordedNode, **options) -> int:
+    app = web.Application()
+    app.router.add_post("/", node.handle)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        # a new ingester every time, as after a worker restart
+        ingester = DepositIngester(SUIRequests(url=str(server.make_url("/"))), **options)
+        return await ingester.run()
+    finally:
+        await http_client.close()
+        await server.close()
+
+
+async def queue_entries() -> int:
+    async with get_session_context() as session:
+        db_result = await session.exec(select(DepositQueue))
+        return len(db_result.all())
+
+
+def test_ingester_starts_at_the_tip(db, redis, recording, queued):
+    db(seed_wallets(recording))
+    node = RecordedNode(recording, visible=recording["history"])
+
+    # deposits from before the first run are left to the reconciliation sweep
+    assert db(ingest(node)) == 0
+    assert db(ingest(node)) == 0
+    assert queued == []
+
+
+def test_ingester_enqueues_every_deposit_once(db, redis, recording, queued):
+    db(seed_wallets(recording))
+    alice, bob = recording["addresses"]["alice"], recording["addresses"]["bob"]
+    node = RecordedNode(recording, visible=recording["history"])
+    db(ingest(node))
+
+    node.visible = len(recording["transactions"])
+    # one checkpoint per page, bob's usdc transfer and a sweep out of alice's wallet are no deposits
+    assert db(ingest(node, batchSize=1)) == 3
+    assert sorted(queued) == sorted([alice, alice, bob])
+    assert db(queue_entries()) == 2
+
+    assert db(ingest(node, batchSize=1)) == 0
+    assert len(queued) == 3
+
+
+def test_ingester_enqueues_once_across_restarts(db, redis, recording, queued, monkeypatch):
+    db(seed_wallets(recording))
+    alice = recording["addresses"]["alice"]
+    node = RecordedNode(recording, visible=recording["history"])
+    db(ingest(node))
+    node.visible = len(recording["transactions"])
+
+    # the worker dies after queueing the first page but before moving the cursor past it
+    set_checkpoint = deposits.set_deposit_checkpoint
+
+    async def crash(checkpoint):
+        raise ConnectionError("worker lost")
+
+    monkeypatch.setattr(deposits, "set_deposit_checkpoint", crash)
+    with pytest.raises(ConnectionError):
+        db(ingest(node, batchSize=1))
+    assert queued == [alice]
+    monkeypatch.setattr(deposits, "set_deposit_checkpoint", set_checkpoint)
+
+    # the restarted worker reads the same page again without queueing its deposit twice
+    assert db(ingest(node, batchSize=1)) == 2
+    assert db(ingest(node, batchSize=1)) == 0
+    assert sorted(queued) == sorted([alice, alice, recording["addresses"]["bob"]])
+
+
+def test_ingester_retries_a_failed_queue_write(db, redis, recording, queued, monkeypatch):
+    db(seed_wallets(recording))
+    node = RecordedNode(recording, visible=recording["history"])
+    db(ingest(node))
+    node.visible = len(recording["transactions"])
+
+    enqueue = deposits.enqueue_deposits
+
+    async def unavailable(session, userUids):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(deposits, "enqueue_deposits", unavailable)
+    with pytest.raises(ConnectionError):
+        db(ingest(node))
+    monkeypatch.setattr(deposits, "enqueue_deposits", enqueue)
+
+    # the claims were released with the failed write, so the deposits are queued on the next run
+    assert db(ingest(node)) == 3
+
+
+def test_ingester_calls_follow_checkpoints_not_wallets(db, redis, recording, queued):
+    db(seed_wallets(recording, others=120))
+    node = RecordedNode(recording, visible=recording["history"])
+    db(ingest(node))
+
+    node.visible = len(recording["transactions"])
+    node.calls.clear()
+    assert db(ingest(node)) == 3
+    # one page of checkpoints and one batch of their transactions, however many wallets there are
+    assert node.calls == {"sui_getCheckpoints": 1, "sui_multiGetTransactionBlocks": 1}
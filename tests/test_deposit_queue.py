@@ -0,0 +1,82 @@
+import asyncio
+from decimal import Decimal
+
+from sqlmodel import select
+
+from src.apps.accounts.deposits import DepositQueueWorker, enqueue_deposits
+from src.apps.accounts.models import DepositQueue, User, UserWallet
+from src.apps.accounts.services import UserServices
+from src.db.engine import get_session_context, pool_capacity
+
+
+async def seed_queue(count: int):
+    async with get_session_context() as session:
+        uids = []
+        for index in range(count):
+            user = User(userId=f"user-{index}", firstName="user")
+            session.add(user)
+            await session.flush()
+            session.add(UserWallet(
+                userUid=user.uid, address=f"0x{index:064x}", phrase=f"phrase-{index}", privateKey=f"key-{index}"
+            ))
+            uids.append(user.uid)
+        await session.flush()
+        await enqueue_deposits(session, uids)
+        await session.commit()
+        return uids
+
+
+async def queue():
+    async with get_session_context() as session:
+        db_result = await session.exec(select(DepositQueue))
+        return {entry.userUid: entry.attempts for entry in db_result.all()}
+
+
+def balance_of(amount):
+    async def _get_user_balance(self, address):
+        return amount
+    return _get_user_balance
+
+
+def test_failed_balance_lookup_keeps_the_entry(db, redis, monkeypatch):
+    uids = db(seed_queue(1))
+    monkeypatch.setattr(UserServices, "_get_user_balance", balance_of(None))
+
+    assert db(DepositQueueWorker().process_one()) is False
+
+    # the entry waits for another attempt instead of being dropped with the deposit
+    assert db(queue()) == {uids[0]: 1}
+
+
+def test_empty_wallet_clears_the_entry(db, redis, monkeypatch):
+    db(seed_queue(1))
+    monkeypatch.setattr(UserServices, "_get_user_balance", balance_of(Decimal(0)))
+
+    assert db(DepositQueueWorker().process_one()) is False
+    assert db(queue()) == {}
+
+
+def test_concurrent_claimers_stake_every_entry_once(db, redis, monkeypatch):
+    uids = db(seed_queue(12))
+    staked = []
+
+    async def stake_sui(self, user, session):
+        staked.append(user.uid)
+        # hold the claim for a while so the other claimers have to skip it
+        await asyncio.sleep(0.01)
+        await session.commit()
+        return True
+
+    monkeypatch.setattr(UserServices, "stake_sui", stake_sui)
+
+    assert db(DepositQueueWorker(concurrency=4).drain()) == 12
+    assert sorted(staked) == sorted(uids)
+    assert db(queue()) == {}
+
+
+def test_concurrency_is_capped_at_the_pool(monkeypatch):
+    from src.config.settings import Config
+
+    monkeypatch.setattr(Config, "PROCESS_ROLE", "worker")
+    assert DepositQueueWorker(concurrency=100).concurrency == pool_capacity("worker")
+    assert DepositQueueWorker(concurrency=2).concurrency == 2
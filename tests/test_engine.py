@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.config.settings import Config
+from src.db import engine as db_engine
+from src.db.engine import engine_options, pool_capacity
+
+
+def test_pool_is_sized_per_process_role():
+    for role, (poolSize, maxOverflow) in db_engine.POOL_SIZES.items():
+        options = engine_options(role)
+        assert (options["pool_size"], options["max_overflow"]) == (poolSize, maxOverflow)
+        assert pool_capacity(role) == poolSize + maxOverflow
+        assert options["connect_args"]["server_settings"]["application_name"] == f"suibison-{role}"
+
+
+def test_unknown_role_is_rejected():
+    with pytest.raises(ValueError):
+        engine_options("scheduler")
+
+
+def test_search_path_is_only_sent_with_a_schema(monkeypatch):
+    monkeypatch.setattr(Config, "SCHEMA", None)
+    assert "search_path" not in engine_options("web")["connect_args"]["server_settings"]
+
+    monkeypatch.setattr(Config, "SCHEMA", "tenant")
+    assert engine_options("web")["connect_args"]["server_settings"]["search_path"] == "tenant"
+
+
+def test_connections_start_with_the_role_settings(db, monkeypatch):
+    monkeypatch.setattr(Config, "SCHEMA", "tenant")
+
+    async def settings():
+        roleEngine = create_async_engine(Config.DATABASE_URL, **engine_options("worker"))
+        try:
+            async with roleEngine.connect() as conn:
+                searchPath = (await conn.execute(text("SHOW search_path"))).scalar()
+                applicationName = (await conn.execute(text("SHOW application_name"))).scalar()
+                return searchPath, applicationName
+        finally:
+            await roleEngine.dispose()
+
+    assert db(settings()) == ("tenant", "suibison-worker")
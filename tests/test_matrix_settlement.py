@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import event
+from sqlmodel import select
+
+from src.apps.accounts.enum import ActivityType
+from src.apps.accounts.matrix import MatrixPoolSettlement
+from src.apps.accounts.models import Activities, MatrixPool, MatrixPoolUsers, User, UserWallet
+from src.db.engine import engine, get_session_context
+
+NOW = datetime(2026, 1, 8)
+
+
+async def seed_pool(referrals, raised: Decimal, endDate: datetime):
+    """A pool raising `raised` with one participant per entry of `referrals`, returns the pool uid"""
+    async with get_session_context() as session:
+        pool = MatrixPool(raisedPoolAmount=raised, startDate=endDate - timedelta(days=7), endDate=endDate)
+        session.add(pool)
+        for index, referralsAdded in enumerate(referrals):
+            user = User(userId=f"user-{index}", firstName="user")
+            session.add(user)
+            await session.flush()
+            session.add(UserWallet(
+                userUid=user.uid, address=f"0x{index:064x}", phrase=f"phrase-{index}", privateKey=f"key-{index}"
+            ))
+            session.add(MatrixPoolUsers(matrixPoolUid=pool.uid, userId=user.userId, referralsAdded=referralsAdded))
+        await session.commit()
+        return pool.uid
+
+
+async def earnings():
+    async with get_session_context() as session:
+        db_result = await session.exec(
+            select(User.userId, UserWallet.earnings).join(UserWallet, UserWallet.userUid == User.uid)
+        )
+        return dict(db_result.all())
+
+
+async def payouts():
+    async with get_session_context() as session:
+        db_result = await session.exec(select(Activities).where(Activities.activityType == ActivityType.MATRIXPOOL))
+        return len(db_result.all())
+
+
+def test_ended_pool_is_paid_out_once_by_share(db):
+    poolUid = db(seed_pool([1, 3], Decimal(100), NOW - timedelta(days=1)))
+
+    assert db(MatrixPoolSettlement().run(NOW)) == 2
+    assert db(earnings()) == {"user-0": Decimal(25), "user-1": Decimal(75)}
+    assert db(payouts()) == 2
+
+    # a settled pool is skipped by later runs and direct settles
+    assert db(MatrixPoolSettlement().run(NOW)) == 0
+    assert db(MatrixPoolSettlement().settle(poolUid, NOW)) == 0
+    assert db(earnings()) == {"user-0": Decimal(25), "user-1": Decimal(75)}
+
+
+def test_active_pool_shares_are_refreshed_without_paying(db):
+    db(seed_pool([1, 1, 2], Decimal(40), NOW + timedelta(days=3)))
+
+    assert db(MatrixPoolSettlement().run(NOW)) == 0
+
+    async def shares():
+        async with get_session_context() as session:
+            db_result = await session.exec(select(MatrixPoolUsers.matrixShare).order_by(MatrixPoolUsers.referralsAdded))
+            return db_result.all()
+
+    assert db(shares()) == [Decimal("25.00"), Decimal("25.00"), Decimal("50.00")]
+    assert db(earnings()) == {"user-0": 0, "user-1": 0, "user-2": 0}
+
+
+def test_settlement_never_loads_the_participants(db):
+    db(seed_pool([1, 2], Decimal(30), NOW + timedelta(days=3)))
+    db(seed_pool([], Decimal(0), NOW - timedelta(days=1)))
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        db(MatrixPoolSettlement().run(NOW))
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+    # the `users` relationship is selectin loaded by default, with one SELECT of every participant row
+    assert not [statement for statement in statements if "AS matrix_users_uid" in statement]
@@ -0,0 +1,101 @@
+from decimal import Decimal
+
+from sqlalchemy import update
+from sqlmodel import select
+
+from src.apps.accounts.enum import ActivityType
+from src.apps.accounts.models import Activities, User, UserStaking
+from src.apps.accounts.referrals import (
+    REDEPOSIT_DETAIL,
+    ReferralCounterReconciler,
+    add_referral_stake,
+    add_to_referral_tree,
+)
+from src.db.engine import get_session_context
+
+
+async def build_star(stakes):
+    """A root with one level 1 referral per entry of `stakes`, each staked the way `stake_sui` does"""
+    async with get_session_context() as session:
+        root = User(userId="root", firstName="root")
+        session.add(root)
+        await session.flush()
+        session.add(UserStaking(userUid=root.uid))
+        await add_to_referral_tree(root, None, session)
+        for index, amount in enumerate(stakes):
+            user = User(userId=f"user-{index}", firstName="user", referrer_id=root.uid)
+            session.add(user)
+            await session.flush()
+            session.add(UserStaking(userUid=user.uid, deposit=amount))
+            await add_to_referral_tree(user, root.uid, session)
+            await add_referral_stake(root.uid, Decimal(0), amount, session)
+        await session.commit()
+        return root.uid
+
+
+async def redeposit(userId: str, amount: Decimal):
+    """Puts part of a withdrawal back into the stake the way `withdrawToUserWallet` does"""
+    async with get_session_context() as session:
+        user = (await session.exec(select(User).where(User.userId == userId))).one()
+        staking = (await session.exec(select(UserStaking).where(UserStaking.userUid == user.uid))).one()
+        staking.deposit += amount
+        session.add(Activities(
+            activityType=ActivityType.DEPOSIT, strDetail=REDEPOSIT_DETAIL, suiAmount=amount, userUid=user.uid
+        ))
+        await session.commit()
+
+
+async def reconcile(repair: bool = True, batchSize: int = 100):
+    async with get_session_context() as session:
+        return await ReferralCounterReconciler(batchSize).run(session, repair)
+
+
+async def counters(uid):
+    async with get_session_context() as session:
+        user = await session.get(User, uid)
+        return user.totalReferrals, user.paidReferrals, user.referralsDeposit
+
+
+def test_kept_counters_match_the_recount(db, redis):
+    rootUid = db(build_star([Decimal("0.5"), Decimal(2), Decimal(3)]))
+    # a redeposit grows the stake without adding to the referrer's referralsDeposit
+    db(redeposit("user-1", Decimal(1)))
+
+    audit = db(reconcile(repair=False))
+
+    assert audit.checked == 4
+    assert audit.mismatchedUserIds == []
+    assert db(counters(rootUid)) == (3, 2, Decimal("5.5"))
+
+
+def test_drifted_counters_are_reported_and_repaired(db, redis):
+    rootUid = db(build_star([Decimal("0.5"), Decimal(2)]))
+
+    async def drift():
+        async with get_session_context() as session:
+            await session.execute(
+                update(User).where(User.uid == rootUid).values(paidReferrals=0, referralsDeposit=Decimal(9))
+            )
+            await session.commit()
+
+    db(drift())
+
+    audit = db(reconcile(repair=False))
+    assert audit.mismatchedUserIds == ["root"]
+    assert db(counters(rootUid)) == (2, 0, Decimal(9))
+
+    audit = db(reconcile())
+    assert audit.mismatchedUserIds == ["root"]
+    assert db(counters(rootUid)) == (2, 1, Decimal("2.5"))
+    assert db(reconcile()).mismatched == 0
+
+
+def test_runs_page_through_every_user_and_wrap_around(db, redis):
+    db(build_star([Decimal(1)] * 4))
+
+    pages = [db(reconcile(batchSize=2)) for _ in range(4)]
+
+    assert [page.checked for page in pages] == [2, 2, 1, 2]
+    assert pages[0].cursor is not None and pages[1].cursor is not None
+    # the short page reached the last user, so the next run starts over
+    assert pages[2].cursor is None
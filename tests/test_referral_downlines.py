@@ -0,0 +1,100 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.apps.accounts.models import User
+from src.apps.accounts.referrals import (
+    add_to_referral_tree,
+    decode_downline_cursor,
+    encode_downline_cursor,
+    get_downline_page,
+)
+from src.db.engine import get_session_context
+from src.errors import InvalidCursor
+
+
+def test_downline_cursor_round_trip():
+    joined = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    uid = uuid.uuid4()
+
+    assert decode_downline_cursor(encode_downline_cursor(joined, uid)) == (joined, uid)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_downline_cursor(datetime(2024, 5, 1), uuid.uuid4())[:-4]])
+def test_downline_cursor_rejects_garbage(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_downline_cursor(cursor)
+
+
+async def build_tree(directs: int, grandchildren: int):
+    """A root user with `directs` level 1 referrals, the first of which refers `grandchildren` more"""
+    started = datetime(2024, 1, 1)
+    async with get_session_context() as session:
+        root = User(userId="root", firstName="root", joined=started)
+        session.add(root)
+        await session.flush()
+        await add_to_referral_tree(root, None, session)
+
+        children = []
+        for index in range(directs):
+            child = User(
+                userId=f"child-{index}", firstName="child", referrer_id=root.uid, joined=started + timedelta(minutes=index)
+            )
+            session.add(child)
+            await session.flush()
+            await add_to_referral_tree(child, root.uid, session)
+            children.append(child)
+
+        for index in range(grandchildren):
+            grandchild = User(
+                userId=f"grandchild-{index}",
+                firstName="grandchild",
+                referrer_id=children[0].uid,
+                joined=started + timedelta(hours=1, minutes=index),
+            )
+            session.add(grandchild)
+            await session.flush()
+            await add_to_referral_tree(grandchild, children[0].uid, session)
+        await session.commit()
+        return root.uid
+
+
+async def page_through(rootUid: uuid.UUID, level: int, size: int):
+    pages = []
+    cursor = None
+    async with get_session_context() as session:
+        while True:
+            page = await get_downline_page(rootUid, level, session, cursor=cursor, size=size)
+            pages.append(page)
+            cursor = page.nextCursor
+            if cursor is None:
+                return pages
+
+
+def test_get_downline_page_walks_every_level_1_downline_once(db):
+    rootUid = db(build_tree(directs=7, grandchildren=0))
+
+    pages = db(page_through(rootUid, level=1, size=3))
+
+    assert [len(page.items) for page in pages] == [3, 3, 1]
+    assert [user.userId for page in pages for user in page.items] == [f"child-{index}" for index in range(7)]
+    assert {page.total for page in pages} == {7}
+
+
+def test_get_downline_page_deeper_levels(db):
+    rootUid = db(build_tree(directs=2, grandchildren=5))
+
+    pages = db(page_through(rootUid, level=2, size=2))
+
+    assert [user.userId for page in pages for user in page.items] == [f"grandchild-{index}" for index in range(5)]
+    assert {page.total for page in pages} == {5}
+
+
+def test_get_downline_page_last_full_page_has_no_cursor(db):
+    rootUid = db(build_tree(directs=4, grandchildren=0))
+
+    pages = db(page_through(rootUid, level=1, size=2))
+
+    assert [len(page.items) for page in pages] == [2, 2]
+    assert pages[-1].nextCursor is None
@@ -0,0 +1,129 @@
+from decimal import Decimal
+
+from sqlalchemy import text, update
+from sqlmodel import select
+
+from src.apps.accounts import tree
+from src.apps.accounts.enum import ActivityType
+from src.apps.accounts.models import Activities, User, UserStaking
+from src.apps.accounts.referrals import REDEPOSIT_DETAIL, add_referral_stake, add_to_referral_tree, propagate_team_volume
+from src.apps.accounts.tree import ReferralTreeAuditor
+from src.apps.accounts.views import delete_a_user
+from src.db.engine import get_session_context
+from src.db.redis import cache_referral_summary, get_cached_referral_summary
+
+
+async def build_chain(length: int):
+    """`length` users each referred by the one before, with a staking account, top down"""
+    uids = []
+    async with get_session_context() as session:
+        for index in range(length):
+            user = User(userId=f"user-{index}", firstName="user", referrer_id=uids[-1] if uids else None)
+            session.add(user)
+            await session.flush()
+            session.add(UserStaking(userUid=user.uid))
+            await add_to_referral_tree(user, user.referrer_id, session)
+            uids.append(user.uid)
+        await session.commit()
+    return uids
+
+
+async def stake(uid, amount: Decimal):
+    """Credits a stake the way `stake_sui` does"""
+    async with get_session_context() as session:
+        user = await session.get(User, uid)
+        staking = (await session.exec(select(UserStaking).where(UserStaking.userUid == uid))).one()
+        stakedBefore = staking.deposit
+        staking.deposit += amount
+        if user.referrer_id:
+            await add_referral_stake(user.referrer_id, stakedBefore, amount, session)
+            await propagate_team_volume([(uid, amount)], session)
+        await session.commit()
+
+
+async def redeposit(uid, amount: Decimal):
+    """Puts part of a withdrawal back into the stake the way `withdrawToUserWallet` does"""
+    async with get_session_context() as session:
+        staking = (await session.exec(select(UserStaking).where(UserStaking.userUid == uid))).one()
+        staking.deposit += amount
+        session.add(Activities(
+            activityType=ActivityType.DEPOSIT, strDetail=REDEPOSIT_DETAIL, suiAmount=amount, userUid=uid
+        ))
+        await session.commit()
+
+
+async def audit(repair: bool = False):
+    async with get_session_context() as session:
+        # the admin endpoint's session has already begun its transaction
+        await session.exec(select(User.uid).limit(1))
+        return await ReferralTreeAuditor().run(session, repair)
+
+
+async def shift_team_volume(uid, amount: Decimal):
+    async with get_session_context() as session:
+        await session.execute(update(User).where(User.uid == uid).values(totalTeamVolume=User.totalTeamVolume + amount))
+        await session.commit()
+
+
+def test_audit_finds_no_drift_in_kept_counters(db):
+    uids = db(build_chain(8))
+    db(stake(uids[7], Decimal("10")))
+    db(stake(uids[3], Decimal("2.5")))
+    db(stake(uids[3], Decimal("1.25")))
+    db(redeposit(uids[7], Decimal("4")))
+
+    result = db(audit())
+
+    assert result.checked == 8
+    assert result.mismatched == 0
+
+
+def test_audit_repairs_team_volume(db):
+    uids = db(build_chain(8))
+    db(stake(uids[7], Decimal("10")))
+    # volume lost with a write that never happened, and some that was never staked
+    db(shift_team_volume(uids[4], Decimal("-10")))
+    db(shift_team_volume(uids[1], Decimal("3")))
+
+    result = db(audit(repair=True))
+
+    assert result.mismatchedCounters == {"totalTeamVolume": 2}
+    assert sorted(result.mismatchedUserIds) == ["user-1", "user-4"]
+    assert db(audit()).mismatched == 0
+
+
+def test_snapshot_reads_one_repeatable_read_snapshot(db, monkeypatch):
+    db(build_chain(3))
+    levels = []
+    stream = tree.stream_keyset
+
+    async def stream_keyset(query, key, session=None, **options):
+        db_result = await session.execute(text("SHOW transaction_isolation"))
+        levels.append(db_result.scalar())
+        async for rows in stream(query, key, session, **options):
+            yield rows
+
+    monkeypatch.setattr(tree, "stream_keyset", stream_keyset)
+    db(audit())
+
+    assert levels == ["repeatable read"]
+
+
+async def delete_user(userId: str):
+    async with get_session_context() as session:
+        await delete_a_user(userId, session)
+
+
+def test_deleting_a_user_takes_them_out_of_every_uplines_counters(db, redis):
+    uids = db(build_chain(8))
+    db(stake(uids[6], Decimal("3")))
+    db(stake(uids[7], Decimal("10")))
+    db(redeposit(uids[7], Decimal("4")))
+    db(cache_referral_summary("user-0", {}))
+    db(cache_referral_summary("user-5", {}))
+
+    db(delete_user("user-7"))
+
+    assert db(audit()).mismatched == 0
+    assert db(get_cached_referral_summary("user-0")) is None
+    assert db(get_cached_referral_summary("user-5")) is None
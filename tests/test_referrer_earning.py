@@ -0,0 +1,113 @@
+from decimal import Decimal
+
+from sqlalchemy import delete, update
+from sqlmodel import select
+
+from src.apps.accounts.enum import ActivityType
+from src.apps.accounts.models import Activities, User, UserReferral, UserStaking, UserWallet
+from src.apps.accounts.referrals import add_to_referral_tree
+from src.apps.accounts.services import UserServices
+from src.db.engine import get_session_context
+
+
+async def build_chain(length: int):
+    """`length` users each referred by the one before, with a wallet and a stake of 10, top down"""
+    uids = []
+    async with get_session_context() as session:
+        for index in range(length):
+            user = User(userId=f"user-{index}", firstName="user", referrer_id=uids[-1] if uids else None)
+            session.add(user)
+            await session.flush()
+            session.add(UserStaking(userUid=user.uid, deposit=Decimal(10)))
+            session.add(UserWallet(
+                userUid=user.uid, address=f"0x{index:064x}", phrase=f"phrase-{index}", privateKey=f"key-{index}"
+            ))
+            await add_to_referral_tree(user, user.referrer_id, session)
+            uids.append(user.uid)
+        await session.commit()
+    return uids
+
+
+async def pay(uid, amount: Decimal):
+    async with get_session_context() as session:
+        referral = await session.get(User, uid)
+        uplineUserIds = await UserServices().add_referrer_earning(referral, amount, session)
+        await session.commit()
+        return uplineUserIds
+
+
+async def earnings():
+    async with get_session_context() as session:
+        db_result = await session.exec(
+            select(User.userId, UserWallet.totalReferralBonus).join(UserWallet, UserWallet.userUid == User.uid)
+        )
+        return {userId: bonus for userId, bonus in db_result.all() if bonus}
+
+
+async def referral_records(theirUserId: str):
+    async with get_session_context() as session:
+        db_result = await session.exec(select(UserReferral).where(UserReferral.theirUserId == theirUserId))
+        return {record.userId: (record.stake, record.reward) for record in db_result.all() if record.reward}
+
+
+def test_bonus_is_paid_five_levels_up(db):
+    uids = db(build_chain(7))
+
+    uplineUserIds = db(pay(uids[6], Decimal(100)))
+
+    assert uplineUserIds == ["user-5", "user-4", "user-3", "user-2", "user-1"]
+    assert db(earnings()) == {
+        "user-5": Decimal(10), "user-4": Decimal(5), "user-3": Decimal(3), "user-2": Decimal(2), "user-1": Decimal(1)
+    }
+    assert db(referral_records("user-6"))["user-5"] == (Decimal(100), Decimal(10))
+
+    async def bonuses():
+        async with get_session_context() as session:
+            db_result = await session.exec(select(Activities).where(Activities.activityType == ActivityType.REFERRAL))
+            return len(db_result.all())
+
+    assert db(bonuses()) == 5
+
+
+def test_payout_stops_at_a_missing_referral_record(db):
+    uids = db(build_chain(7))
+
+    async def drop_record():
+        async with get_session_context() as session:
+            await session.execute(
+                delete(UserReferral).where(UserReferral.userId == "user-3").where(UserReferral.theirUserId == "user-6")
+            )
+            await session.commit()
+
+    db(drop_record())
+
+    assert db(pay(uids[6], Decimal(100))) == ["user-5", "user-4"]
+    assert db(earnings()) == {"user-5": Decimal(10), "user-4": Decimal(5)}
+
+
+def test_speed_boost_is_granted_once(db):
+    uids = db(build_chain(3))
+
+    async def referrals_staked(uid, amount: Decimal):
+        async with get_session_context() as session:
+            await session.execute(update(User).where(User.uid == uid).values(referralsDeposit=amount))
+            await session.commit()
+
+    async def boost(uid):
+        async with get_session_context() as session:
+            user = await session.get(User, uid)
+            staking = (await session.exec(select(UserStaking).where(UserStaking.userUid == uid))).one()
+            return user.usedSpeedBoost, staking.roi
+
+    # the referrer's level 1 referrals have staked twice their own stake, their referrer's have not
+    db(referrals_staked(uids[1], Decimal(20)))
+    usedBefore, roiBefore = db(boost(uids[1]))
+
+    db(pay(uids[2], Decimal(5)))
+    used, roi = db(boost(uids[1]))
+    assert not usedBefore and used
+    assert roi > roiBefore
+    assert db(boost(uids[0]))[0] is False
+
+    db(pay(uids[2], Decimal(5)))
+    assert db(boost(uids[1])) == (True, roi)
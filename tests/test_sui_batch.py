@@ -0,0 +1,95 @@
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.utils.http import http_client
+from src.utils.sui_json_rpc_apis import SUIRequests
+
+
+class StubNode:
+    """
+    JSON-RPC node answering `suix_getBalance` batches in reverse order. Addresses starting with
+    `bad` get an error entry, `gone` gets no entry at all and a batch holding `down` fails with a 500.
+    """
+
+    def __init__(self) -> None:
+        self.batches = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        batch = await request.json()
+        self.batches.append(batch)
+        addresses = [call["params"][0] for call in batch]
+        if "down" in addresses:
+            return web.Response(status=500)
+
+        responses = []
+        for call in reversed(batch):
+            address = call["params"][0]
+            if address.startswith("bad"):
+                responses.append({"jsonrpc": "2.0", "id": call["id"], "error": {"code": -32602, "message": "invalid"}})
+            elif address != "gone":
+                responses.append({"jsonrpc": "2.0", "id": call["id"], "result": balance(address)})
+        return web.json_response(responses)
+
+
+def balance(address: str) -> dict:
+    return {
+        "coinType": "0x2::sui::SUI",
+        "coinObjectCount": 1,
+        "totalBalance": str(len(address) * 10**9),
+        "lockedBalance": {},
+    }
+
+
+async def call_node(node: StubNode, call):
+    app = web.Application()
+    app.router.add_post("/", node.handle)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        return await call(SUIRequests(url=str(server.make_url("/"))))
+    finally:
+        await http_client.close()
+        await server.close()
+
+
+def test_batch_call_splits_into_chunks(run):
+    node = StubNode()
+    params = [[f"0x{index}", "0x2::sui::SUI"] for index in range(5)]
+
+    results = run(call_node(node, lambda sui: sui.batchCall("suix_getBalance", params, chunkSize=2)))
+
+    assert [len(batch) for batch in node.batches] == [2, 2, 1]
+    assert [call["params"] for batch in node.batches for call in batch] == params
+    assert results == [balance(address) for address, _ in params]
+
+
+def test_batch_call_matches_out_of_order_responses_by_id(run):
+    node = StubNode()
+    params = [["0x1", "0x2::sui::SUI"], ["0x22", "0x2::sui::SUI"], ["0x333", "0x2::sui::SUI"]]
+
+    results = run(call_node(node, lambda sui: sui.batchCall("suix_getBalance", params)))
+
+    assert [result["totalBalance"] for result in results] == ["3000000000", "4000000000", "5000000000"]
+
+
+def test_batch_call_yields_none_for_failed_calls(run):
+    node = StubNode()
+    addresses = ["0x1", "bad1", "gone", "0x22", "down", "0x333"]
+    params = [[address, "0x2::sui::SUI"] for address in addresses]
+
+    results = run(call_node(node, lambda sui: sui.batchCall("suix_getBalance", params, chunkSize=4)))
+
+    # the error entry and the missing one fail alone, the 500 fails its whole chunk
+    assert results == [balance("0x1"), None, None, balance("0x22"), None, None]
+
+
+def test_get_balances_maps_addresses(run):
+    node = StubNode()
+    addresses = ["0x1", "bad1", "0x333"]
+
+    balances = run(call_node(node, lambda sui: sui.getBalances(addresses, chunkSize=2)))
+
+    assert list(balances) == addresses
+    assert balances["0x1"].totalBalance == "3000000000"
+    assert balances["bad1"] is None
+    assert balances["0x333"].totalBalance == "5000000000"
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+from sqlmodel import select
+
+import src.db.redis
+from src.apps.accounts import deposits
+from src.apps.accounts.deposits import DepositPoller
+from src.apps.accounts.models import User
+from src.apps.accounts.schemas import CoinBalance
+from src.apps.accounts.sweeps import ShardedSweep, lease, run_exclusive
+from src.db.engine import get_session_context
+from src.db.redis import get_sweep_cursor
+from src.errors import LeaseLost
+
+
+def test_lease_skips_a_job_still_running(run, redis):
+    ran = []
+
+    async def job():
+        ran.append(await run_exclusive("job", lambda: asyncio.sleep(0)))
+
+    async def overlapping():
+        async with lease("job") as acquired:
+            assert acquired
+            await job()
+
+    run(overlapping())
+    assert ran == [False]
+
+
+def test_lost_lease_stops_the_job(run, redis):
+    committed = []
+
+    async def job():
+        async with lease("job", ttl=1):
+            # another worker takes the lease over while this run is still going
+            await src.db.redis.redis_client.set("lease:job", "someone-else")
+            await asyncio.sleep(2)
+            committed.append(True)
+
+    with pytest.raises(LeaseLost):
+        run(job())
+    assert committed == []
+
+
+async def seed_users(count: int):
+    async with get_session_context() as session:
+        session.add_all([User(userId=f"user-{index}", firstName="user") for index in range(count)])
+        await session.commit()
+
+
+def test_run_shard_hands_every_page_to_one_call(db, redis):
+    db(seed_users(7))
+    sweep = ShardedSweep("test", shards=1, pageSize=3)
+    calls = []
+    cursors = []
+
+    async def process(pages, pageDone):
+        calls.append([])
+        async for page in pages:
+            calls[-1].append(len(page))
+            await pageDone(page)
+            cursors.append(await get_sweep_cursor("test", 0))
+
+    assert db(sweep.run_shard(0, select(User.uid), process)) == 7
+    assert calls == [[3, 3, 1]]
+    assert len(set(cursors)) == 3
+    # a finished shard starts over on its next run
+    assert db(get_sweep_cursor("test", 0)) is None
+
+
+def test_run_shard_resumes_after_the_last_page_done(db, redis):
+    db(seed_users(7))
+    sweep = ShardedSweep("test", shards=1, pageSize=3)
+    seen = []
+
+    async def crash(pages, pageDone):
+        async for page in pages:
+            seen.extend(row.uid for row in page)
+            await pageDone(page)
+            raise ConnectionError("worker lost")
+
+    async def process(pages, pageDone):
+        async for page in pages:
+            seen.extend(row.uid for row in page)
+            await pageDone(page)
+
+    with pytest.raises(ConnectionError):
+        db(sweep.run_shard(0, select(User.uid), crash))
+    assert db(sweep.run_shard(0, select(User.uid), process)) == 4
+    assert len(seen) == len(set(seen)) == 7
+
+
+class StubNode:
+    """Balances of 0 for every address, each batch lookup taking a little while"""
+
+    def __init__(self) -> None:
+        self.inFlight = 0
+        self.mostInFlight = 0
+        self.checkpointReads = 0
+
+    async def getLatestCheckpoint(self) -> int:
+        self.checkpointReads += 1
+        return 1
+
+    async def getBalances(self, addresses):
+        self.inFlight += 1
+        self.mostInFlight = max(self.mostInFlight, self.inFlight)
+        await asyncio.sleep(0.01)
+        self.inFlight -= 1
+        balance = {"coinType": "0x2::sui::SUI", "coinObjectCount": 0, "totalBalance": "0", "lockedBalance": {}}
+        return {address: CoinBalance(**balance) for address in addresses}
+
+
+def test_deposit_sweep_polls_batches_of_many_pages_at_once(run, redis, monkeypatch):
+    node = StubNode()
+    monkeypatch.setattr(deposits, "SUI", node)
+    done = []
+
+    async def pages():
+        for start in range(0, 20, 5):
+            yield [(f"uid-{index}", f"0x{index}") for index in range(start, start + 5)]
+
+    async def pageDone(page):
+        done.append(page[0][1])
+
+    stats = run(DepositPoller(concurrency=8, batchSize=2).sweep(pages(), pageDone))
+
+    assert stats.users == 20
+    # pages of 5 make 3 batches each, the workers poll beyond a single page
+    assert node.mostInFlight > 3
+    assert node.checkpointReads == 1
+    assert done == ["0x0", "0x5", "0x10", "0x15"]
@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+from sqlmodel import select
+
+from src.apps.accounts.models import User
+from src.apps.accounts.referrals import add_to_referral_tree, propagate_team_volume
+from src.db.engine import get_session_context
+
+
+async def build_chain(length: int):
+    """`length` users each referred by the one before, returns their uids from the top down"""
+    uids = []
+    async with get_session_context() as session:
+        for index in range(length):
+            user = User(userId=f"user-{index}", firstName="user", referrer_id=uids[-1] if uids else None)
+            session.add(user)
+            await session.flush()
+            await add_to_referral_tree(user, user.referrer_id, session)
+            uids.append(user.uid)
+        await session.commit()
+    return uids
+
+
+async def propagate(deposits):
+    async with get_session_context() as session:
+        updated = await propagate_team_volume(deposits, session)
+        await session.commit()
+        return updated
+
+
+async def team_volumes():
+    async with get_session_context() as session:
+        db_result = await session.exec(select(User.userId, User.totalTeamVolume))
+        return {row.userId: row.totalTeamVolume for row in db_result.all()}
+
+
+def test_propagate_team_volume_reaches_five_levels(db):
+    uids = db(build_chain(7))
+
+    assert db(propagate([(uids[6], Decimal("9"))])) == 5
+
+    volumes = db(team_volumes())
+    assert [volumes[f"user-{index}"] for index in range(7)] == [0, 9, 9, 9, 9, 9, 0]
+
+
+def test_propagate_team_volume_sums_a_batch_per_upline(db):
+    uids = db(build_chain(4))
+
+    # user-0 is an upline of both depositors, user-2 only of the first
+    db(propagate([(uids[3], Decimal("2.5")), (uids[1], Decimal("1")), (uids[0], Decimal("4"))]))
+
+    volumes = db(team_volumes())
+    assert [volumes[f"user-{index}"] for index in range(4)] == [Decimal("3.5"), Decimal("2.5"), Decimal("2.5"), 0]
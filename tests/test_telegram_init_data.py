@@ -0,0 +1,75 @@
+import hashlib
+import hmac
+import json
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.errors import TelegramAuthDataTokenExpired, UnAuthorizedTelegramAccess
+from src.utils.hashing import TelegramInitDataValidator
+
+BOT_TOKEN = "123456:test-token"
+
+
+def sign(fields: dict, botToken: str = BOT_TOKEN) -> str:
+    secret = hmac.new(b"WebAppData", botToken.encode(), hashlib.sha256).digest()
+    dataCheckString = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    signed = dict(fields, hash=hmac.new(secret, dataCheckString.encode(), hashlib.sha256).hexdigest())
+    return urllib.parse.urlencode(signed, quote_via=urllib.parse.quote)
+
+
+def init_data(userId: int = 42, authDate: int = None, botToken: str = BOT_TOKEN) -> str:
+    fields = {
+        "auth_date": str(authDate or int(time.time())),
+        "query_id": "AAE",
+        "user": json.dumps({"id": userId, "first_name": "Ada"}),
+    }
+    return sign(fields, botToken)
+
+
+def test_accepts_signed_init_data():
+    assert TelegramInitDataValidator(BOT_TOKEN).verify(init_data(), "42")
+
+
+def test_accepts_cached_init_data_again():
+    validator = TelegramInitDataValidator(BOT_TOKEN)
+    data = init_data()
+    assert validator.verify(data, "42")
+    assert validator.verify(data, "42")
+
+
+def test_rejects_another_bots_signature():
+    assert not TelegramInitDataValidator(BOT_TOKEN).verify(init_data(botToken="654321:other"), "42")
+
+
+def test_rejects_altered_fields():
+    validator = TelegramInitDataValidator(BOT_TOKEN)
+    data = init_data()
+    assert validator.verify(data, "42")
+    assert not validator.verify(data.replace("Ada", "Eve"), "42")
+
+
+def test_rejects_missing_hash():
+    data = init_data()
+    unsigned = "&".join(pair for pair in data.split("&") if not pair.startswith("hash="))
+    assert not TelegramInitDataValidator(BOT_TOKEN).verify(unsigned, "42")
+
+
+def test_rejects_another_user():
+    with pytest.raises(UnAuthorizedTelegramAccess):
+        TelegramInitDataValidator(BOT_TOKEN).verify(init_data(userId=42), "43")
+
+
+def test_rejects_init_data_from_an_earlier_day():
+    yesterday = int((datetime.now() - timedelta(days=1)).timestamp())
+    with pytest.raises(TelegramAuthDataTokenExpired):
+        TelegramInitDataValidator(BOT_TOKEN).verify(init_data(authDate=yesterday), "42")
+
+
+def test_cache_is_bounded():
+    validator = TelegramInitDataValidator(BOT_TOKEN, cacheSize=2)
+    for userId in (1, 2, 3):
+        assert validator.verify(init_data(userId=userId), str(userId))
+    assert len(validator._verified) == 2